@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# vim: set ts=4 sw=4 expandtab sts=4 fileencoding=utf-8:
+"""
+Measures how big the caching db gets.
+
+A calendar of single events, open ended daily and weekly events, events on
+every weekday, monthly events and birthdays is inserted into a fresh db, its
+size and the number of rows in the tables holding the events' instances are
+printed. Run this on two checkouts to compare them:
+
+    $ python benchmarks/dbsize.py --events 200
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+
+import pytz
+
+from khal.khalendar import backend
+
+EVENT = u"""BEGIN:VEVENT
+UID:{kind}-{num}
+DTSTART;TZID=Europe/Berlin:2014{month:02d}{day:02d}T{hour:02d}0000
+DTEND;TZID=Europe/Berlin:2014{month:02d}{day:02d}T{hour:02d}3000
+{rrule}
+SUMMARY:{kind} number {num}
+END:VEVENT"""
+
+BIRTHDAY = u"""BEGIN:VEVENT
+UID:{kind}-{num}
+DTSTART;VALUE=DATE:19{year:02d}{month:02d}{day:02d}
+DTEND;VALUE=DATE:19{year:02d}{month:02d}{day2:02d}
+{rrule}
+SUMMARY:Birthday of person number {num}
+END:VEVENT"""
+
+# kind of event, its template and its RRULE
+KINDS = [
+    ('single', EVENT, u''),
+    ('daily', EVENT, u'RRULE:FREQ=DAILY'),
+    ('weekly', EVENT, u'RRULE:FREQ=WEEKLY'),
+    ('weekdays', EVENT, u'RRULE:FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR'),
+    ('monthly', EVENT, u'RRULE:FREQ=MONTHLY'),
+    ('birthday', BIRTHDAY, u'RRULE:FREQ=YEARLY'),
+]
+
+berlin = pytz.timezone('Europe/Berlin')
+locale = {'default_timezone': berlin, 'local_timezone': berlin}
+
+
+def events(count):
+    for kind, template, rrule in KINDS:
+        for num in range(count):
+            yield u'{0}-{1}.ics'.format(kind, num), template.format(
+                kind=kind, rrule=rrule, num=num, year=num % 100,
+                month=num % 12 + 1, day=num % 27 + 1, day2=num % 27 + 2,
+                hour=num % 12 + 8)
+
+
+def count_rows(dbi, table):
+    try:
+        return dbi.sql_ex('SELECT count(*) FROM {0};'.format(table))[0][0]
+    except backend.sqlite3.OperationalError:
+        # older dbs don't have that table
+        return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--events', type=int, default=100,
+                        help='number of events of each kind')
+    parser.add_argument('--expansion-horizon', type=int, default=0,
+                        help='see the [sqlite] expansion_horizon option, '
+                        'defaults to expanding everything')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    dbpath = os.path.join(tmpdir, 'khal.db')
+    try:
+        dbi = backend.SQLiteDb('home', dbpath, locale=locale,
+                               expansion_horizon=args.expansion_horizon)
+        with dbi.at_once():
+            for href, item in events(args.events):
+                dbi.update(item, href=href)
+        dbi.sql_ex('PRAGMA wal_checkpoint(TRUNCATE);')
+        size = os.path.getsize(dbpath)
+        print('{0} events: {1:.1f} MiB'.format(
+            args.events * len(KINDS), size / 1024. / 1024.))
+        for table in ['recs_loc', 'recs_float', 'series']:
+            print('{0:>10}: {1} rows'.format(table, count_rows(dbi, table)))
+    finally:
+        backend.disconnect(dbpath)
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# vim: set ts=4 sw=4 expandtab sts=4 fileencoding=utf-8:
+"""
+Measures how fast events are inserted into the caching db.
+
+A birthday calendar (yearly recurring all day events) and a calendar of
+weekly meetings are inserted into a fresh db, run this on two checkouts to
+compare them:
+
+    $ python benchmarks/ingest.py --events 2000
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import pytz
+
+from khal.khalendar import backend
+
+BIRTHDAY = u"""BEGIN:VEVENT
+UID:birthday-{num}
+DTSTART;VALUE=DATE:19{year:02d}{month:02d}{day:02d}
+DTEND;VALUE=DATE:19{year:02d}{month:02d}{day2:02d}
+RRULE:FREQ=YEARLY
+SUMMARY:Birthday of person number {num}
+END:VEVENT"""
+
+MEETING = u"""BEGIN:VEVENT
+UID:meeting-{num}
+DTSTART;TZID=Europe/Berlin:2014{month:02d}{day:02d}T{hour:02d}0000
+DTEND;TZID=Europe/Berlin:2014{month:02d}{day:02d}T{hour:02d}3000
+RRULE:FREQ=WEEKLY;COUNT=200
+SUMMARY:Meeting number {num}
+END:VEVENT"""
+
+berlin = pytz.timezone('Europe/Berlin')
+locale = {'default_timezone': berlin, 'local_timezone': berlin}
+
+
+def events(template, count):
+    for num in range(count):
+        yield num, template.format(
+            num=num, year=num % 100, month=num % 12 + 1, day=num % 27 + 1,
+            day2=num % 27 + 2, hour=num % 12 + 8)
+
+
+def bench(name, template, count, dbpath, expansion_horizon):
+    dbi = backend.SQLiteDb(name, dbpath, locale=locale,
+                           expansion_horizon=expansion_horizon)
+    items = list(events(template, count))
+    start = time.time()
+    with dbi.at_once():
+        for num, item in items:
+            dbi.update(item, href='{0}-{1}.ics'.format(name, num))
+    duration = time.time() - start
+    rows = 0
+    for table in ['recs_loc', 'recs_float']:
+        if hasattr(backend, 'instances_query'):
+            sql_s, stuple = backend.instances_query([dbi], table)
+        else:
+            # older versions save every instance as a row
+            sql_s, stuple = 'SELECT * FROM {0} WHERE calendar = ?'.format(table), (name, )
+        rows += dbi.sql_ex('SELECT count(*) FROM ({0});'.format(sql_s), stuple)[0][0]
+    print('{0:>10}: {1} events, {2} instances in {3:.2f}s '
+          '({4:.0f} events/s, {5:.0f} instances/s)'.format(
+              name, count, rows, duration, count / duration, rows / duration))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--events', type=int, default=1000,
+                        help='number of events per calendar')
+    parser.add_argument('--expansion-horizon', type=int, default=0,
+                        help='see the [sqlite] expansion_horizon option, '
+                        'defaults to expanding everything')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        dbpath = os.path.join(tmpdir, 'khal.db')
+        bench('birthdays', BIRTHDAY, args.events, dbpath, args.expansion_horizon)
+        bench('meetings', MEETING, args.events, dbpath, args.expansion_horizon)
+    finally:
+        backend.disconnect(os.path.join(tmpdir, 'khal.db'))
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
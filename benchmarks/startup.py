@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# vim: set ts=4 sw=4 expandtab sts=4 fileencoding=utf-8:
+"""
+Measures how long khal takes to start for each command.
+
+Every command is run several times in a fresh interpreter with an empty
+calendar, the fastest run counts. On python 3.7 and newer the slowest imports
+(as reported by `-X importtime`) are listed as well. With --budget, the
+script fails if any command takes longer than that many milliseconds:
+
+    $ python benchmarks/startup.py --budget 300
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+CONFIG = u"""
+[calendars]
+[[home]]
+path = {calpath}
+
+[locale]
+local_timezone = Europe/Berlin
+default_timezone = Europe/Berlin
+
+[sqlite]
+path = {dbpath}
+"""
+
+COMMANDS = [
+    ['--help'],
+    ['printcalendars'],
+    ['printformats'],
+    ['agenda'],
+    ['calendar'],
+    ['search', 'foo'],
+]
+
+SCRIPT = 'import sys; from khal.cli import main_khal; main_khal(sys.argv[1:])'
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(args, config, importtime=False):
+    """runs khal with `args`
+
+    :returns: the wall clock time in seconds and khal's stderr
+    :rtype: tuple(float, str)
+    """
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ['-X', 'importtime']
+    cmd += ['-c', SCRIPT, '-c', config] + args
+    start = time.time()
+    process = subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    _, err = process.communicate()
+    return time.time() - start, err.decode('utf-8', 'replace')
+
+
+def slowest_imports(importtime_output, count):
+    """the `count` top level imports which took the most time
+
+    :rtype: list(tuple(int, str))
+    """
+    imports = list()
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # only top level imports are not indented
+        if name.startswith('  '):
+            continue
+        imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='how often to run each command')
+    parser.add_argument('--imports', type=int, default=5,
+                        help='how many of the slowest imports to show')
+    parser.add_argument('--budget', type=float, default=None,
+                        help='fail if a command takes longer (in ms)')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    over_budget = list()
+    try:
+        config = os.path.join(tmpdir, 'config')
+        calpath = os.path.join(tmpdir, 'home')
+        os.mkdir(calpath)
+        with open(config, 'w') as config_file:
+            config_file.write(CONFIG.format(
+                calpath=calpath, dbpath=os.path.join(tmpdir, 'khal.db')))
+        # creates the db, so its creation is not measured
+        run(['agenda'], config)
+
+        for command in COMMANDS:
+            duration = min(run(command, config)[0] for _ in range(args.repeat))
+            print('{0:>15}: {1:6.0f}ms'.format(' '.join(command), duration * 1000))
+            if sys.version_info >= (3, 7):
+                _, err = run(command, config, importtime=True)
+                for cumulative, name in slowest_imports(err, args.imports):
+                    print('{0:>23.0f}ms {1}'.format(cumulative / 1000., name))
+            if args.budget is not None and duration * 1000 > args.budget:
+                over_budget.append(' '.join(command))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    if over_budget:
+        print('over budget: {0}'.format(', '.join(over_budget)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -20,7 +20,9 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #
+import datetime
 import logging
+import signal
 import sys
 import textwrap
 
@@ -32,14 +34,18 @@ except ImportError:
 
 import click
 
-from khal import controllers
-from khal import khalendar
+# only import what every command needs here, the commands import the rest
+# (e.g. icalendar, vdirsyncer or urwid) themselves, so `khal --help` or
+# `khal printcalendars` start fast
 from khal import __version__
 from khal.log import logger
-from khal.settings import get_config, InvalidSettingsError
 from khal.exceptions import FatalError
 from .terminal import colored, get_terminal_size
 
+# the same as khalendar.backend.SEARCH_FIELDS, which would take too long to
+# import just for `khal search --help`
+SEARCH_FIELDS = ['summary', 'location', 'description']
+
 
 days_option = click.option('--days', default=None, type=int,
                            help='How many days to include.')
@@ -80,6 +86,17 @@ def _calendar_select_callback(ctx, option, calendars):
         raise ValueError(mode)
 
 
+def _date_callback(ctx, option, value):
+    if value is None:
+        return
+    from khal import aux
+    locale = ctx.obj['conf']['locale']
+    try:
+        return aux.datefstr(value, locale['dateformat'], locale['longdateformat'])
+    except aux.InvalidDate as error:
+        raise click.BadParameter(str(error))
+
+
 def calendar_selector(f):
     a = click.option('--include-calendar', '-a', multiple=True, metavar='CAL',
                      expose_value=False, callback=_calendar_select_callback,
@@ -103,23 +120,54 @@ def global_options(f):
     return config(verbose(version(f)))
 
 
-def build_collection(ctx):
+def build_collection(ctx, sync=None, index=False):
+    """
+    :param sync: if the calendars' db should be updated from their vdirs, by
+                 default only if `khal watch` isn't keeping it up to date
+    :type sync: bool
+    :param index: keep the events in memory once they have been read, see
+                  `khalendar.CalendarCollection`
+    :type index: bool
+    """
+    from khal import khalendar
+    from khal.khalendar import watch
     try:
         conf = ctx.obj['conf']
-        collection = khalendar.CalendarCollection()
+        snapshot = conf['sqlite']['snapshot']
         selection = ctx.obj.get('calendar_selection', None)
+        collection = khalendar.CalendarCollection(
+            snapshot_db=conf['sqlite']['path'] if snapshot else None,
+            index=index,
+            all_calendars=selection is None or
+            set(conf['calendars']).issubset(selection))
+        if sync is None:
+            sync = not watch.is_current(conf['sqlite']['path'])
+        # `khal daemon` keeps the calendars around between queries
+        calendars = ctx.obj.get('calendars')
 
         for name, cal in conf['calendars'].items():
-            if selection is None or name in ctx.obj['calendar_selection']:
-                collection.append(khalendar.Calendar(
+            if selection is not None and name not in selection:
+                continue
+            if calendars is not None and name in calendars:
+                calendar = calendars[name]
+                calendar.needs_sync = sync
+            else:
+                calendar = khalendar.Calendar(
                     name=name,
                     dbpath=conf['sqlite']['path'],
                     path=cal['path'],
                     readonly=cal['readonly'],
                     color=cal['color'],
                     unicode_symbols=conf['locale']['unicode_symbols'],
-                    locale=conf['locale']
-                ))
+                    locale=conf['locale'],
+                    expansion_horizon=conf['sqlite']['expansion_horizon'],
+                    workers=conf['sqlite']['workers'],
+                    sync=sync,
+                    lazy_db=snapshot,
+                )
+                if calendars is not None:
+                    calendars[name] = calendar
+            collection.append(calendar)
     except FatalError as error:
         logger.fatal(error)
         sys.exit(1)
@@ -137,19 +185,30 @@ def prepare_context(ctx, config, verbose):
     else:
         logger.setLevel(logging.INFO)
 
+    from khal.settings import get_config, InvalidSettingsError
     ctx.obj = {}
     try:
         ctx.obj['conf'] = conf = get_config(config)
     except InvalidSettingsError:
         sys.exit(1)
 
-    logger.debug('Using config:')
-    logger.debug(stringify_conf(conf).decode('utf-8'))
+    if verbose:
+        logger.debug('Using config:')
+        logger.debug(stringify_conf(conf).decode('utf-8'))
 
     if conf is None:
         raise click.UsageError('Invalid config file, exiting.')
 
 
+def term_width(ctx):
+    """the width of the terminal the output is for, `khal daemon` gets it
+    from khalc"""
+    width = ctx.obj.get('term_width')
+    if width is None:
+        width, _ = get_terminal_size()
+    return width
+
+
 def stringify_conf(conf):
     # since we have only two levels of recursion, a recursive function isn't
     # really worth it
@@ -191,6 +250,7 @@ def _get_cli():
     @click.pass_context
     def calendar(ctx, days, events, dates):
         '''Print calendar with agenda.'''
+        from khal import controllers
         controllers.Calendar(
             build_collection(ctx),
             date=dates,
@@ -199,6 +259,7 @@ def _get_cli():
             locale=ctx.obj['conf']['locale'],
             weeknumber=ctx.obj['conf']['locale']['weeknumbers'],
             show_all_days=ctx.obj['conf']['default']['show_all_days'],
+            term_width=term_width(ctx),
             days=days,
             events=events
         )
@@ -209,6 +270,7 @@ def _get_cli():
     @click.pass_context
     def agenda(ctx, days, events, dates):
         '''Print agenda.'''
+        from khal import controllers
         controllers.Agenda(
             build_collection(ctx),
             date=dates,
@@ -216,6 +278,7 @@ def _get_cli():
             encoding=ctx.obj['conf']['locale']['encoding'],
             show_all_days=ctx.obj['conf']['default']['show_all_days'],
             locale=ctx.obj['conf']['locale'],
+            term_width=term_width(ctx),
             days=days,
             events=events,
         )
@@ -232,6 +295,7 @@ def _get_cli():
     @click.pass_context
     def new(ctx, description, location, repeat):
         '''Create a new event.'''
+        from khal import controllers
         controllers.NewFromString(
             build_collection(ctx),
             ctx.obj['conf'],
@@ -245,7 +309,8 @@ def _get_cli():
     @click.pass_context
     def interactive(ctx):
         '''Interactive UI. Also launchable via `ikhal`.'''
-        controllers.Interactive(build_collection(ctx), ctx.obj['conf'])
+        from khal import controllers
+        controllers.Interactive(build_collection(ctx, index=True), ctx.obj['conf'])
 
     @click.command()
     @calendar_selector
@@ -254,14 +319,67 @@ def _get_cli():
     def interactive_cli(ctx, config, verbose):
         '''Interactive UI. Also launchable via `khal interactive`.'''
         prepare_context(ctx, config, verbose)
-        controllers.Interactive(build_collection(ctx), ctx.obj['conf'])
+        from khal import controllers
+        controllers.Interactive(build_collection(ctx, index=True), ctx.obj['conf'])
 
     @cli.command()
     @calendar_selector
     @click.pass_context
     def printcalendars(ctx):
         '''List all calendars.'''
-        click.echo('\n'.join(build_collection(ctx).names))
+        # the calendars' names are all in the config, no need to open them
+        selection = ctx.obj.get('calendar_selection', None)
+        names = [name for name in ctx.obj['conf']['calendars']
+                 if selection is None or name in selection]
+        click.echo('\n'.join(names))
+
+    @cli.command('watch')
+    @click.option('--poll', is_flag=True,
+                  help='Check the calendars for changes periodically instead '
+                  'of using inotify.')
+    @click.pass_context
+    def watch_cmd(ctx, poll):
+        '''Keep the caching database up to date.
+
+        Runs until interrupted and updates the database as soon as an event
+        in one of the calendars is added, changed or deleted. While it is
+        running, other khal commands do not need to check the calendars for
+        changes.
+        '''
+        from khal.khalendar import watch
+        conf = ctx.obj['conf']
+        watcher = watch.Watcher(build_collection(ctx, sync=False),
+                                conf['sqlite']['path'], use_inotify=not poll)
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            pass
+
+    @cli.command()
+    @click.pass_context
+    def daemon(ctx):
+        '''Answer queries from khalc.
+
+        Keeps the configuration and the calendars loaded and runs agenda,
+        calendar, search, printcalendars and printformats for `khalc`, which
+        otherwise behaves just like khal.
+        '''
+        from khal import client, daemon as khal_daemon
+        from khal.settings import find_configuration_file
+        config_path = ctx.parent.params['config'] or find_configuration_file()
+        server = khal_daemon.Server(ctx.find_root().command, ctx.obj['conf'],
+                                    config_path, client.socket_path())
+        try:
+            server.bind()
+        except RuntimeError as error:
+            logger.fatal(error)
+            sys.exit(1)
+        # remove the socket when being terminated
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
 
     @cli.command()
     @click.pass_context
@@ -282,22 +400,40 @@ def _get_cli():
 
     @cli.command()
     @calendar_selector
+    @click.option('--from', 'start', default=None, metavar='DATE',
+                  callback=_date_callback,
+                  help='Only show instances ending on or after DATE.')
+    @click.option('--to', 'end', default=None, metavar='DATE',
+                  callback=_date_callback,
+                  help='Only show instances starting on or before DATE.')
+    @click.option('--field', default=None,
+                  type=click.Choice(SEARCH_FIELDS),
+                  help='Only search this property of the events.')
+    @click.option('--limit', default=None, type=click.IntRange(min=1),
+                  help='Show at most this many events.')
     @click.argument('search_string')
     @click.pass_context
-    def search(ctx, search_string):
+    def search(ctx, search_string, start, end, field, limit):
         '''Search for events matching SEARCH_STRING
 
-        For repetitive events only one event is currently shown.
+        Events containing all words of SEARCH_STRING (or words beginning with
+        them) in their summary, location, description, categories, comments,
+        contacts or resources are shown, best matches first.
+
+        For repetitive events only one event is shown, unless --from or --to
+        is given, then all matching instances in that time range are shown in
+        chronological order.
         '''
-        # TODO support for time ranges, location, description etc
+        if end is not None:
+            end += datetime.timedelta(days=1)
         collection = build_collection(ctx)
-        events = collection.search(search_string)
-        event_column = list()
-        term_width, _ = get_terminal_size()
+        events = collection.search(search_string, start=start, end=end,
+                                   field=field, limit=limit)
+        width = term_width(ctx)
+        encoding = ctx.obj['conf']['locale']['encoding']
         for event in events:
-            desc = textwrap.wrap(event.long(), term_width)
-            event_column.extend([colored(d, event.color) for d in desc])
-        click.echo('\n'.join(event_column).encode(ctx.obj['conf']['locale']['encoding']))
+            desc = textwrap.wrap(event.long(), width)
+            click.echo('\n'.join(colored(d, event.color) for d in desc).encode(encoding))
 
     return cli, interactive_cli
 
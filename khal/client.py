@@ -0,0 +1,101 @@
+# vim: set ts=4 sw=4 expandtab sts=4 fileencoding=utf-8:
+# Copyright (c) 2013-2015 Christian Geier et al.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+`khalc` hands its arguments to a running `khal daemon` and prints its
+answer. If there is no daemon (or it cannot answer the query), khal is run
+as usual.
+
+This module is imported on every call of `khalc`, so it must not import any
+of khal's heavier dependencies.
+"""
+import json
+import os
+import socket
+import sys
+import tempfile
+
+# how long to wait for the daemon's answer, in seconds
+TIMEOUT = 10
+
+
+def socket_path():
+    """the path of the daemon's socket"""
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(runtime_dir, 'khal-{0}.sock'.format(os.getuid()))
+
+
+def query(argv, path=None, color=False, width=None):
+    """ask the daemon to run khal with `argv`
+
+    :param argv: the command line arguments (without the program name)
+    :type argv: list(str)
+    :param color: if the output may contain ANSI color codes
+    :type color: bool
+    :param width: the width of the terminal the output is for, without it
+                  the daemon does not run commands whose output depends on
+                  it
+    :type width: int
+    :returns: exit code and output, or None if the daemon did not answer
+    :rtype: tuple(int, bytes) or None
+    """
+    path = path or socket_path()
+    try:
+        # somebody else's socket could lie about the results
+        if os.stat(path).st_uid != os.getuid():
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(TIMEOUT)
+        try:
+            sock.connect(path)
+            request = json.dumps({'argv': argv, 'color': color,
+                                  'width': width}) + '\n'
+            sock.sendall(request.encode('utf-8'))
+            sock.shutdown(socket.SHUT_WR)
+            chunks = list()
+            while True:
+                chunk = sock.recv(64 * 1024)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        finally:
+            sock.close()
+        header, _, output = b''.join(chunks).partition(b'\n')
+        header = json.loads(header.decode('utf-8'))
+    except (OSError, IOError, socket.error, ValueError):
+        return None
+    if header.get('fallback', True):
+        return None
+    return header['exit_code'], output
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    from khal.terminal import get_terminal_size
+    result = query(argv, color=sys.stdout.isatty(), width=get_terminal_size()[0])
+    if result is None:
+        from khal.cli import main_khal
+        return main_khal(args=argv, prog_name='khal')
+    exit_code, output = result
+    getattr(sys.stdout, 'buffer', sys.stdout).write(output)
+    sys.stdout.flush()
+    sys.exit(exit_code)
@@ -94,20 +94,15 @@ def get_agenda(collection, locale, dates=[],
                    for one in range(days) for date in dates]
         daylist.sort()
 
-    daylist = construct_daynames(daylist, locale['longdateformat'])
+    daynames = construct_daynames(daylist, locale['longdateformat'])
 
-    for day, dayname in daylist:
-        start = datetime.datetime.combine(day, datetime.time.min)
-        end = datetime.datetime.combine(day, datetime.time.max)
-
-        # TODO unify allday and datetime events
-        all_day_events = collection.get_allday_by_time_range(day)
-        events = collection.get_datetime_by_time_range(start, end)
+    # TODO unify allday and datetime events
+    for (_, dayname), (day, all_day_events, events) in zip(
+            daynames, collection.get_events_by_days(daylist, occurrences=True)):
         if len(events) == 0 and len(all_day_events) == 0 and not show_all_days:
             continue
 
         event_column.append(bstring(dayname))
-        events.sort(key=lambda e: e.start)
         for event in itertools.chain(all_day_events, events):
             desc = textwrap.wrap(event.compact(day), width)
             event_column.extend([colored(d, event.color) for d in desc])
@@ -120,8 +115,9 @@ def get_agenda(collection, locale, dates=[],
 class Calendar(object):
 
     def __init__(self, collection, date=[], firstweekday=0, encoding='utf-8',
-                 weeknumber=False, show_all_days=False, **kwargs):
-        term_width, _ = get_terminal_size()
+                 weeknumber=False, show_all_days=False, term_width=None, **kwargs):
+        if term_width is None:
+            term_width, _ = get_terminal_size()
         lwidth = 25
         rwidth = term_width - lwidth - 4
         event_column = get_agenda(
@@ -137,8 +133,9 @@ class Calendar(object):
 class Agenda(object):
 
     def __init__(self, collection, date=None, firstweekday=0, encoding='utf-8',
-                 show_all_days=False, **kwargs):
-        term_width, _ = get_terminal_size()
+                 show_all_days=False, term_width=None, **kwargs):
+        if term_width is None:
+            term_width, _ = get_terminal_size()
         event_column = get_agenda(collection, dates=date, width=term_width,
                                   show_all_days=show_all_days, **kwargs)
         echo('\n'.join(event_column).encode(encoding))
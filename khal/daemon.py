@@ -0,0 +1,183 @@
+# vim: set ts=4 sw=4 expandtab sts=4 fileencoding=utf-8:
+# Copyright (c) 2013-2015 Christian Geier et al.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+`khal daemon` keeps the parsed config and the calendars loaded and runs the
+commands `khalc` (see khal.client) sends it over a UNIX socket.
+"""
+import json
+import os
+import socket
+
+from click.testing import CliRunner
+
+from .log import logger
+
+# only these commands are run by the daemon, all others (e.g. those which
+# need a terminal or change events) are run by khalc itself
+COMMANDS = ['agenda', 'calendar', 'search', 'printcalendars', 'printformats']
+
+# these lay out their output for the terminal's width, which only the client
+# knows
+WIDTH_COMMANDS = ['agenda', 'calendar', 'search']
+
+# options of khal itself (not of its commands) which take a value
+_VALUE_OPTIONS = ['-c', '--config']
+
+# the longest request we accept, in bytes
+MAX_REQUEST = 64 * 1024
+
+
+def _command(argv, default_command):
+    """the command `argv` would run, or None if we cannot tell"""
+    for arg in argv:
+        if arg in _VALUE_OPTIONS or arg.startswith('--config='):
+            # another config than the daemon's
+            return None
+        if arg in ['--help', '--version']:
+            return None
+        if not arg.startswith('-'):
+            return arg
+    return default_command or None
+
+
+class Server(object):
+    """
+    :param cli: khal's click group
+    :type cli: click.Group
+    :param conf: the parsed config
+    :type conf: dict
+    :param config_path: where the config was read from, the daemon stops
+                        answering queries once it changes
+    :type config_path: str
+    :param path: the path of the socket
+    :type path: str
+    """
+
+    def __init__(self, cli, conf, config_path, path):
+        self._cli = cli
+        self._conf = conf
+        self._config_path = config_path
+        self._config_mtime = self._mtime(config_path)
+        # calendars are created on first use and then reused
+        self._calendars = dict()
+        self._path = path
+        self._runner = CliRunner()
+        self._sock = None
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return None
+
+    def bind(self):
+        """create the socket, replacing a stale one"""
+        if os.path.exists(self._path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self._path)
+            except socket.error:
+                os.remove(self._path)
+            else:
+                raise RuntimeError(
+                    'another khal daemon is listening on {0}'.format(self._path))
+            finally:
+                probe.close()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)
+        try:
+            self._sock.bind(self._path)
+        finally:
+            os.umask(old_umask)
+        self._sock.listen(16)
+
+    def serve_forever(self):
+        """answer queries one after the other until interrupted"""
+        if self._sock is None:
+            self.bind()
+        logger.info('Listening on {0}'.format(self._path))
+        try:
+            while True:
+                conn, _ = self._sock.accept()
+                try:
+                    self.handle(conn)
+                except (socket.error, ValueError) as error:
+                    logger.warning('Could not answer query: {0}'.format(error))
+                finally:
+                    conn.close()
+        finally:
+            self.close()
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+
+    def handle(self, conn):
+        """read one request from `conn` and answer it"""
+        data = b''
+        while b'\n' not in data and len(data) < MAX_REQUEST:
+            chunk = conn.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+        request = json.loads(data.split(b'\n', 1)[0].decode('utf-8'))
+        result = self.run(request['argv'], color=request.get('color', False),
+                          width=request.get('width'))
+        if result is None:
+            conn.sendall(json.dumps({'fallback': True}).encode('utf-8') + b'\n')
+        else:
+            exit_code, output = result
+            header = json.dumps({'fallback': False, 'exit_code': exit_code})
+            conn.sendall(header.encode('utf-8') + b'\n' + output)
+
+    def run(self, argv, color=False, width=None):
+        """run khal with `argv`
+
+        :param width: the width of the client's terminal
+        :type width: int
+        :returns: exit code and output, or None if the client should run the
+                  command itself
+        :rtype: tuple(int, bytes) or None
+        """
+        if self._mtime(self._config_path) != self._config_mtime:
+            logger.warning('{0} has changed, please restart the daemon'
+                           .format(self._config_path))
+            return None
+        command = _command(argv, self._conf['default']['default_command'])
+        if command not in COMMANDS:
+            return None
+        if width is None and command in WIDTH_COMMANDS:
+            return None
+        obj = {'conf': self._conf, 'calendars': self._calendars,
+               'term_width': width}
+        result = self._runner.invoke(self._cli, argv, obj=obj, color=color)
+        if result.exception is not None and \
+                not isinstance(result.exception, SystemExit):
+            logger.error('Running {0} failed: {1!r}'.format(argv, result.exception))
+            return None
+        return result.exit_code, result.output_bytes
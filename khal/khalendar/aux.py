@@ -6,12 +6,29 @@ import pytz
 
 from .. import log
 
+from . import fastexpand
 from .exceptions import UnsupportedRecursion
 
 logger = log.logger
 
+# rrule really doesn't like to calculate all recurrences until eternity, so we
+# only do it until 2037, because a) I'm not sure if python can deal with larger
+# datetime values yet and b) pytz doesn't know any larger transition times
+EXPAND_UNTIL = datetime(2037, 12, 31)
 
-def expand(vevent, default_tz, href=''):
+
+def open_ended(vevent):
+    """returns True if vevent has an RRULE without an end (neither UNTIL nor
+    COUNT)
+
+    :type vevent: icalendar.cal.Event
+    :rtype: bool
+    """
+    return ('RRULE' in vevent and
+            not set(['UNTIL', 'COUNT']).intersection(vevent['RRULE'].keys()))
+
+
+def expand(vevent, default_tz, href='', until=None):
     """
     Constructs a list of start and end dates for all recurring instances of the
     event defined in vevent.
@@ -29,6 +46,9 @@ def expand(vevent, default_tz, href=''):
     :param href: the href of the vevent, used for more informative logging and
                  nothing else
     :type href: str
+    :param until: if given, RRULEs without an end are only expanded up to this
+                  (naive, in the event's timezone) datetime instead of 2037
+    :type until: datetime.datetime
     :returns: list of start and end (date)times of the expanded event
     :rtyped list(tuple(datetime, datetime))
     """
@@ -38,66 +58,64 @@ def expand(vevent, default_tz, href=''):
     else:
         duration = vevent['DTEND'].dt - vevent['DTSTART'].dt
 
+    # vevent itself is not modified
+    dtstart = vevent['DTSTART'].dt
+
     # dateutil.rrule converts everything to datetime
-    allday = not isinstance(vevent['DTSTART'].dt, datetime)
+    allday = not isinstance(dtstart, datetime)
 
     # icalendar did not understand the defined timezone
     if (not allday and 'TZID' in vevent['DTSTART'].params and
-            vevent['DTSTART'].dt.tzinfo is None):
-        vevent['DTSTART'].dt = default_tz.localize(vevent['DTSTART'].dt)
+            dtstart.tzinfo is None):
+        dtstart = default_tz.localize(dtstart)
 
     if 'RRULE' not in vevent.keys() and 'RDATE' not in vevent.keys():
-        return [(vevent['DTSTART'].dt, vevent['DTSTART'].dt + duration)]
+        return [(dtstart, dtstart + duration)]
 
     events_tz = None
-    if getattr(vevent['DTSTART'].dt, 'tzinfo', False):
+    if getattr(dtstart, 'tzinfo', False):
         # dst causes problem while expanding the rrule, therefor we transform
         # everything to naive datetime objects and tranform back after
         # expanding
-        events_tz = vevent['DTSTART'].dt.tzinfo
-        vevent['DTSTART'].dt = vevent['DTSTART'].dt.replace(tzinfo=None)
+        events_tz = dtstart.tzinfo
+        dtstart = dtstart.replace(tzinfo=None)
+
+    # explicitly specified recursion dates and excluded dates
+    rdates = localize_strip_tz(_dates(vevent, 'RDATE'), events_tz or default_tz)
+    exdates = localize_strip_tz(_dates(vevent, 'EXDATE'), events_tz or default_tz)
 
     if 'RRULE' in vevent:
         rrulestr = vevent['RRULE'].to_ical()
-        rrule = dateutil.rrule.rrulestr(rrulestr, dtstart=vevent['DTSTART'].dt)
+        rrule = dateutil.rrule.rrulestr(rrulestr, dtstart=dtstart)
 
-        if not set(['UNTIL', 'COUNT']).intersection(vevent['RRULE'].keys()):
-            # rrule really doesn't like to calculate all recurrences until
-            # eternity, so we only do it until 2037, because a) I'm not sure
-            # if python can deal with larger datetime values yet and b) pytz
-            # doesn't know any larger transition times
-            rrule._until = datetime(2037, 12, 31)
+        windowed = False
+        if open_ended(vevent):
+            if until is not None and until < EXPAND_UNTIL:
+                rrule._until = until
+                windowed = True
+            else:
+                rrule._until = EXPAND_UNTIL
 
         if getattr(rrule._until, 'tzinfo', False):
             rrule._until = rrule._until.astimezone(events_tz or default_tz)
             rrule._until = rrule._until.replace(tzinfo=None)
 
+        dtstartl = fastexpand.expand(rrule, rdates, exdates, events_tz, allday)
+        if dtstartl is not None:
+            return [(start, start + duration) for start in dtstartl]
+
         logger.debug('calculating recurrence dates for {0}, '
                      'this might take some time.'.format(href))
         dtstartl = list(rrule)
-        if len(dtstartl) == 0:
+        # if we only expand up to `until`, all instances might lie after it
+        if len(dtstartl) == 0 and not windowed:
             raise UnsupportedRecursion
     else:
-        dtstartl = [vevent['DTSTART'].dt]
-
-    # include explicitly specified recursion dates
-    if 'RDATE' in vevent:
-        if not isinstance(vevent['RDATE'], list):
-            rdates = [vevent['RDATE']]
-        else:
-            rdates = vevent['RDATE']
-        rdates = [leaf.dt for tree in rdates for leaf in tree.dts]
-        rdates = localize_strip_tz(rdates, events_tz or default_tz)
-        dtstartl += rdates
-
-    # remove excluded dates
-    if 'EXDATE' in vevent:
-        if not isinstance(vevent['EXDATE'], list):
-            exdates = [vevent['EXDATE']]
-        else:
-            exdates = vevent['EXDATE']
-        exdates = [leaf.dt for tree in exdates for leaf in tree.dts]
-        exdates = localize_strip_tz(exdates, events_tz or default_tz)
+        dtstartl = [dtstart]
+
+    dtstartl += rdates
+    if exdates:
+        exdates = set(exdates)
         dtstartl = [start for start in dtstartl if start not in exdates]
 
     if events_tz is not None:
@@ -114,6 +132,19 @@ def expand(vevent, default_tz, href=''):
     return dtstartend
 
 
+def _dates(vevent, name):
+    """the dates of all of vevent's `name` (RDATE or EXDATE) properties
+
+    :rtype: list(datetime.date) or list(datetime.datetime)
+    """
+    if name not in vevent:
+        return list()
+    trees = vevent[name]
+    if not isinstance(trees, list):
+        trees = [trees]
+    return [leaf.dt for tree in trees for leaf in tree.dts]
+
+
 def sanitize(vevent):
     """
     clean up vevents we do not understand
@@ -31,30 +31,359 @@ note on naming:
 """
 from __future__ import print_function
 
+import collections
 import contextlib
 import datetime
+import functools
+import hashlib
 from os import makedirs, path
 import sqlite3
+import struct
 import time
+import zlib
 
 import icalendar
 import pytz
 import xdg.BaseDirectory
 
-from .event import Event
+from .event import Event, Occurrence
 from . import aux
-from .. import log
+from .. import log, __version__
+from ..compat import unicode_type
 from .exceptions import CouldNotCreateDbDir, OutdatedDbVersionError, \
-    UpdateFailed
+    UpdateFailed, EventNotFound
 
 logger = log.logger
 
-DB_VERSION = 3  # The current db layout version
+DB_VERSION = 9  # The current db layout version
 
 RECURRENCE_ID = 'RECURRENCE-ID'
 THISANDFUTURE = 'THISANDFUTURE'
 THISANDPRIOR = 'THISANDPRIOR'
 
+# how many parsed vevents each SQLiteDb keeps around, see VEventCache
+VEVENT_CACHE_SIZE = 1000
+
+# how many expanded recurrence sets the expansions table keeps
+EXPANSION_CACHE_SIZE = 1000
+
+# indexes on the recursion tables, these allow range queries to be answered
+# with an index range scan instead of a full table scan
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS recs_loc_dtstart ON recs_loc (calendar, dtstart);',
+    'CREATE INDEX IF NOT EXISTS recs_loc_dtend ON recs_loc (calendar, dtend);',
+    'CREATE INDEX IF NOT EXISTS recs_float_dtstart ON recs_float (calendar, dtstart);',
+    'CREATE INDEX IF NOT EXISTS recs_float_dtend ON recs_float (calendar, dtend);',
+]
+
+
+# for events with an open ended RRULE which have only been expanded up to
+# some point in time (see SQLiteDb's `expansion_horizon`), `until` is the unix
+# time up to which their instances have been inserted into the recursion tables
+CREATE_HORIZONS = '''CREATE TABLE IF NOT EXISTS horizons (
+    href TEXT NOT NULL,
+    calendar TEXT NOT NULL,
+    until INT NOT NULL,
+    primary key (href, calendar)
+    );'''
+
+
+# full text index of the events' text properties, its rowids are the rowids of
+# the corresponding rows in the events table. This needs the FTS5 extension,
+# which not every sqlite build comes with, SQLiteDb.search falls back to a
+# (much slower) LIKE query without it.
+CREATE_FTS = '''CREATE VIRTUAL TABLE events_fts USING fts5(
+    summary, location, description, other
+    );'''
+
+# a sqlite without FTS5 cannot write to the full text index of a db created
+# by one with it, the index is outdated then. This table's existence records
+# that, the index is rebuilt the next time a sqlite with FTS5 opens the db.
+CREATE_FTS_OUTDATED = 'CREATE TABLE IF NOT EXISTS events_fts_outdated (unused INT);'
+
+# the properties `SQLiteDb.search` can be restricted to, these are also the
+# names of the first columns of the full text index
+SEARCH_FIELDS = ['summary', 'location', 'description']
+
+# the properties in the last column of the full text index
+FTS_OTHER = ['CATEGORIES', 'COMMENT', 'CONTACT', 'RESOURCES']
+
+
+# inode, size and mtime (in nanoseconds) of every file in a calendar's vdir as
+# seen when the db was last updated from it, see `khalendar.Calendar`
+CREATE_FILES = '''CREATE TABLE IF NOT EXISTS files (
+    href TEXT NOT NULL,
+    calendar TEXT NOT NULL,
+    inode INT NOT NULL,
+    size INT NOT NULL,
+    mtime_ns INT NOT NULL,
+    primary key (href, calendar)
+    );'''
+
+
+# the instances of recurring events, keyed by a fingerprint of everything
+# their expansion depends on (see `expansion_key`), so events with the same
+# recurrence (in any calendar) are only expanded once. `times` holds the
+# instances' start and end unix times (see `pack_times`), `last_used` is the
+# unix time (in milliseconds) the entry was last inserted or used, the least
+# recently used entries are evicted.
+CREATE_EXPANSIONS = '''CREATE TABLE IF NOT EXISTS expansions (
+    key TEXT NOT NULL PRIMARY KEY,
+    times BLOB NOT NULL,
+    last_used INT NOT NULL
+    );'''
+
+
+# integer ids of the calendars, the series table refers to calendars by these
+CREATE_CALENDAR_IDS = '''CREATE TABLE IF NOT EXISTS calendar_ids (
+    id INTEGER PRIMARY KEY,
+    calendar TEXT NOT NULL UNIQUE
+    );'''
+
+
+# instances of recurring events which are `period` seconds apart and all
+# last `duration` seconds are saved as one row instead of one row per
+# instance in the recursion tables, see `compact_times`. `first` is the unix
+# time of the first instance's start, `allday` is 1 for instances which
+# would otherwise be in recs_float and 0 for those of recs_loc. There are
+# few enough series that range queries just scan the table.
+CREATE_SERIES = '''CREATE TABLE IF NOT EXISTS series (
+    calendar_id INT NOT NULL REFERENCES calendar_ids( id ),
+    href TEXT NOT NULL,
+    hrefrecuid TEXT NOT NULL,
+    allday INT NOT NULL,
+    first INT NOT NULL,
+    period INT NOT NULL,
+    count INT NOT NULL,
+    duration INT NOT NULL
+    );'''
+
+CREATE_SERIES_INDEX = \
+    'CREATE INDEX IF NOT EXISTS series_href ON series (href, calendar_id);'
+
+# seconds per FREQ of the RRULEs whose instances are a multiple of these
+# apart (apart from daylight saving time changes), see `series_period`
+PERIODS = {
+    'SECONDLY': 1,
+    'MINUTELY': 60,
+    'HOURLY': 3600,
+    'DAILY': 24 * 3600,
+    'WEEKLY': 7 * 24 * 3600,
+}
+
+
+def _migrate_3(cursor):
+    """db layout version 4 adds indexes on the recursion tables"""
+    for sql_s in INDEXES:
+        cursor.execute(sql_s)
+
+
+def _migrate_4(cursor):
+    """db layout version 5 adds the horizons table, all events in older dbs
+    are already expanded completely"""
+    cursor.execute(CREATE_HORIZONS)
+
+
+def _migrate_5(cursor):
+    """db layout version 6 adds the files table, the first update of each
+    calendar fills it"""
+    cursor.execute(CREATE_FILES)
+
+
+def _migrate_6(cursor):
+    """db layout version 7 adds the columns `Occurrence`s are built from to
+    the events table"""
+    existing = [row[1] for row in cursor.execute('PRAGMA table_info(events);')]
+    for column, column_type in [('summary', 'TEXT'), ('location', 'TEXT'),
+                                ('recurring', 'INT'), ('allday', 'INT'),
+                                ('tzname', 'TEXT')]:
+        if column not in existing:
+            cursor.execute('ALTER TABLE events ADD COLUMN {0} {1};'
+                           .format(column, column_type))
+    rows = cursor.execute('SELECT rowid, item FROM events;').fetchall()
+    cursor.executemany(
+        'UPDATE events SET summary = ?, location = ?, recurring = ?, '
+        'allday = ?, tzname = ? WHERE rowid = ?;',
+        (display_columns(icalendar.Event.from_ical(item)) + (rowid, )
+         for rowid, item in rows))
+
+
+def _migrate_7(cursor):
+    """db layout version 8 adds the expansions table"""
+    cursor.execute(CREATE_EXPANSIONS)
+
+
+def _migrate_8(cursor):
+    """db layout version 9 saves the instances of regular recurring events as
+    series, the instances already in the db are compacted, and compresses
+    the expansions table"""
+    cursor.execute('DELETE FROM expansions;')
+    cursor.execute(CREATE_CALENDAR_IDS)
+    cursor.execute(CREATE_SERIES)
+    cursor.execute(CREATE_SERIES_INDEX)
+    # the instances of THISANDFUTURE events have been shifted, those are
+    # left alone
+    rows = cursor.execute(
+        'SELECT href, calendar, item FROM events WHERE recurring AND '
+        'hrefrecuid = href AND href NOT IN '
+        "(SELECT href FROM events WHERE item LIKE '%RANGE=THISANDFUTURE%');"
+    ).fetchall()
+    for href, calendar, item in rows:
+        period = series_period(icalendar.Event.from_ical(item))
+        if period is None:
+            continue
+        calendar_id = _intern_calendar(cursor, calendar)
+        for table, allday in [('recs_loc', 0), ('recs_float', 1)]:
+            condition = ('FROM {0} WHERE href = ? AND hrefrecuid = href AND '
+                         'calendar = ?'.format(table))
+            times = cursor.execute('SELECT dtstart, dtend ' + condition + ';',
+                                   (href, calendar)).fetchall()
+            series, single = compact_times(times, period)
+            if not series:
+                continue
+            cursor.execute('DELETE ' + condition + ';', (href, calendar))
+            cursor.executemany(
+                'INSERT INTO {0} (dtstart, dtend, href, hrefrecuid, recuid, calendar) '
+                'VALUES (?, ?, ?, ?, ?, ?);'.format(table),
+                ((dbstart, dbend, href, href, dbstart, calendar)
+                 for dbstart, dbend in single))
+            _insert_series(cursor, calendar_id, href, href, allday, series)
+
+
+# maps an outdated db layout version to the function that migrates it to the
+# next version
+MIGRATIONS = {
+    3: _migrate_3,
+    4: _migrate_4,
+    5: _migrate_5,
+    6: _migrate_6,
+    7: _migrate_7,
+    8: _migrate_8,
+}
+
+
+# connections to db files, shared by all SQLiteDb objects in this process
+_connections = dict()
+
+
+def _connect(db_path):
+    """open a new connection to the db at `db_path`"""
+    conn = sqlite3.connect(db_path)
+    if db_path != ':memory:':
+        # with a write-ahead log, readers and writers don't block each other
+        conn.execute('PRAGMA journal_mode=WAL;')
+    return conn
+
+
+_fts5 = None
+
+
+def fts5_available(conn):
+    """if the sqlite library `conn` uses has the FTS5 extension, this is
+    only checked once
+
+    :type conn: sqlite3.Connection
+    :rtype: bool
+    """
+    global _fts5
+    if _fts5 is None:
+        try:
+            conn.execute('CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(text);')
+            conn.execute('DROP TABLE temp.fts5_probe;')
+            _fts5 = True
+        except sqlite3.OperationalError as error:
+            logger.debug('sqlite has no FTS5: {0}'.format(error))
+            _fts5 = False
+    return _fts5
+
+
+def _intern_calendar(cursor, calendar):
+    """the id of `calendar` in the calendar_ids table, a new one is assigned
+    if it has none yet
+
+    :rtype: int
+    """
+    cursor.execute('INSERT OR IGNORE INTO calendar_ids (calendar) VALUES (?);',
+                   (calendar, ))
+    cursor.execute('SELECT id FROM calendar_ids WHERE calendar = ?;', (calendar, ))
+    return cursor.fetchall()[0][0]
+
+
+def _insert_series(cursor, calendar_id, href, href_rec_inst, allday, series):
+    """insert `series` as returned by `compact_times`"""
+    cursor.executemany(
+        'INSERT INTO series (calendar_id, href, hrefrecuid, allday, first, '
+        'period, count, duration) VALUES (?, ?, ?, ?, ?, ?, ?, ?);',
+        ((calendar_id, href, href_rec_inst, allday) + one for one in series))
+
+
+def disconnect(db_path):
+    """close the shared connection to the db at `db_path`, if there is one,
+    the next SQLiteDb using that db will open a new connection"""
+    conn = _connections.pop(path.expanduser(db_path), None)
+    if conn is not None:
+        conn.close()
+
+
+class VEventCache(object):
+    """
+    A bounded LRU cache of parsed vevents.
+
+    All instances of a recurring event share the same item in the db, parsing
+    it only once saves a lot of time when showing many of them. As `Event`
+    sets DTSTART and DTEND for each instance, a shallow copy of the cached
+    vevent is handed out on every lookup and `Event` replaces those
+    properties instead of modifying them.
+
+    :param maxsize: maximal number of vevents to keep
+    :type maxsize: int
+    """
+
+    def __init__(self, maxsize=VEVENT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._vevents = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._vevents)
+
+    def get(self, key, item):
+        """return a copy of the parsed vevent for `key`, parse `item` if it
+        is not cached yet
+
+        :param key: (calendar, hrefrecuid, etag)
+        :type key: tuple
+        :param item: the vevent as saved in the db
+        :type item: unicode
+        :rtype: icalendar.Event
+        """
+        try:
+            vevent = self._vevents.pop(key)
+            self.hits += 1
+        except KeyError:
+            vevent = icalendar.Event.from_ical(item)
+            self.misses += 1
+            if len(self._vevents) >= self.maxsize:
+                self._vevents.popitem(last=False)
+        self._vevents[key] = vevent
+        return copy_vevent(vevent)
+
+    def clear(self):
+        self._vevents.clear()
+
+
+def copy_vevent(vevent):
+    """shallow copy of `vevent`, properties are shared with the original
+
+    :type vevent: icalendar.Event
+    :rtype: icalendar.Event
+    """
+    copied = vevent.__class__()
+    copied.update(vevent)
+    copied.subcomponents = list(vevent.subcomponents)
+    return copied
+
 
 class SQLiteDb(object):
     """
@@ -70,9 +399,13 @@ class SQLiteDb(object):
                     None, a place according to the XDG specifications will be
                     chosen
     :type db_path: str or None
+    :param expansion_horizon: if set, events with an open ended RRULE are only
+                              expanded this many days into the future, further
+                              instances are inserted once they are queried
+    :type expansion_horizon: int or None
     """
 
-    def __init__(self, calendar, db_path, locale):
+    def __init__(self, calendar, db_path, locale, expansion_horizon=None):
         if db_path is None:
             db_path = xdg.BaseDirectory.save_data_path('khal') + '/khal.db'
         self.db_path = path.expanduser(db_path)
@@ -83,14 +416,34 @@ class SQLiteDb(object):
         self.table_d = calendar + '_d'
         self.table_dt = calendar + '_dt'
         self._at_once = False
-        self.conn = sqlite3.connect(self.db_path)
-        self.cursor = self.conn.cursor()
-        self._create_default_tables()
-        self._check_table_version()
+        if expansion_horizon:
+            self.expansion_horizon = datetime.timedelta(days=expansion_horizon)
+        else:
+            self.expansion_horizon = None
+        self._min_horizon = None
+        self.vevent_cache = VEventCache()
+        try:
+            self.conn = _connections[self.db_path]
+            self.cursor = self.conn.cursor()
+        except KeyError:
+            self.conn = _connect(self.db_path)
+            self.cursor = self.conn.cursor()
+            self._create_default_tables()
+            self._check_table_version()
+            # every connection to :memory: opens a new db, so those cannot
+            # be shared
+            if self.db_path != ':memory:':
+                _connections[self.db_path] = self.conn
+            self._create_fts()
+        self._fts = fts5_available(self.conn) and self._table_exists('events_fts')
         self._check_calendar_exists()
 
     @contextlib.contextmanager
     def at_once(self):
+        if self._at_once:
+            # the outermost at_once commits
+            yield self
+            return
         self._at_once = True
         try:
             yield self
@@ -117,7 +470,8 @@ class SQLiteDb(object):
 
     def _check_table_version(self):
         """tests for curent db Version
-        if the table is still empty, insert db_version
+        if the table is still empty, insert db_version, if the db has an older
+        version we know how to migrate from, migrate it
         """
         self.cursor.execute('SELECT version FROM version')
         result = self.cursor.fetchone()
@@ -125,7 +479,16 @@ class SQLiteDb(object):
             self.cursor.execute('INSERT INTO version (version) VALUES (?)',
                                 (DB_VERSION, ))
             self.conn.commit()
-        elif not result[0] == DB_VERSION:
+            return
+        version = result[0]
+        while version != DB_VERSION and version in MIGRATIONS:
+            logger.debug('migrating db from version {0} to {1}'
+                         .format(version, version + 1))
+            MIGRATIONS[version](self.cursor)
+            version += 1
+            self.cursor.execute('UPDATE version SET version = ?', (version, ))
+            self.conn.commit()
+        if version != DB_VERSION:
             raise OutdatedDbVersionError(
                 str(self.db_path) +
                 " is probably an invalid or outdated database.\n"
@@ -153,6 +516,11 @@ class SQLiteDb(object):
                 etag TEXT,
                 type TEXT,
                 item TEXT,
+                summary TEXT,
+                location TEXT,
+                recurring INT,
+                allday INT,
+                tzname TEXT,
                 primary key (hrefrecuid, calendar)
                 );''')
         self.cursor.execute('''CREATE TABLE IF NOT EXISTS recs_loc (
@@ -173,6 +541,51 @@ class SQLiteDb(object):
             calendar TEXT NOT NULL,
             primary key (href, recuid, calendar)
             );''')
+        self.cursor.execute(CREATE_HORIZONS)
+        self.cursor.execute(CREATE_FILES)
+        self.cursor.execute(CREATE_EXPANSIONS)
+        self.cursor.execute(CREATE_CALENDAR_IDS)
+        self.cursor.execute(CREATE_SERIES)
+        self.cursor.execute(CREATE_SERIES_INDEX)
+        for sql_s in INDEXES:
+            self.cursor.execute(sql_s)
+        self.conn.commit()
+
+    def _table_exists(self, name):
+        self.cursor.execute(
+            'SELECT count(*) FROM sqlite_master WHERE name = ?;', (name, ))
+        return bool(self.cursor.fetchone()[0])
+
+    def _create_fts(self):
+        """create the full text index if sqlite supports it and it does not
+        exist yet (or rebuild it if it is outdated), and add all events
+        already in the db to it"""
+        exists = self._table_exists('events_fts')
+        if not fts5_available(self.conn):
+            if exists:
+                logger.debug('full text index cannot be updated without FTS5')
+                self.cursor.execute(CREATE_FTS_OUTDATED)
+                self.conn.commit()
+            return
+        outdated = self._table_exists('events_fts_outdated')
+        if exists and not outdated:
+            return
+        if exists:
+            logger.debug('rebuilding outdated full text index')
+            self.cursor.execute('DELETE FROM events_fts;')
+            self.cursor.execute('DROP TABLE events_fts_outdated;')
+        else:
+            try:
+                self.cursor.execute(CREATE_FTS)
+            except sqlite3.OperationalError as error:
+                logger.debug('could not create full text index: {0}'.format(error))
+                return
+        rows = self.conn.execute('SELECT rowid, item FROM events;')
+        self.cursor.executemany(
+            'INSERT INTO events_fts (rowid, summary, location, description, other) '
+            'VALUES (?, ?, ?, ?, ?);',
+            ((rowid, ) + search_text(icalendar.Event.from_ical(item))
+             for rowid, item in rows))
         self.conn.commit()
 
     def _check_calendar_exists(self):
@@ -189,6 +602,8 @@ class SQLiteDb(object):
             sql_s = 'INSERT INTO calendars (calendar, resource) VALUES (?, ?);'
             stuple = (self.calendar, '')
             self.sql_ex(sql_s, stuple)
+        self.calendar_id = _intern_calendar(self.cursor, self.calendar)
+        self.conn.commit()
 
     def sql_ex(self, statement, stuple=''):
         """wrapper for sql statements, does a "fetchall" """
@@ -198,11 +613,17 @@ class SQLiteDb(object):
             self.conn.commit()
         return result
 
+    def sql_many(self, statement, stuples):
+        """wrapper for executing one sql statement for every tuple in
+        `stuples`"""
+        self.cursor.executemany(statement, stuples)
+        if not self._at_once:
+            self.conn.commit()
+
     def update(self, vevent, href, etag=''):
         """insert a new or update an existing card in the db
 
-        This is mostly a wrapper around two SQL statements, doing some cleanup
-        before.
+        This is mostly a wrapper around `prepare_update` and `insert`.
 
         :param vevent: event to be inserted or updated. If this is a calendar
                        object, it will be searched for an event.
@@ -221,113 +642,202 @@ class SQLiteDb(object):
         """
         if href is None:
             raise ValueError('href may not be None')
+        prepared = prepare_update(vevent, href, self.calendar,
+                                  self.locale['default_timezone'],
+                                  self.expansion_horizon,
+                                  expansions=self.cached_expansion)
+        self.insert(prepared, href, etag)
 
-        if isinstance(vevent, icalendar.cal.Event):
-            ical = vevent
-        else:
-            ical = icalendar.Event.from_ical(vevent)
-
-        # insert the (sub) events in the right order, e.g. recurrence-id events
-        # after the corresponding rrule event
-        def sort_key(vevent):
-            assert isinstance(vevent, icalendar.Event)  # REMOVE ME
-            uid = str(vevent['UID'])
-            rec_id = vevent.get(RECURRENCE_ID)
-            if rec_id is None:
-                return uid, 0
-            rrange = rec_id.params.get('RANGE')
-            if rrange == THISANDFUTURE:
-                return uid, aux.to_unix_time(rec_id.dt)
-            else:
-                return uid, 1
+    def insert(self, prepared, href, etag=''):
+        """insert the vevents of one href, as returned by `prepare_update`,
+        into the db, replacing whatever was saved under that href before
 
-        vevents = (aux.sanitize(c) for c in ical.walk() if c.name == 'VEVENT')
+        :type prepared: list(PreparedVEvent)
+        :type href: str
+        :type etag: str
+        """
         # Need to delete the whole event in case we are updating a
         # recurring event with an event which is either not recurring any
         # more or has EXDATEs, as those would be left in the recursion
         # tables. There are obviously better ways to achieve the same
         # result.
-        self.delete(href)
-        for vevent in sorted(vevents, key=sort_key):
-            check_support(vevent, href, self.calendar)
-            self._update_impl(vevent, href, etag)
+        with self.at_once():
+            self.delete(href)
+            # THISANDFUTURE events shift the rows of the instances they
+            # modify, so those must not be saved as series
+            compact = all(one.shift is None for one in prepared)
+            for one, times in zip(prepared, owned_times(prepared)):
+                self._update_impl(one, href, etag, times, compact)
+            if any(one.expansion is not None for one in prepared):
+                self._evict_expansions()
 
-    def _update_impl(self, vevent, href, etag):
-        """expand (if needed) and insert non-reccuring and original recurring
-        (those with an RRULE property"""
-        # TODO FIXME this function is a steaming pile of shit
+    def _update_impl(self, prepared, href, etag, times, compact=True):
+        """insert a non-reccuring, original recurring (those with an RRULE
+        property) or RECURRENCE-ID event
 
-        assert isinstance(vevent, icalendar.Event)  # REMOVE ME
-        rec_id = vevent.get(RECURRENCE_ID)
-        if rec_id is None:
-            rrange = None
+        :type prepared: PreparedVEvent
+        :param times: the instances to insert, see `owned_times`
+        :type times: list(tuple(int, int))
+        :param compact: if regular instances may be saved as series
+        :type compact: bool
+        """
+        recs_table = prepared.recs_table
+        rec_inst = prepared.rec_inst
+        href_rec_inst = prepared.href_rec_inst
+        if prepared.shift is not None:
+            if prepared.times:
+                start_shift, duration = prepared.shift
+                recs_sql_s = (
+                    'UPDATE {0} SET dtstart = recuid + ?, dtend = recuid + ?, hrefrecuid=? '
+                    'WHERE recuid >= ? AND href = ? AND calendar = ?;'.format(recs_table))
+                stuple = (start_shift, start_shift + duration, href_rec_inst, rec_inst,
+                          href, self.calendar)
+                self.sql_ex(recs_sql_s, stuple)
         else:
-            rrange = rec_id.params.get('RANGE')
+            series = list()
+            if compact and prepared.period is not None:
+                series, times = compact_times(times, prepared.period)
+            recs_sql_s = (
+                'INSERT OR REPLACE INTO {0} '
+                '(dtstart, dtend, href, hrefrecuid, recuid, calendar)'
+                'VALUES (?, ?, ?, ?, ?, ?);'.format(recs_table))
+            self.sql_many(recs_sql_s, (
+                (dbstart, dbend, href, href_rec_inst,
+                 dbstart if rec_inst is None else rec_inst, self.calendar)
+                for dbstart, dbend in times))
+            _insert_series(self.cursor, self.calendar_id, href, href_rec_inst,
+                           int(recs_table == 'recs_float'), series)
 
-        # testing on datetime.date won't work as datetime is a child of date
-        all_day_event = not isinstance(vevent['DTSTART'].dt, datetime.datetime)
-        if all_day_event:
-            recs_table = 'recs_float'
-        else:
-            recs_table = 'recs_loc'
+        if prepared.until is not None:
+            sql_s = ('INSERT OR REPLACE INTO horizons (href, calendar, until) '
+                     'VALUES (?, ?, ?);')
+            self.sql_ex(sql_s, (href, self.calendar, prepared.until))
+            self._min_horizon = None
 
-        thisandfuture = (rrange == THISANDFUTURE)
-        if thisandfuture:
-            start_shift, duration = calc_shift_deltas(vevent)
-            start_shift = start_shift.days * 3600 * 24 + start_shift.seconds
-            duration = duration.days * 3600 * 24 + duration.seconds
-
-        dtstartend = aux.expand(vevent, self.locale['default_timezone'], href)
-        for dtstart, dtend in dtstartend:
-            if all_day_event:
-                dbstart = aux.to_unix_time(dtstart)
-                dbend = aux.to_unix_time(dtend)
-                if rec_id is not None:
-                    rec_inst = aux.to_unix_time(rec_id.dt)
-                    href_rec_inst = href + str(rec_inst)
-                else:
-                    rec_inst = dbstart
-                    href_rec_inst = href
-            else:
-                # TODO: extract non-Olson TZs from params['TZID']
-                # perhaps better done in event/vevent or directly in icalendar
-                if dtstart.tzinfo is None:
-                    dtstart = self.locale['default_timezone'].localize(dtstart)
-                if dtend.tzinfo is None:
-                    dtend = self.locale['default_timezone'].localize(dtend)
-                dbstart = aux.to_unix_time(dtstart)
-                dbend = aux.to_unix_time(dtend)
-
-                if rec_id is not None:
-                    recstart = rec_id.dt
-                    if recstart.tzinfo is None:
-                        recstart = self.locale['default_timezone'].localize(recstart)
-                    recstart = str(aux.to_unix_time(recstart))
-                    rec_inst = recstart
-                    href_rec_inst = href + rec_inst
-                else:
-                    rec_inst = dbstart
-                    href_rec_inst = href
-
-            if thisandfuture:
-                recs_sql_s = (
-                    'UPDATE {0} SET dtstart = recuid + ?, dtend = recuid + ?, hrefrecuid=? '
-                    'WHERE recuid >= ?;'.format(recs_table))
-                stuple = (start_shift, start_shift + duration, href_rec_inst, rec_inst)
+        if prepared.expansion is not None:
+            last_used = int(time.time() * 1000)
+            if prepared.expanded:
+                sql_s = ('INSERT OR REPLACE INTO expansions (key, times, last_used) '
+                         'VALUES (?, ?, ?);')
+                self.sql_ex(sql_s, (prepared.expansion, pack_times(prepared.times),
+                                    last_used))
             else:
-                recs_sql_s = (
-                    'INSERT OR REPLACE INTO {0} '
-                    '(dtstart, dtend, href, hrefrecuid, recuid, calendar)'
-                    'VALUES (?, ?, ?, ?, ?, ?);'.format(recs_table))
-                stuple = (dbstart, dbend, href, href_rec_inst, rec_inst, self.calendar)
-            self.sql_ex(recs_sql_s, stuple)
+                # `times` came from the expansions table, it is only marked
+                # as used
+                sql_s = 'UPDATE expansions SET last_used = ? WHERE key = ?;'
+                self.sql_ex(sql_s, (last_used, prepared.expansion))
 
         sql_s = ('INSERT INTO events '
-                 '(item, etag, href, calendar, hrefrecuid) '
-                 'VALUES (?, ?, ?, ?, ?);')
-        stuple = (vevent.to_ical().decode('utf-8'),
-                  etag, href, self.calendar, href_rec_inst)
+                 '(item, etag, href, calendar, hrefrecuid, summary, location, '
+                 'recurring, allday, tzname) '
+                 'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);')
+        stuple = (prepared.item, etag, href, self.calendar, href_rec_inst) + \
+            prepared.display
         self.sql_ex(sql_s, stuple)
+        if self._fts:
+            sql_s = ('INSERT INTO events_fts '
+                     '(rowid, summary, location, description, other) '
+                     'VALUES (?, ?, ?, ?, ?);')
+            self.sql_ex(sql_s, (self.cursor.lastrowid, ) + prepared.text)
+
+    def cached_expansion(self, key):
+        """the instances of a recurring event, if an event with the same
+        recurrence has been inserted before
+
+        :param key: see `expansion_key`
+        :type key: str
+        :returns: the instances' start and end unix times or None
+        :rtype: list(tuple(int, int)) or None
+        """
+        result = self.sql_ex('SELECT times FROM expansions WHERE key = ?;', (key, ))
+        if not result:
+            return None
+        return unpack_times(result[0][0])
+
+    def _evict_expansions(self):
+        """delete the least recently used entries of the expansions table, if
+        it has more than EXPANSION_CACHE_SIZE"""
+        count = self.sql_ex('SELECT count(*) FROM expansions;')[0][0]
+        if count > EXPANSION_CACHE_SIZE:
+            sql_s = ('DELETE FROM expansions WHERE key IN '
+                     '(SELECT key FROM expansions ORDER BY last_used, rowid LIMIT ?);')
+            self.sql_ex(sql_s, (count - EXPANSION_CACHE_SIZE, ))
+
+    def _extend_horizons(self, end):
+        """make sure all instances of lazily expanded events starting before
+        `end` are in the recursion tables
+
+        :param end: unix time
+        :type end: int
+        """
+        # the unix times of allday events and of `until` are not really in
+        # UTC, a day of slack covers any difference
+        end = end + 24 * 3600
+        if self._min_horizon is None:
+            sql_s = 'SELECT min(until) FROM horizons WHERE calendar = ?;'
+            self._min_horizon = self.sql_ex(sql_s, (self.calendar, ))[0][0]
+        if self._min_horizon is None or end <= self._min_horizon:
+            return
+
+        until = (datetime.datetime.utcfromtimestamp(end) +
+                 max(self.expansion_horizon or datetime.timedelta(0),
+                     datetime.timedelta(days=1)))
+        sql_s = ('SELECT horizons.href, until, etag, item FROM horizons '
+                 'JOIN events ON horizons.href = events.hrefrecuid AND '
+                 'horizons.calendar = events.calendar '
+                 'WHERE horizons.calendar = ? AND until < ?;')
+        result = self.sql_ex(sql_s, (self.calendar, end))
+        logger.debug('expanding {0} events of calendar {1} up to {2}'
+                     .format(len(result), self.calendar, until))
+        with self.at_once():
+            for href, old_until, etag, item in result:
+                self._extend_impl(icalendar.Event.from_ical(item), href,
+                                  old_until, until)
+        self._min_horizon = None
+
+    def _extend_impl(self, vevent, href, since, until):
+        """insert the instances of an open ended recurring event between
+        `since` (unix time) and `until` (datetime)"""
+        all_day_event = not isinstance(vevent['DTSTART'].dt, datetime.datetime)
+        if all_day_event:
+            recs_table = 'recs_float'
+        else:
+            recs_table = 'recs_loc'
+        try:
+            dtstartend = aux.expand(vevent, self.locale['default_timezone'],
+                                    href, until=until)
+        except Exception as error:
+            logger.warning('Could not expand {0}/{1} any further: {2}'
+                           .format(self.calendar, href, error))
+            dtstartend = list()
+        # instances which are already in the db (e.g. those replaced by
+        # RECURRENCE-ID events) must not be inserted again
+        sql_s = 'SELECT recuid FROM {0} WHERE href = ? AND calendar = ?;'.format(recs_table)
+        taken = set(int(recuid) for recuid, in self.sql_ex(sql_s, (href, self.calendar)))
+        sql_s = ('SELECT first, period, count FROM series '
+                 'WHERE href = ? AND calendar_id = ? AND allday = ?;')
+        stored = self.sql_ex(sql_s, (href, self.calendar_id, int(all_day_event)))
+        default_tz = self.locale['default_timezone']
+        times = [
+            (dbstart, dbend) for dbstart, dbend
+            in db_times(dtstartend, all_day_event, default_tz)
+            if dbstart > since - 24 * 3600 and dbstart not in taken and not any(
+                first <= dbstart < first + count * period and
+                (dbstart - first) % period == 0
+                for first, period, count in stored)]
+        series = list()
+        period = series_period(vevent)
+        if period is not None:
+            series, times = compact_times(times, period)
+        sql_s = ('INSERT OR IGNORE INTO {0} '
+                 '(dtstart, dtend, href, hrefrecuid, recuid, calendar)'
+                 'VALUES (?, ?, ?, ?, ?, ?);'.format(recs_table))
+        self.sql_many(sql_s, ((dbstart, dbend, href, href, dbstart, self.calendar)
+                              for dbstart, dbend in times))
+        _insert_series(self.cursor, self.calendar_id, href, href,
+                       int(all_day_event), series)
+        sql_s = 'UPDATE horizons SET until = ? WHERE href = ? AND calendar = ?;'
+        self.sql_ex(sql_s, (aux.to_unix_time(until), href, self.calendar))
 
     def get_ctag(self):
         stuple = (self.calendar, )
@@ -365,9 +875,16 @@ class SQLiteDb(object):
         :param etag: only there for compatiblity with vdirsyncer's Storage,
                      we always delete
         """
-        for table in ['recs_loc', 'recs_float']:
+        self.vevent_cache.clear()
+        for table in ['recs_loc', 'recs_float', 'horizons', 'files']:
             sql_s = 'DELETE FROM {0} WHERE href = ? AND calendar = ?;'.format(table)
             self.sql_ex(sql_s, (href, self.calendar))
+        sql_s = 'DELETE FROM series WHERE href = ? AND calendar_id = ?;'
+        self.sql_ex(sql_s, (href, self.calendar_id))
+        if self._fts:
+            sql_s = ('DELETE FROM events_fts WHERE rowid IN '
+                     '(SELECT rowid FROM events WHERE href = ? AND calendar = ?);')
+            self.sql_ex(sql_s, (href, self.calendar))
         sql_s = 'DELETE FROM events WHERE href = ? AND calendar = ?;'
         self.sql_ex(sql_s, (href, self.calendar))
 
@@ -375,67 +892,68 @@ class SQLiteDb(object):
         """
         :returns: list of (href, etag)
         """
-        sql_s = 'SELECT href, etag FROM events WHERE calendar = ?;'
-        return list(set(self.sql_ex(sql_s, (self.calendar, ))))
+        sql_s = 'SELECT DISTINCT href, etag FROM events WHERE calendar = ?;'
+        return self.sql_ex(sql_s, (self.calendar, ))
 
-    def get_time_range(self, start, end):
-        """returns
-        :type start: datetime.datetime
-        :type end: datetime.datetime
-        """
-        start = time.mktime(start.timetuple())
-        end = time.mktime(end.timetuple())
-        sql_s = ('SELECT recs_loc.hrefrecuid, dtstart, dtend FROM '
-                 'recs_loc JOIN events ON '
-                 'recs_loc.hrefrecuid = events.hrefrecuid AND '
-                 'recs_loc.calendar = events.calendar WHERE '
-                 '(dtstart >= ? AND dtstart <= ? OR '
-                 'dtend >= ? AND dtend <= ? OR '
-                 'dtstart <= ? AND dtend >= ?) AND events.calendar = ?;')
-        stuple = (start, end, start, end, start, end, self.calendar)
-        result = self.sql_ex(sql_s, stuple)
-        for href_rec_inst, start, end in result:
-            start = pytz.UTC.localize(
-                datetime.datetime.utcfromtimestamp(start))
-            end = pytz.UTC.localize(datetime.datetime.utcfromtimestamp(end))
-            event = self.get(href_rec_inst, start=start, end=end)
-            yield event
-
-    def get_allday_range(self, start, end=None):
+    def list_files(self):
+        """the files of this calendar's vdir as seen during the last update
+
+        :returns: inode, size and mtime (in nanoseconds) for every href
+        :rtype: dict(str, tuple(int, int, int))
         """
-        :type start: datetime.date
-        :type end: datetime.date
+        sql_s = 'SELECT href, inode, size, mtime_ns FROM files WHERE calendar = ?;'
+        return dict((href, (inode, size, mtime_ns)) for href, inode, size, mtime_ns
+                    in self.sql_ex(sql_s, (self.calendar, )))
+
+    def update_files(self, files):
+        """save the inode, size and mtime (in nanoseconds) of files
+
+        :param files: href and (inode, size, mtime_ns) of each file
+        :type files: iterable(tuple(str, tuple(int, int, int)))
         """
-        assert isinstance(start, datetime.date) and not isinstance(start, datetime.datetime)
-        strstart = aux.to_unix_time(start)
-        if end is None:
-            end = start + datetime.timedelta(days=1)
-        assert isinstance(end, datetime.date) and not isinstance(end, datetime.datetime)
-        strend = aux.to_unix_time(end)
-        sql_s = ('SELECT recs_float.hrefrecuid, dtstart, dtend FROM '
-                 'recs_float JOIN events ON '
-                 'recs_float.hrefrecuid = events.hrefrecuid AND '
-                 'recs_float.calendar = events.calendar WHERE '
-                 '(dtstart >= ? AND dtstart < ? OR '
-                 'dtend > ? AND dtend <= ? OR '
-                 'dtstart <= ? AND dtend > ? ) AND events.calendar = ?;')
-        stuple = (strstart, strend, strstart, strend, strstart, strend, self.calendar)
-        result = self.sql_ex(sql_s, stuple)
-        for href_rec_inst, start, end in result:
-            start = datetime.date.fromtimestamp(start)
-            end = datetime.date.fromtimestamp(end)
-            event = self.get(href_rec_inst, start=start, end=end)
-            yield event
+        sql_s = ('INSERT OR REPLACE INTO files (href, calendar, inode, size, mtime_ns) '
+                 'VALUES (?, ?, ?, ?, ?);')
+        self.sql_many(sql_s, ((href, self.calendar) + tuple(stat) for href, stat in files))
+
+    def get_time_range(self, start, end, occurrences=False):
+        """see the module level `get_time_range`"""
+        return get_time_range([self], start, end, occurrences)
+
+    def get_allday_range(self, start, end=None, occurrences=False):
+        """see the module level `get_allday_range`"""
+        return get_allday_range([self], start, end, occurrences)
 
     def get(self, href_rec_inst, start=None, end=None):
         """returns the Event matching href_rec_inst, if start and end are given, a
         specific Event from a Recursion set is returned, otherwise the Event
         returned exactly as saved in the db
+
+        :raises: EventNotFound if there is no such event (e.g. it has been
+                 deleted since an Occurrence of it was read)
         """
-        sql_s = 'SELECT href, etag, item FROM events WHERE hrefrecuid = ?;'
-        result = self.sql_ex(sql_s, (href_rec_inst, ))
+        sql_s = ('SELECT href, etag, item FROM events '
+                 'WHERE hrefrecuid = ? AND calendar = ?;')
+        result = self.sql_ex(sql_s, (href_rec_inst, self.calendar))
+        if not result:
+            raise EventNotFound('{0} not found in calendar {1}'.format(
+                href_rec_inst, self.calendar))
         href, etag, item = result[0]
-        return Event(item,
+        return self._construct_event(
+            item, href, etag, href_rec_inst, start=start, end=end)
+
+    def _construct_occurrence(self, href, etag, href_rec_inst, start, end,
+                              summary, location, recurring, allday, tzname):
+        """build an Occurrence from a row of the recursion tables and the
+        display columns of the events table"""
+        return Occurrence(
+            self.calendar, href, etag, href_rec_inst, start, end, summary,
+            location, bool(recurring), bool(allday), tzname, self.locale,
+            functools.partial(self.get, href_rec_inst, start=start, end=end))
+
+    def _construct_event(self, item, href, etag, href_rec_inst, start=None, end=None):
+        """build an Event from a row of the events table"""
+        vevent = self.vevent_cache.get((self.calendar, href_rec_inst, etag), item)
+        return Event(vevent,
                      locale=self.locale,
                      start=start,
                      end=end,
@@ -445,14 +963,647 @@ class SQLiteDb(object):
                      recuid=href_rec_inst,
                      )
 
-    def search(self, search_string):
-        sql_s = ('SELECT hrefrecuid FROM events '
-                 'WHERE item LIKE (?) and calendar = (?)')
-        stuple = ('%' + search_string + '%', self.calendar)
-        result = self.sql_ex(sql_s, stuple)
-        for href_rec_inst, in result:
-            event = self.get(href_rec_inst)
-            yield event
+    def search(self, search_string, start=None, end=None, field=None, limit=None):
+        """see the module level `search`"""
+        return search([self], search_string, start=start, end=end,
+                      field=field, limit=limit)
+
+
+def _in_calendars(dbs, column='calendar'):
+    """an SQL condition (and its parameters) matching the calendars of
+    `dbs`"""
+    return ('{0} IN ({1})'.format(column, ', '.join('?' * len(dbs))),
+            [db.calendar for db in dbs])
+
+
+def instances_query(dbs, table, start=None, end=None, href=None):
+    """an SQL query (and its parameters) for the calendar, hrefrecuid,
+    dtstart and dtend of all instances of the calendars of `dbs` which would
+    be in `table` (recs_loc or recs_float), whether they are saved as rows of
+    that table or as series
+
+    Only those instances of a series which start before `end` and end after
+    `start` are generated.
+
+    :param start: only instances ending at or after this unix time
+    :type start: int or None
+    :param end: only instances starting at or before this unix time
+    :type end: int or None
+    :param href: only instances of the event saved under this href
+    :type href: str or None
+    :rtype: tuple(str, list)
+    """
+    # the primary key (href, recuid, calendar) finds the rows of one event
+    # faster than the indexes on (calendar, dtstart/dtend), a unary + keeps
+    # sqlite from using those
+    in_calendars, rows_stuple = _in_calendars(
+        dbs, 'calendar' if href is None else '+calendar')
+    rows_sql_s = ('SELECT calendar, hrefrecuid, dtstart, dtend FROM {0} WHERE {1}'
+                  .format(table, in_calendars))
+    in_ids = _in_calendars(dbs, 'calendar_id')[0]
+    series_stuple = [db.calendar_id for db in dbs] + [int(table == 'recs_float')]
+    series_sql_s = 'FROM series WHERE {0} AND allday = ?'.format(in_ids)
+    if href is not None:
+        rows_sql_s += ' AND href = ?'
+        rows_stuple.append(href)
+        series_sql_s += ' AND href = ?'
+        series_stuple.append(href)
+    # the indexes of the first and last instance of each series in range
+    first_k = last_k = None
+    if start is not None:
+        start = int(start)
+        rows_sql_s += ' AND dtend >= ?'
+        rows_stuple.append(start)
+        series_sql_s += ' AND first + (count - 1) * period + duration >= ?'
+        series_stuple.append(start)
+        # sqlite's integer division truncates, which is fine as long as
+        # the result is not negative
+        first_k = 'max(0, (? - duration - first + period - 1) / period)'
+    if end is not None:
+        end = int(end)
+        rows_sql_s += ' AND dtstart <= ?'
+        rows_stuple.append(end)
+        series_sql_s += ' AND first <= ?'
+        series_stuple.append(end)
+        last_k = 'min(count - 1, (? - first) / period)'
+    series_sql_s = (
+        'SELECT calendar_id, hrefrecuid, first, period, duration, {0} AS first_k, '
+        '{1} AS last_k '.format(first_k or '0', last_k or 'count - 1') +
+        series_sql_s)
+    series_stuple = [one for one in [start, end] if one is not None] + series_stuple
+    sql_s = (
+        'WITH RECURSIVE instances '
+        '(calendar_id, hrefrecuid, dtstart, duration, period, remaining) AS ('
+        'SELECT calendar_id, hrefrecuid, first + first_k * period, duration, '
+        'period, last_k - first_k FROM ({0}) WHERE first_k <= last_k '
+        'UNION ALL '
+        'SELECT calendar_id, hrefrecuid, dtstart + period, duration, period, '
+        'remaining - 1 FROM instances WHERE remaining > 0) '
+        '{1} UNION ALL '
+        'SELECT calendar, hrefrecuid, dtstart, dtstart + duration FROM instances '
+        'JOIN calendar_ids ON calendar_ids.id = instances.calendar_id'
+        .format(series_sql_s, rows_sql_s))
+    return sql_s, series_stuple + rows_stuple
+
+
+# the columns of the events table an Occurrence is built from
+DISPLAY_COLUMNS = 'summary, location, recurring, allday, tzname'
+
+
+def _construct(db, occurrences, columns, href, etag, href_rec_inst, start, end):
+    """build an Occurrence (or an Event) from the `columns` selected from the
+    events table"""
+    if occurrences:
+        return db._construct_occurrence(href, etag, href_rec_inst, start, end,
+                                        *columns)
+    return db._construct_event(columns[0], href, etag, href_rec_inst,
+                               start=start, end=end)
+
+
+def get_time_range(dbs, start, end, occurrences=False, href=None):
+    """the datetime events of the calendars of `dbs` between `start` and
+    `end`, ordered by their start
+
+    All `dbs` must share the same db connection (all SQLiteDbs of the same
+    db file do), the events of all of them are fetched with one query.
+
+    :type dbs: list(SQLiteDb)
+    :type start: datetime.datetime
+    :type end: datetime.datetime
+    :param occurrences: return Occurrences instead of Events, which do not
+                        need parsing the events' iCalendar data
+    :type occurrences: bool
+    :param href: only return the instances of the event saved under `href`
+    :type href: str or None
+    :rtype: generator(event.Event or event.Occurrence)
+    """
+    start = time.mktime(start.timetuple())
+    end = time.mktime(end.timetuple())
+    for db in dbs:
+        db._extend_horizons(end)
+    by_name = dict((db.calendar, db) for db in dbs)
+    recs_sql_s, stuple = instances_query(dbs, 'recs_loc', start, end, href)
+    sql_s = ('SELECT recs.calendar, recs.hrefrecuid, dtstart, dtend, '
+             'events.href, etag, {0} FROM '
+             '({1}) AS recs JOIN events ON '
+             'recs.hrefrecuid = events.hrefrecuid AND '
+             'recs.calendar = events.calendar '
+             'ORDER BY dtstart;'.format(
+                 DISPLAY_COLUMNS if occurrences else 'item', recs_sql_s))
+    # iterating over a fresh cursor streams the rows, so we neither need
+    # to fetch all of them first nor query the events table once per row
+    for row in dbs[0].conn.execute(sql_s, stuple):
+        calendar, href_rec_inst, start, end, href, etag = row[:6]
+        start = pytz.UTC.localize(
+            datetime.datetime.utcfromtimestamp(start))
+        end = pytz.UTC.localize(datetime.datetime.utcfromtimestamp(end))
+        yield _construct(by_name[calendar], occurrences, row[6:], href, etag,
+                         href_rec_inst, start, end)
+
+
+def get_allday_range(dbs, start, end=None, occurrences=False, href=None):
+    """the all day events of the calendars of `dbs` between `start` and `end`
+    (or on `start`, if `end` is None), ordered by their start, see
+    `get_time_range`
+
+    :type dbs: list(SQLiteDb)
+    :type start: datetime.date
+    :type end: datetime.date
+    :type occurrences: bool
+    :type href: str or None
+    :rtype: generator(event.Event or event.Occurrence)
+    """
+    assert isinstance(start, datetime.date) and not isinstance(start, datetime.datetime)
+    strstart = aux.to_unix_time(start)
+    if end is None:
+        end = start + datetime.timedelta(days=1)
+    assert isinstance(end, datetime.date) and not isinstance(end, datetime.datetime)
+    strend = aux.to_unix_time(end)
+    for db in dbs:
+        db._extend_horizons(strend)
+    by_name = dict((db.calendar, db) for db in dbs)
+    # the boundaries are exclusive here
+    recs_sql_s, stuple = instances_query(dbs, 'recs_float', strstart + 1, strend - 1,
+                                         href)
+    sql_s = ('SELECT recs.calendar, recs.hrefrecuid, dtstart, dtend, '
+             'events.href, etag, {0} FROM '
+             '({1}) AS recs JOIN events ON '
+             'recs.hrefrecuid = events.hrefrecuid AND '
+             'recs.calendar = events.calendar '
+             'ORDER BY dtstart;'.format(
+                 DISPLAY_COLUMNS if occurrences else 'item', recs_sql_s))
+    for row in dbs[0].conn.execute(sql_s, stuple):
+        calendar, href_rec_inst, start, end, href, etag = row[:6]
+        start = datetime.date.fromtimestamp(start)
+        end = datetime.date.fromtimestamp(end)
+        yield _construct(by_name[calendar], occurrences, row[6:], href, etag,
+                         href_rec_inst, start, end)
+
+
+def search(dbs, search_string, start=None, end=None, field=None, limit=None):
+    """search the text properties of the events of the calendars of `dbs`
+    (which must share a db connection) for `search_string`
+
+    With the full text index, events matching all words of
+    `search_string` (or words starting with them) are returned, best
+    matches first. Otherwise all events containing `search_string`
+    anywhere in their raw iCalendar data are returned.
+
+    If `start` or `end` is given, the instances of the matching events
+    between those days are returned instead, ordered by their start.
+
+    :param start: only return instances ending after the beginning of
+                  this day
+    :type start: datetime.date
+    :param end: only return instances starting before this day
+    :type end: datetime.date
+    :param field: only search this property, one of `SEARCH_FIELDS`
+    :type field: str
+    :param limit: return at most this many events
+    :type limit: int
+    :rtype: generator(event.Event)
+    """
+    assert field is None or field in SEARCH_FIELDS
+    match = fts_query(search_string, field)
+    if dbs[0]._fts and match:
+        source = 'events_fts JOIN events ON events_fts.rowid = events.rowid'
+        condition = 'events_fts MATCH ?'
+        stuple = [match]
+        order = 'rank'
+        # without the index, searching a single property needs the
+        # parsed events
+        filtered = False
+    else:
+        source = 'events'
+        condition = 'item LIKE (?)'
+        stuple = ['%' + search_string + '%']
+        order = None
+        filtered = field is not None
+
+    if start is None and end is None:
+        columns = 'NULL, NULL, NULL'
+    else:
+        columns = 'recs.dtstart, recs.dtend, recs.allday'
+        order = 'recs.dtstart'
+        loc_start = loc_end = float_start = float_end = None
+        if start is not None:
+            loc_start = time.mktime(start.timetuple())
+            float_start = aux.to_unix_time(start)
+        if end is not None:
+            loc_end = time.mktime(end.timetuple())
+            float_end = aux.to_unix_time(end)
+            for db in dbs:
+                db._extend_horizons(loc_end)
+        recs = list()
+        recs_stuple = list()
+        for table, allday, rstart, rend in [
+                ('recs_loc', 0, loc_start, loc_end),
+                ('recs_float', 1, float_start, float_end)]:
+            # the boundaries are exclusive here
+            instances_sql_s, instances_stuple = instances_query(
+                dbs, table,
+                None if rstart is None else rstart + 1,
+                None if rend is None else rend - 1)
+            recs.append('SELECT calendar, hrefrecuid, dtstart, dtend, '
+                        '{0} AS allday FROM ({1})'.format(allday, instances_sql_s))
+            recs_stuple.extend(instances_stuple)
+        source += (' JOIN ({0}) AS recs ON recs.hrefrecuid = events.hrefrecuid '
+                   'AND recs.calendar = events.calendar'
+                   .format(' UNION ALL '.join(recs)))
+        stuple = recs_stuple + stuple
+
+    in_calendars, calendars = _in_calendars(dbs, 'events.calendar')
+    sql_s = ('SELECT events.calendar, events.hrefrecuid, events.href, etag, '
+             'item, {0} FROM {1} WHERE {2} AND {3}'
+             .format(columns, source, condition, in_calendars))
+    stuple.extend(calendars)
+    if order is not None:
+        sql_s += ' ORDER BY ' + order
+    if not filtered:
+        sql_s += ' LIMIT ?'
+        stuple.append(-1 if limit is None else limit)
+
+    found = 0
+    by_name = dict((db.calendar, db) for db in dbs)
+    for calendar, href_rec_inst, href, etag, item, dtstart, dtend, allday in \
+            dbs[0].conn.execute(sql_s + ';', stuple):
+        if allday is None:
+            pass
+        elif allday:
+            dtstart = datetime.date.fromtimestamp(dtstart)
+            dtend = datetime.date.fromtimestamp(dtend)
+        else:
+            dtstart = pytz.UTC.localize(datetime.datetime.utcfromtimestamp(dtstart))
+            dtend = pytz.UTC.localize(datetime.datetime.utcfromtimestamp(dtend))
+        event = by_name[calendar]._construct_event(
+            item, href, etag, href_rec_inst, start=dtstart, end=dtend)
+        if filtered:
+            text = unicode_type(event.vevent.get(field.upper(), u''))
+            if search_string.lower() not in text.lower():
+                continue
+            if limit is not None and found >= limit:
+                return
+        found += 1
+        yield event
+
+
+# everything `SQLiteDb.insert` needs to know about one vevent
+PreparedVEvent = collections.namedtuple('PreparedVEvent', [
+    'recs_table',  # the recursion table the instances go into
+    'rec_inst',  # see `rec_inst`
+    'href_rec_inst',
+    'shift',  # (start shift, duration) in seconds for THISANDFUTURE events
+    'times',  # list of the instances' (dtstart, dtend) as unix times
+    'until',  # unix time up to which an open ended RRULE has been expanded
+    'item',  # the vevent as saved in the events table
+    'text',  # the vevent's text for the full text index, see `search_text`
+    'display',  # the vevent's columns for Occurrences, see `display_columns`
+    'expansion',  # the key `times` are cached under, see `expansion_key`
+    'expanded',  # if `times` were expanded (and not found in the expansions table)
+    'period',  # see `series_period`, None for RECURRENCE-ID events
+])
+
+
+def prepare_update(vevent, href, calendar, default_tz, expansion_horizon=None,
+                   expansions=None):
+    """parse, sanitize and expand the vevents of one href
+
+    This does not need access to the db (and all arguments and the result can
+    be pickled), so it can be run in another process, see
+    `khalendar.Calendar.db_update`.
+
+    :param vevent: event(s) as found in the vdir or an icalendar.Event
+    :type vevent: unicode or icalendar.cal.Event
+    :param href: href of the event
+    :type href: str
+    :param calendar: name of the calendar, only used for logging
+    :type calendar: str
+    :param default_tz: the timezone floating events are assumed to be in
+    :type default_tz: pytz.timezone
+    :param expansion_horizon: if not None, open ended RRULEs are only
+                              expanded this far into the future
+    :type expansion_horizon: datetime.timedelta
+    :param expansions: looks up the instances of an already expanded
+                       recurrence, see `SQLiteDb.cached_expansion`
+    :type expansions: callable
+    :rtype: list(PreparedVEvent)
+    """
+    if isinstance(vevent, icalendar.cal.Event):
+        ical = vevent
+    else:
+        ical = icalendar.Event.from_ical(vevent)
+
+    # insert the (sub) events in the right order, e.g. recurrence-id events
+    # after the corresponding rrule event
+    def sort_key(vevent):
+        assert isinstance(vevent, icalendar.Event)  # REMOVE ME
+        uid = str(vevent['UID'])
+        rec_id = vevent.get(RECURRENCE_ID)
+        if rec_id is None:
+            return uid, 0
+        rrange = rec_id.params.get('RANGE')
+        if rrange == THISANDFUTURE:
+            return uid, aux.to_unix_time(rec_id.dt)
+        else:
+            return uid, 1
+
+    vevents = [aux.sanitize(c) for c in ical.walk() if c.name == 'VEVENT']
+
+    # THISANDFUTURE events modify the instances already in the db, so
+    # those need to be expanded completely right away
+    until = None
+    if expansion_horizon is not None and not any(
+            vevent.get(RECURRENCE_ID) is not None and
+            vevent[RECURRENCE_ID].params.get('RANGE') == THISANDFUTURE
+            for vevent in vevents):
+        # whole days, so the expansion of the same event can be reused
+        # during the day
+        until = datetime.datetime.combine(
+            datetime.date.today() + expansion_horizon, datetime.time.min)
+
+    prepared = list()
+    for vevent in sorted(vevents, key=sort_key):
+        check_support(vevent, href, calendar)
+        prepared.append(_prepare_vevent(vevent, href, default_tz, until,
+                                        expansions))
+    return prepared
+
+
+def _prepare_vevent(vevent, href, default_tz, until=None, expansions=None):
+    """expand (if needed) a single vevent
+
+    :param until: if given, an open ended RRULE is only expanded up to
+                  this datetime, see `aux.expand`
+    :type until: datetime.datetime
+    :param expansions: see `prepare_update`
+    :type expansions: callable
+    :rtype: PreparedVEvent
+    """
+    rec_id = vevent.get(RECURRENCE_ID)
+    if rec_id is None:
+        rrange = None
+    else:
+        rrange = rec_id.params.get('RANGE')
+
+    # testing on datetime.date won't work as datetime is a child of date
+    all_day_event = not isinstance(vevent['DTSTART'].dt, datetime.datetime)
+    if all_day_event:
+        recs_table = 'recs_float'
+    else:
+        recs_table = 'recs_loc'
+
+    shift = None
+    if rrange == THISANDFUTURE:
+        start_shift, duration = calc_shift_deltas(vevent)
+        shift = (start_shift.days * 3600 * 24 + start_shift.seconds,
+                 duration.days * 3600 * 24 + duration.seconds)
+
+    lazy = until is not None and rec_id is None and aux.open_ended(vevent)
+    rec_inst, href_rec_inst = _rec_inst(rec_id, href, all_day_event, default_tz)
+    key = expansion_key(vevent, default_tz, until)
+    times = None
+    if key is not None and expansions is not None:
+        times = expansions(key)
+    expanded = times is None
+    if expanded:
+        dtstartend = aux.expand(vevent, default_tz, href, until=until)
+        times = list(db_times(dtstartend, all_day_event, default_tz))
+    return PreparedVEvent(
+        recs_table=recs_table,
+        rec_inst=rec_inst,
+        href_rec_inst=href_rec_inst,
+        shift=shift,
+        times=times,
+        until=aux.to_unix_time(until) if lazy else None,
+        item=vevent.to_ical().decode('utf-8'),
+        text=search_text(vevent),
+        display=display_columns(vevent),
+        expansion=key,
+        expanded=expanded,
+        period=series_period(vevent) if rec_id is None else None,
+    )
+
+
+def expansion_key(vevent, default_tz, until=None):
+    """fingerprint of everything the instances of a recurring vevent depend
+    on: its DTSTART, DTEND or DURATION, RRULE, RDATE and EXDATE properties,
+    the default timezone, how far it is expanded (and khal's version)
+
+    :type vevent: icalendar.cal.Event
+    :type default_tz: pytz.timezone
+    :param until: see `aux.expand`, only RRULEs without an end depend on it
+    :type until: datetime.datetime
+    :returns: None for vevents which do not recur
+    :rtype: str or None
+    """
+    if 'RRULE' not in vevent and 'RDATE' not in vevent:
+        return None
+    recurrence = icalendar.Event()
+    for name in ['DTSTART', 'DTEND', 'DURATION', 'RRULE', 'RDATE', 'EXDATE']:
+        if name in vevent:
+            recurrence[name] = vevent[name]
+    if not aux.open_ended(vevent):
+        until = None
+    fingerprint = u'\n'.join([
+        __version__, str(default_tz), until.isoformat() if until else u'',
+        recurrence.to_ical().decode('utf-8')])
+    return hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()
+
+
+def series_period(vevent):
+    """the period (in seconds) of the RRULE of `vevent`, most of its
+    instances can be saved as series with this period
+
+    :type vevent: icalendar.cal.Event
+    :returns: None if `vevent` has no RRULE or its frequency is not a fixed
+              number of seconds
+    :rtype: int or None
+    """
+    rrule = vevent.get('RRULE')
+    if rrule is None or isinstance(rrule, list):
+        return None
+    freq = rrule.get('FREQ', [None])[0]
+    if freq not in PERIODS:
+        return None
+    return PERIODS[freq] * int(rrule.get('INTERVAL', [1])[0])
+
+
+def compact_times(times, period):
+    """split the instances of a recurring event into series of instances
+    which are `period` seconds apart and have the same duration
+
+    Instances which have no neighbour in any series (e.g. after a daylight
+    saving time change or an EXDATE) are returned as they are.
+
+    :param times: the instances' start and end unix times
+    :type times: list(tuple(int, int))
+    :type period: int
+    :returns: the series as (first start, period, count, duration) and the
+              remaining instances
+    :rtype: tuple(list(tuple(int, int, int, int)), list(tuple(int, int)))
+    """
+    # maps the start and duration the next instance of a series would have
+    # to its first start and count
+    runs = dict()
+    for start, end in sorted(times):
+        duration = end - start
+        first, count = runs.pop((start, duration), (start, 0))
+        runs[(start + period, duration)] = (first, count + 1)
+    series = list()
+    single = list()
+    for (_, duration), (first, count) in runs.items():
+        if count > 1:
+            series.append((first, period, count, duration))
+        else:
+            single.append((first, first + duration))
+    return sorted(series), sorted(single)
+
+
+def owned_times(prepared):
+    """the instances of each of the `prepared` vevents of one href which are
+    not replaced by those of a later one (e.g. instances of an RRULE event
+    replaced by a RECURRENCE-ID event), as an instance is identified by its
+    recuid in the recursion tables
+
+    :type prepared: list(PreparedVEvent)
+    :rtype: list(list(tuple(int, int)))
+    """
+    def recuids(one):
+        if one.rec_inst is None:
+            return [str(dbstart) for dbstart, _ in one.times]
+        return [str(one.rec_inst)] * len(one.times)
+
+    owners = dict()
+    for index, one in enumerate(prepared):
+        if one.shift is None:
+            for recuid in recuids(one):
+                owners[(one.recs_table, recuid)] = index
+    return [[times for times, recuid in zip(one.times, recuids(one))
+             if owners.get((one.recs_table, recuid)) == index]
+            for index, one in enumerate(prepared)]
+
+
+def pack_times(times):
+    """
+    :param times: start and end unix times
+    :type times: list(tuple(int, int))
+    :returns: `times` as saved in the expansions table, the distance of each
+              start to the previous one and each duration, compressed (those
+              repeat a lot)
+    :rtype: sqlite3.Binary
+    """
+    flat = list()
+    previous = 0
+    for start, end in times:
+        flat.extend((start - previous, end - start))
+        previous = start
+    return sqlite3.Binary(zlib.compress(struct.pack('<{0}q'.format(len(flat)), *flat)))
+
+
+def unpack_times(blob):
+    """the reverse of `pack_times`
+
+    :rtype: list(tuple(int, int))
+    """
+    packed = zlib.decompress(bytes(blob))
+    flat = struct.unpack('<{0}q'.format(len(packed) // 8), packed)
+    times = list()
+    start = 0
+    for delta, duration in zip(flat[::2], flat[1::2]):
+        start += delta
+        times.append((start, start + duration))
+    return times
+
+
+def search_text(vevent):
+    """the text of `vevent` for the columns of the full text index
+
+    :type vevent: icalendar.cal.Event
+    :returns: summary, location, description and all other text properties
+    :rtype: tuple(unicode, unicode, unicode, unicode)
+    """
+    def text(name):
+        value = vevent.get(name, u'')
+        if isinstance(value, list):
+            return u' '.join(unicode_type(one) for one in value)
+        return unicode_type(value)
+    return (text('SUMMARY'), text('LOCATION'), text('DESCRIPTION'),
+            u' '.join(text(name) for name in FTS_OTHER).strip())
+
+
+def display_columns(vevent):
+    """the values of the columns of the events table `event.Occurrence`s are
+    built from
+
+    :type vevent: icalendar.cal.Event
+    :returns: summary, location, if the event recurs, if it is an all day
+              event and the name of its DTSTART's timezone
+    :rtype: tuple(unicode, unicode, int, int, str)
+    """
+    dtstart = vevent['DTSTART']
+    allday = not isinstance(dtstart.dt, datetime.datetime)
+    tzname = None
+    if not allday:
+        tzname = getattr(dtstart.dt.tzinfo, 'zone', None) or \
+            dtstart.params.get('TZID')
+    location = vevent.get('LOCATION')
+    if location is not None:
+        location = unicode_type(location)
+    # the same as event.Event.recur
+    recurring = 'RRULE' in vevent or RECURRENCE_ID in vevent or \
+        'RDATE' in vevent
+    return (unicode_type(vevent.get('SUMMARY', u'')), location,
+            int(recurring), int(allday), tzname)
+
+
+def fts_query(search_string, field=None):
+    """turn a search string into an FTS5 query matching all events which
+    contain every word of it (or words beginning with those)
+
+    :param field: only match this column of the full text index
+    :type field: str
+    :type search_string: unicode
+    :rtype: unicode
+    """
+    query = u' '.join(u'"{0}"*'.format(word.replace(u'"', u'""'))
+                      for word in search_string.split())
+    if query and field is not None:
+        query = u'{0} : ({1})'.format(field, query)
+    return query
+
+
+def _rec_inst(rec_id, href, all_day_event, default_tz):
+    """returns the recurrence instance (None for events without a
+    RECURRENCE-ID, those use the start of each instance) and the
+    hrefrecuid of a vevent
+
+    :type rec_id: icalendar.prop.vDDDTypes or None
+    :rtype: tuple(str or int or None, str)
+    """
+    if rec_id is None:
+        return None, href
+    if all_day_event:
+        rec_inst = aux.to_unix_time(rec_id.dt)
+    else:
+        recstart = rec_id.dt
+        if recstart.tzinfo is None:
+            recstart = default_tz.localize(recstart)
+        rec_inst = str(aux.to_unix_time(recstart))
+    return rec_inst, href + str(rec_inst)
+
+
+def db_times(dtstartend, all_day_event, default_tz):
+    """convert the start and end (date)times returned by `aux.expand` into
+    the unix times saved in the recursion tables"""
+    for dtstart, dtend in dtstartend:
+        if not all_day_event:
+            # TODO: extract non-Olson TZs from params['TZID']
+            # perhaps better done in event/vevent or directly in icalendar
+            if dtstart.tzinfo is None:
+                dtstart = default_tz.localize(dtstart)
+            if dtend.tzinfo is None:
+                dtend = default_tz.localize(dtend)
+        yield aux.to_unix_time(dtstart), aux.to_unix_time(dtend)
 
 
 def check_support(vevent, href, calendar):
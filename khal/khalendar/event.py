@@ -22,6 +22,8 @@
 
 """this module will the event model, hopefully soon in a cleaned up version"""
 
+import bisect
+import copy
 import datetime
 
 import icalendar
@@ -31,7 +33,118 @@ from .aux import to_naive_utc
 from ..log import logger
 
 
-class Event(object):
+class CompactMixin(object):
+
+    """one line descriptions of events, shared by Event and Occurrence
+
+    Needs `start`, `end`, `allday`, `recur`, `summary`, `href`, `locale`
+    and `unicode_symbols`.
+    """
+
+    @property
+    def symbol_strings(self):
+        if self.unicode_symbols:
+            return dict(
+                recurring=u'\N{Clockwise gapped circle arrow}',
+                range=u'\N{Left right arrow}',
+                range_end=u'\N{Rightwards arrow to bar}',
+                range_start=u'\N{Rightwards arrow from bar}',
+                right_arrow=u'\N{Rightwards arrow}'
+            )
+        else:
+            return dict(
+                recurring=u'R',
+                range=u'<->',
+                range_end=u'->|',
+                range_start=u'|->',
+                right_arrow=u'->'
+            )
+
+    def compact(self, day, timeformat='%H:%M'):
+        """
+        returns a short description of the event
+
+        :param day: print information in regards to this day, if the event
+                    starts and ends on this day, the start and end time will be
+                    given (only the description for all day events), otherwise
+                    arrows will indicate if the events started before `day`
+                    and/or lasts longer.
+        :type day: datetime.date
+        :return: compact description of Event
+        :rtype: unicode()
+        """
+        try:
+            if self.allday:
+                return self._compact_allday(day)
+            else:
+                return self._compact_datetime(day, timeformat)
+        except Exception as e:
+            raise type(e)('Something went wrong while displaying "{}": {}'
+                          .format(self.href, str(e)))
+
+    def _compact_allday(self, day):
+        if self.recur:
+            recurstr = self.symbol_strings['recurring']
+        else:
+            recurstr = ''
+
+        if day < self.start or day + datetime.timedelta(days=1) > self.end:
+            raise ValueError('Day out of range: {}'
+                             .format(dict(day=day, start=self.start,
+                                          end=self.end)))
+        elif self.start < day and self.end > day + datetime.timedelta(days=1):
+            # event starts before and goes on longer than `day`:
+            rangestr = self.symbol_strings['range']
+        elif self.start < day:
+            # event started before `day`
+            rangestr = self.symbol_strings['range_end']
+        elif self.end > day + datetime.timedelta(days=1):
+            # event goes on longer than `day`
+            rangestr = self.symbol_strings['range_start']
+        elif self.start == self.end - datetime.timedelta(days=1) == day:
+            # only on `day`
+            rangestr = ''
+
+        return ' '.join(filter(bool, (rangestr, self.summary, recurstr)))
+
+    def _compact_datetime(self, day, timeformat='%M:%H'):
+        """compact description of this event
+
+        see compact() for description of `day`
+
+        :return: compact description of Event
+        :rtype: unicode()
+        """
+        if day < self.start.date() or day > self.end.date():
+            raise ValueError(
+                'please supply a `day` this event is scheduled on')
+        start = datetime.datetime.combine(day, datetime.time.min)
+        end = datetime.datetime.combine(day, datetime.time.max)
+        local_start = self.locale['local_timezone'].localize(start)
+        local_end = self.locale['local_timezone'].localize(end)
+        if self.recur:
+            recurstr = ' ' + self.symbol_strings['recurring']
+        else:
+            recurstr = ''
+
+        tostr = '-'
+        if self.start < local_start:
+            startstr = self.symbol_strings['right_arrow'] + ' '
+            tostr = ''
+        else:
+            startstr = self.start.strftime(timeformat)
+
+        if self.end > local_end:
+            endstr = self.symbol_strings['right_arrow'] + ' '
+            tostr = ''
+        else:
+            endstr = self.end.strftime(timeformat)
+
+        return (startstr + tostr + endstr +
+                ': ' + self.summary + recurstr)
+
+
+class Event(CompactMixin):
 
     """the base event class"""
 
@@ -105,29 +218,13 @@ class Event(object):
             if isinstance(self.vevent['dtstart'].dt, datetime.datetime):
                 start = start.astimezone(locale['local_timezone'])
                 end = end.astimezone(locale['local_timezone'])
-            self.vevent['DTSTART'].dt = start
+            # the vevent may be shared with other events (see
+            # backend.VEventCache), so the properties are replaced and not
+            # modified in place
+            self.vevent['DTSTART'] = with_dt(self.vevent['DTSTART'], start)
 
             if 'DTEND' in self.vevent.keys():
-                self.vevent['DTEND'].dt = end
-
-    @property
-    def symbol_strings(self):
-        if self.unicode_symbols:
-            return dict(
-                recurring=u'\N{Clockwise gapped circle arrow}',
-                range=u'\N{Left right arrow}',
-                range_end=u'\N{Rightwards arrow to bar}',
-                range_start=u'\N{Rightwards arrow from bar}',
-                right_arrow=u'\N{Rightwards arrow}'
-            )
-        else:
-            return dict(
-                recurring=u'R',
-                range=u'<->',
-                range_end=u'->|',
-                range_start=u'|->',
-                right_arrow=u'->'
-            )
+                self.vevent['DTEND'] = with_dt(self.vevent['DTEND'], end)
 
     @property
     def uid(self):
@@ -264,101 +361,96 @@ class Event(object):
         return u'{}: {}{}{}{}'.format(
             rangestr, self.summary, location, repitition, description)
 
-    def compact(self, day, timeformat='%H:%M'):
+    def _create_calendar(self):
         """
-        returns a short description of the event
+        create the calendar
 
-        :param day: print information in regards to this day, if the event
-                    starts and ends on this day, the start and end time will be
-                    given (only the description for all day events), otherwise
-                    arrows will indicate if the events started before `day`
-                    and/or lasts longer.
-        :type day: datetime.date
-        :return: compact description of Event
-        :rtype: unicode()
+        :returns: calendar
+        :rtype: icalendar.Calendar()
         """
-        try:
-            if self.allday:
-                return self._compact_allday(day)
-            else:
-                return self._compact_datetime(day, timeformat)
-        except Exception as e:
-            raise type(e)('Something went wrong while displaying "{}": {}'
-                          .format(self.href, str(e)))
+        calendar = icalendar.Calendar()
+        calendar.add('version', '2.0')
+        calendar.add('prodid', '-//CALENDARSERVER.ORG//NONSGML Version 1//EN')
 
-    def _compact_allday(self, day):
-        if self.recur:
-            recurstr = self.symbol_strings['recurring']
-        else:
-            recurstr = ''
+        return calendar
 
-        if day < self.start or day + datetime.timedelta(days=1) > self.end:
-            raise ValueError('Day out of range: {}'
-                             .format(dict(day=day, start=self.start,
-                                          end=self.end)))
-        elif self.start < day and self.end > day + datetime.timedelta(days=1):
-            # event starts before and goes on longer than `day`:
-            rangestr = self.symbol_strings['range']
-        elif self.start < day:
-            # event started before `day`
-            rangestr = self.symbol_strings['range_end']
-        elif self.end > day + datetime.timedelta(days=1):
-            # event goes on longer than `day`
-            rangestr = self.symbol_strings['range_start']
-        elif self.start == self.end - datetime.timedelta(days=1) == day:
-            # only on `day`
-            rangestr = ''
 
-        return ' '.join(filter(bool, (rangestr, self.summary, recurstr)))
+class Occurrence(CompactMixin):
 
-    def _compact_datetime(self, day, timeformat='%M:%H'):
-        """compact description of this event
+    """one instance of an event, with just the properties needed to show it
+    in a list of events (see `compact`)
 
-        see compact() for description of `day`
+    These are read from the db without parsing the event's iCalendar data,
+    the complete `Event` is only parsed once `event` is accessed.
+    """
 
-        :return: compact description of Event
-        :rtype: unicode()
+    def __init__(self, calendar, href, etag, recuid, start, end, summary,
+                 location, recur, allday, tzname, locale, load):
         """
-        if day < self.start.date() or day > self.end.date():
-            raise ValueError(
-                'please supply a `day` this event is scheduled on')
-        start = datetime.datetime.combine(day, datetime.time.min)
-        end = datetime.datetime.combine(day, datetime.time.max)
-        local_start = self.locale['local_timezone'].localize(start)
-        local_end = self.locale['local_timezone'].localize(end)
-        if self.recur:
-            recurstr = ' ' + self.symbol_strings['recurring']
-        else:
-            recurstr = ''
-
-        tostr = '-'
-        if self.start < local_start:
-            startstr = self.symbol_strings['right_arrow'] + ' '
-            tostr = ''
-        else:
-            startstr = self.start.strftime(timeformat)
-
-        if self.end > local_end:
-            endstr = self.symbol_strings['right_arrow'] + ' '
-            tostr = ''
+        :param start: start of this instance, in UTC for datetime events
+        :type start: datetime.date or datetime.datetime
+        :param end: see :param start:
+        :type end: datetime.date or datetime.datetime
+        :param recur: if the event recurs (or is an instance of a recurring
+                      event), see `Event.recur`
+        :type recur: bool
+        :param tzname: the timezone of the event's DTSTART, if any
+        :type tzname: str or None
+        :param load: returns the complete `Event` for this instance
+        :type load: callable
+        """
+        self.calendar = calendar
+        self.href = href
+        self.etag = etag
+        self._recuid = recuid
+        self.summary = summary
+        self.location = location
+        self.recur = recur
+        self.allday = allday
+        self.tzname = tzname
+        self.locale = locale
+        self.color = None
+        self.readonly = False
+        self.unicode_symbols = True
+        self._load = load
+        self._event = None
+
+        if allday:
+            if end == start:
+                # see Event.end
+                end += datetime.timedelta(days=1)
         else:
-            endstr = self.end.strftime(timeformat)
+            start = start.astimezone(locale['local_timezone'])
+            end = end.astimezone(locale['local_timezone'])
+        self.start = start
+        self.end = end
 
-        return (startstr + tostr + endstr +
-                ': ' + self.summary + recurstr)
+    @property
+    def event(self):
+        """the complete event
 
-    def _create_calendar(self):
+        :rtype: Event
+        :raises: EventNotFound if the event has been deleted since this
+                 Occurrence was read
         """
-        create the calendar
+        if self._event is None:
+            self._event = self._load()
+            self._event.color = self.color
+            self._event.readonly = self.readonly
+            self._event.unicode_symbols = self.unicode_symbols
+        return self._event
 
-        :returns: calendar
-        :rtype: icalendar.Calendar()
-        """
-        calendar = icalendar.Calendar()
-        calendar.add('version', '2.0')
-        calendar.add('prodid', '-//CALENDARSERVER.ORG//NONSGML Version 1//EN')
 
-        return calendar
+def with_dt(prop, dt):
+    """return a copy of the date(time) property `prop` with `dt` as value
+
+    :type prop: icalendar.prop.vDDDTypes
+    :type dt: datetime.date or datetime.datetime
+    :rtype: icalendar.prop.vDDDTypes
+    """
+    prop = copy.copy(prop)
+    prop.dt = dt
+    return prop
 
 
 def create_timezone(tz, first_date=None, last_date=None):
@@ -389,29 +481,73 @@ def create_timezone(tz, first_date=None, last_date=None):
     As this information is not provided by pytz at all, there is no
     easy solution, we'd really need to ship another version of the OLSON DB.
 
+    The generated components are cached (per timezone and range of
+    transition times), the returned component is therefore shared and must
+    not be modified.
     """
 
     # TODO last_date = None, recurring to infinity
 
     first_date = datetime.datetime.today() if not first_date else to_naive_utc(first_date)
     last_date = datetime.datetime.today() if not last_date else to_naive_utc(last_date)
+    first_num, last_num = _transition_window(tz._utc_transition_times,
+                                             first_date, last_date)
+
+    key = (tz.zone, first_num, last_num)
+    if key not in _vtimezone_cache:
+        if len(_vtimezone_cache) >= VTIMEZONE_CACHE_SIZE:
+            _vtimezone_cache.clear()
+        _vtimezone_cache[key] = _create_timezone(tz, first_num, last_num)
+    return _vtimezone_cache[key]
+
+
+# VTIMEZONE components already generated by create_timezone
+_vtimezone_cache = dict()
+VTIMEZONE_CACHE_SIZE = 256
+
+
+def _transition_window(transition_times, first_date, last_date):
+    """the indexes of the first and last transition times needed to cover
+    `first_date` to `last_date`: the last transition before `first_date` and
+    the first one after `last_date`
+
+    :param transition_times: sorted transition times, the first one is
+                             always included
+    :type transition_times: list(datetime.datetime)
+    :type first_date: datetime.datetime
+    :type last_date: datetime.datetime
+    :rtype: tuple(int, int)
+    """
+    first_tt, last_tt = transition_times[0], transition_times[-1]
+
+    first_num = bisect.bisect_left(transition_times, first_date) - 1
+    if first_num < 0 or transition_times[first_num] == first_tt:
+        first_num = 0
+    else:
+        # the first of several equal transition times
+        first_num = bisect.bisect_left(transition_times,
+                                       transition_times[first_num])
+
+    last_num = bisect.bisect_right(transition_times, last_date)
+    if last_num == len(transition_times) or \
+            transition_times[last_num] == last_tt:
+        last_num = len(transition_times) - 1
+    return first_num, last_num
+
+
+def _create_timezone(tz, first_num, last_num):
+    """
+    :param first_num: index of the first transition time to include
+    :type first_num: int
+    :param last_num: index of the last transition time to include
+    :type last_num: int
+    :rtype: icalendar.Timezone()
+    """
     timezone = icalendar.Timezone()
     timezone.add('TZID', tz)
 
     dst = {one[2]: 'DST' in two.__repr__() for one, two in iteritems(tz._tzinfos)}
 
-    # looking for the first and last transition time we need to include
-    first_num, last_num = 0, len(tz._utc_transition_times) - 1
-    first_tt = tz._utc_transition_times[0]
-    last_tt = tz._utc_transition_times[-1]
-    for num, dt in enumerate(tz._utc_transition_times):
-        if dt > first_tt and dt < first_date:
-            first_num = num
-            first_tt = dt
-        if dt < last_tt and dt > last_date:
-            last_num = num
-            last_tt = dt
-
     timezones = dict()
     for num in range(first_num, last_num + 1):
         name = tz._transition_info[num][2]
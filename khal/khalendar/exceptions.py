@@ -55,6 +55,11 @@ class UpdateFailed(Error):
     """could not update the event in the database"""
 
 
+class EventNotFound(Error):
+
+    """the event is not (or no longer) in the database"""
+
+
 class UnsupportedRecursion(Error):
 
     """raised if the RRULE is not understood by dateutil.rrule"""
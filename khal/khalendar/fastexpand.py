@@ -0,0 +1,300 @@
+# vim: set ts=4 sw=4 expandtab sts=4 fileencoding=utf-8:
+# Copyright (c) 2013-2015 Christian Geier et al.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+A faster way to expand the most common recurrence rules, using numpy.
+
+Plain DAILY, WEEKLY (optionally with BYDAY), MONTHLY and YEARLY rules with
+INTERVAL, COUNT and/or UNTIL are computed as arrays of (naive) unix times
+instead of iterating over the dateutil rrule, the resulting start times are
+localized in bulk. `expand` returns None for anything else (or if numpy is
+not installed), aux.expand then uses dateutil as before.
+"""
+
+import datetime
+
+import dateutil.rrule
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+EPOCH = datetime.datetime(1970, 1, 1)
+DAY = 24 * 3600
+# dateutil stops at the end of this year
+MAX_DAY = (datetime.datetime(datetime.MAXYEAR, 12, 31) - EPOCH).days
+MAX_MONTH = datetime.MAXYEAR * 12 + 11
+
+# per timezone: its transition times (as unix times), the offset after each
+# transition and the tzinfo used after each transition
+_transitions_cache = dict()
+
+
+def available():
+    """
+    :returns: if numpy is installed
+    :rtype: bool
+    """
+    return numpy is not None
+
+
+def expand(rrule, rdates, exdates, timezone, allday):
+    """the start times of all instances of an event, like aux.expand
+
+    :param rrule: the event's RRULE, with dtstart and until naive datetimes
+                  in the event's timezone
+    :type rrule: dateutil.rrule.rrule
+    :param rdates: the event's RDATEs, naive and in the event's timezone
+    :type rdates: list(datetime.datetime)
+    :param exdates: the event's EXDATEs, naive and in the event's timezone
+    :type exdates: list(datetime.datetime)
+    :param timezone: the event's timezone, None for floating events
+    :type timezone: pytz.timezone
+    :param allday: if the event is an all day event
+    :type allday: bool
+    :returns: the sorted start times (datetime.date for all day events) or
+              None if this event needs to be expanded by dateutil
+    :rtype: list(datetime.datetime) or list(datetime.date) or None
+    """
+    if numpy is None:
+        return None
+    starts = _rrule_starts(rrule)
+    if starts is None or not len(starts):
+        return None
+
+    if rdates or exdates:
+        if allday or not all(isinstance(one, datetime.datetime) and
+                             one.tzinfo is None and not one.microsecond
+                             for one in rdates + exdates):
+            return None
+        if rdates:
+            starts = numpy.union1d(starts, _unix_times(rdates))
+        if exdates:
+            starts = starts[~numpy.in1d(starts, _unix_times(exdates))]
+        if not len(starts):
+            return None
+
+    if allday:
+        return (starts // DAY).astype('datetime64[D]').tolist()
+    naive = starts.astype('datetime64[s]').tolist()
+    if timezone is None:
+        return naive
+    return _localize(naive, starts, timezone)
+
+
+def _unix_times(dates):
+    """
+    :type dates: list(datetime.datetime)
+    :rtype: numpy.ndarray
+    """
+    return numpy.array([_seconds(one - EPOCH) for one in dates],
+                       dtype=numpy.int64)
+
+
+def _seconds(delta):
+    """
+    :type delta: datetime.timedelta
+    :returns: the whole seconds of `delta`
+    :rtype: int
+    """
+    return delta.days * DAY + delta.seconds
+
+
+def _rrule_starts(rrule):
+    """the instances of `rrule` as sorted (naive) unix times
+
+    :type rrule: dateutil.rrule.rrule
+    :returns: None if rrule is not supported
+    :rtype: numpy.ndarray or None
+    """
+    if not isinstance(rrule, dateutil.rrule.rrule):
+        return None
+    dtstart, until, count = rrule._dtstart, rrule._until, rrule._count
+    if dtstart.tzinfo is not None or getattr(until, 'tzinfo', None) is not None:
+        return None
+    # dateutil treats COUNT=0 like no COUNT
+    if not until and not count:
+        return None
+    if (rrule._bysetpos or rrule._byyearday or rrule._byeaster or
+            rrule._byweekno or rrule._bynweekday or rrule._bynmonthday or
+            not _only(rrule._byhour, dtstart.hour) or
+            not _only(rrule._byminute, dtstart.minute) or
+            not _only(rrule._bysecond, dtstart.second)):
+        return None
+
+    freq, interval = rrule._freq, rrule._interval
+    first_day, time_of_day = divmod(_seconds(dtstart - EPOCH), DAY)
+    last_day = MAX_DAY
+    if until:
+        last_day = min(last_day, (until - EPOCH).days)
+    if last_day < first_day:
+        return None
+
+    if freq == dateutil.rrule.DAILY:
+        if rrule._bymonth or rrule._bymonthday or rrule._byweekday:
+            return None
+        if count:
+            last_day = min(last_day, first_day + (count - 1) * interval)
+        days = numpy.arange(first_day, last_day + 1, interval, dtype=numpy.int64)
+    elif freq == dateutil.rrule.WEEKLY:
+        if rrule._bymonth or rrule._bymonthday or not rrule._byweekday:
+            return None
+        days = _weekly(first_day, last_day, interval, rrule._wkst,
+                       rrule._byweekday, count)
+    elif freq in (dateutil.rrule.MONTHLY, dateutil.rrule.YEARLY):
+        if rrule._byweekday or not _only(rrule._bymonthday, dtstart.day):
+            return None
+        if freq == dateutil.rrule.YEARLY:
+            if not _only(rrule._bymonth, dtstart.month):
+                return None
+            interval *= 12
+        elif rrule._bymonth:
+            return None
+        days = _monthly(dtstart, last_day, interval, count)
+    else:
+        return None
+
+    starts = days * DAY + time_of_day
+    if until:
+        starts = starts[starts <= _seconds(until - EPOCH)]
+    if count:
+        starts = starts[:count]
+    return starts
+
+
+def _only(values, value):
+    """
+    :returns: if `value` is the only one of `values` (one of rrule's BY*
+              parts)
+    :rtype: bool
+    """
+    return values is not None and list(values) == [value]
+
+
+def _weekly(first_day, last_day, interval, wkst, weekdays, count):
+    """
+    :returns: the days (since the epoch) on `weekdays` of every `interval`th
+              week (starting on `wkst`), beginning with the week of
+              `first_day`
+    :rtype: numpy.ndarray
+    """
+    offsets = numpy.array(sorted((day - wkst) % 7 for day in weekdays),
+                          dtype=numpy.int64)
+    # 1970-01-01 was a Thursday
+    first_week = first_day - ((first_day + 3 - wkst) % 7)
+    weeks = (last_day - first_week) // (7 * interval) + 1
+    if count:
+        weeks = min(weeks, count // len(offsets) + 2)
+    days = (first_week + numpy.arange(weeks, dtype=numpy.int64)[:, None] * 7 * interval +
+            offsets[None, :]).ravel()
+    return days[(days >= first_day) & (days <= last_day)]
+
+
+def _monthly(dtstart, last_day, interval, count):
+    """
+    :returns: the days (since the epoch) with dtstart's day of the month in
+              every `interval`th month, beginning with dtstart's month;
+              months without that day are skipped
+    :rtype: numpy.ndarray
+    """
+    first_month = dtstart.year * 12 + dtstart.month - 1
+    last_month = MAX_MONTH
+    if last_day < MAX_DAY:
+        last_date = EPOCH + datetime.timedelta(days=last_day)
+        last_month = last_date.year * 12 + last_date.month - 1
+    months = (last_month - first_month) // interval + 1
+    wanted = months
+    if count:
+        # some months might not have dtstart's day
+        wanted = min(months, count)
+    while True:
+        # numpy's months are counted from 1970-01
+        month = numpy.arange(wanted, dtype=numpy.int64) * interval + \
+            (first_month - 1970 * 12)
+        month_start = month.astype('datetime64[M]').astype('datetime64[D]')
+        month_end = (month + 1).astype('datetime64[M]').astype('datetime64[D]')
+        month_start = month_start.astype(numpy.int64)
+        length = month_end.astype(numpy.int64) - month_start
+        days = month_start[length >= dtstart.day] + dtstart.day - 1
+        if wanted == months or len(days) >= count:
+            return days[days <= last_day]
+        wanted = min(months, wanted * 2)
+
+
+def _transitions(timezone):
+    """
+    :type timezone: pytz.tzinfo.DstTzInfo
+    :rtype: tuple(numpy.ndarray, numpy.ndarray, list(datetime.tzinfo))
+    """
+    if timezone.zone not in _transitions_cache:
+        tzinfos = [timezone._tzinfos[info] for info in timezone._transition_info]
+        _transitions_cache[timezone.zone] = (
+            _unix_times(timezone._utc_transition_times),
+            numpy.array([_seconds(info[0]) for info in timezone._transition_info],
+                        dtype=numpy.int64),
+            tzinfos,
+        )
+    return _transitions_cache[timezone.zone]
+
+
+def _localize(naive, starts, timezone):
+    """localizes `naive` like timezone.localize() does, but only calls it for
+    times close to one of timezone's transitions
+
+    :param naive: the start times
+    :type naive: list(datetime.datetime)
+    :param starts: the same as (naive) unix times
+    :type starts: numpy.ndarray
+    :type timezone: pytz.timezone
+    :returns: the localized start times, ordered by their UTC time, or None
+              if some of them are the same UTC time
+    :rtype: list(datetime.datetime) or None
+    """
+    if not hasattr(timezone, '_utc_transition_times'):
+        # no transitions (e.g. UTC), localize() is cheap
+        return [timezone.localize(one) for one in naive]
+
+    transitions, offsets, tzinfos = _transitions(timezone)
+
+    def transition(times):
+        return numpy.maximum(
+            numpy.searchsorted(transitions, times, side='right') - 1, 0)
+
+    # localize() considers the transitions up to a day before and after, if
+    # there are none the offset is unambiguous
+    index = transition(starts - DAY)
+    simple = index == transition(starts + DAY)
+    utc = starts - offsets[index]
+    simple &= transition(utc) == index
+
+    localized = list()
+    for number, start in enumerate(naive):
+        if simple[number]:
+            localized.append(start.replace(tzinfo=tzinfos[index[number]]))
+        else:
+            start = timezone.localize(start)
+            utc[number] = starts[number] - _seconds(start.utcoffset())
+            localized.append(start)
+
+    if len(numpy.unique(utc)) != len(utc):
+        return None
+    return [localized[number] for number in numpy.argsort(utc, kind='mergesort')]
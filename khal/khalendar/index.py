@@ -0,0 +1,192 @@
+# vim: set ts=4 sw=4 expandtab sts=4 fileencoding=utf-8:
+# Copyright (c) 2013-2015 Christian Geier et al.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+An in-memory index of the occurrences of a CalendarCollection's calendars,
+for long running sessions (ikhal) which query the same days over and over.
+
+The occurrences are loaded one month at a time, the first time a day of that
+month is queried. For each month, the all day and the datetime occurrences
+are kept ordered by their start, together with the greatest end so far, so
+the occurrences overlapping a range of time are found by bisecting those.
+"""
+import bisect
+from calendar import timegm
+import datetime
+import time
+
+from . import aux
+
+
+class _Intervals(object):
+    """
+    Occurrences ordered by their start, which `overlapping` finds in
+    O(log n + k).
+
+    :param items: start, end (unix times) and occurrence of each
+                  occurrence, ordered by their start
+    :type items: list(tuple(int, int, event.Occurrence))
+    """
+
+    def __init__(self, items):
+        self._items = items
+        self._starts = [start for start, _, _ in items]
+        self._max_ends = list()
+        self._update_max_ends(0)
+
+    def _update_max_ends(self, first):
+        """recompute the greatest ends so far from `first` on"""
+        del self._max_ends[first:]
+        for _, end, _ in self._items[first:]:
+            self._max_ends.append(max(end, self._max_ends[-1]) if self._max_ends else end)
+
+    def overlapping(self, start, end):
+        """the occurrences which end at or after `start` and start at or
+        before `end`, ordered by their start"""
+        # the occurrences before `first` (and all which started before
+        # them) have ended before `start`
+        first = bisect.bisect_left(self._max_ends, start)
+        last = bisect.bisect_right(self._starts, end)
+        return [item for item in self._items[first:last] if item[1] >= start]
+
+    def replace(self, calendar, href, items):
+        """replace the occurrences of the event saved under `href` in
+        `calendar` with `items`"""
+        first = len(self._items)
+        for num in reversed(range(len(self._items))):
+            occurrence = self._items[num][2]
+            if occurrence.href == href and occurrence.calendar == calendar:
+                del self._items[num]
+                del self._starts[num]
+                first = num
+        for item in items:
+            num = bisect.bisect_right(self._starts, item[0])
+            self._items.insert(num, item)
+            self._starts.insert(num, item[0])
+            first = min(first, num)
+        self._update_max_ends(first)
+
+
+def _datetime_items(occurrences):
+    return [(timegm(one.start.utctimetuple()), timegm(one.end.utctimetuple()), one)
+            for one in occurrences]
+
+
+def _allday_items(occurrences):
+    return [(aux.to_unix_time(one.start), aux.to_unix_time(one.end), one)
+            for one in occurrences]
+
+
+def _month(day):
+    return day.replace(day=1)
+
+
+def _next_month(first):
+    return (first + datetime.timedelta(days=31)).replace(day=1)
+
+
+def _months(first, last):
+    """the first days of all months from `first`'s to `last`'s
+
+    :type first: datetime.date
+    :type last: datetime.date
+    :rtype: list(datetime.date)
+    """
+    months = [_month(first)]
+    while _next_month(months[-1]) <= last:
+        months.append(_next_month(months[-1]))
+    return months
+
+
+class OccurrenceIndex(object):
+    """
+    The occurrences of calendars, kept in memory once they have been loaded.
+
+    :param load: returns the all day and the datetime occurrences between two
+                 dates (inclusive) of all calendars, or only those of the
+                 event whose calendar and href are passed as well
+    :type load: callable
+    """
+
+    def __init__(self, load):
+        self._load = load
+        # the first day of each loaded month and its all day and datetime
+        # occurrences
+        self._months = dict()
+
+    def clear(self):
+        """forget all occurrences, e.g. because the db has been changed by
+        someone else"""
+        self._months = dict()
+
+    def _loaded(self, month):
+        """the intervals of `month`, loaded if they have not been yet
+
+        :rtype: tuple(_Intervals, _Intervals)
+        """
+        if month not in self._months:
+            allday, timed = self._load(
+                month, _next_month(month) - datetime.timedelta(days=1))
+            self._months[month] = (_Intervals(_allday_items(allday)),
+                                   _Intervals(_datetime_items(timed)))
+        return self._months[month]
+
+    def _collect(self, months, which, start, end):
+        """the occurrences of `months` overlapping `start` to `end`, ordered
+        by their start, each only once even if it is in several months"""
+        found = list()
+        seen = set()
+        for month in months:
+            for item in self._loaded(month)[which].overlapping(start, end):
+                occurrence = item[2]
+                key = (occurrence.calendar, occurrence._recuid, item[0])
+                if key not in seen:
+                    seen.add(key)
+                    found.append(item)
+        if len(months) > 1:
+            found.sort(key=lambda item: item[0])
+        return [item[2] for item in found]
+
+    def get_allday_by_time_range(self, start, end=None):
+        """see `CalendarCollection.get_allday_by_time_range`"""
+        if end is None:
+            end = start + datetime.timedelta(days=1)
+        months = _months(start, max(start, end - datetime.timedelta(days=1)))
+        # the boundaries are exclusive here, like in backend.get_allday_range
+        return self._collect(months, 0, aux.to_unix_time(start) + 1,
+                             aux.to_unix_time(end) - 1)
+
+    def get_datetime_by_time_range(self, start, end):
+        """see `CalendarCollection.get_datetime_by_time_range`"""
+        months = _months(start.date(), max(start, end).date())
+        return self._collect(months, 1, int(time.mktime(start.timetuple())),
+                             int(time.mktime(end.timetuple())))
+
+    def update(self, calendar, href):
+        """read the occurrences of the event saved under `href` in `calendar`
+        anew (after it has been added, changed or deleted) in all loaded
+        months"""
+        for month, (allday, timed) in list(self._months.items()):
+            new_allday, new_timed = self._load(
+                month, _next_month(month) - datetime.timedelta(days=1),
+                calendar, href)
+            allday.replace(calendar, href, _allday_items(new_allday))
+            timed.replace(calendar, href, _datetime_items(new_timed))
@@ -29,19 +29,47 @@ for caching (see backend if you're interested).
 If you want to see how the sausage is made:
     Welcome to the sausage factory!
 """
+import bisect
+from calendar import timegm
+import collections
+import datetime
+import functools
+import itertools
+import multiprocessing
 import os
 import os.path
+import stat
+import time
+import traceback
 
+try:
+    from os import scandir
+except ImportError:  # python < 3.5
+    scandir = None
+
+from vdirsyncer.exceptions import NotFoundError
 from vdirsyncer.storage import FilesystemStorage
+from vdirsyncer.utils import get_etag_from_file
 
-from . import backend
-from .event import Event
+from . import backend, snapshot
+from .index import OccurrenceIndex
+from .event import Event, Occurrence
 from .. import log
 from .exceptions import UnsupportedFeatureError, ReadOnlyCalendarError, \
     UpdateFailed
 
 logger = log.logger
 
+# only start worker processes if at least this many events need updating,
+# starting them takes longer than parsing a handful of events
+PARALLEL_THRESHOLD = 200
+
+# how many events are inserted per transaction when ingesting in parallel
+INGEST_BATCH = 500
+
+# how many vdirs are scanned at once by CalendarCollection.sync
+SCAN_THREADS = 8
+
 
 def create_directory(path):
     if not os.path.isdir(path):
@@ -50,10 +78,165 @@ def create_directory(path):
         os.makedirs(path, mode=0o750)
 
 
+# what we remember about each file of a vdir to notice when it changes
+FileStat = collections.namedtuple('FileStat', ['inode', 'size', 'mtime_ns'])
+
+
+def file_stat(stat_result):
+    """
+    :type stat_result: os.stat_result
+    :rtype: FileStat
+    """
+    mtime_ns = getattr(stat_result, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(round(stat_result.st_mtime * 10 ** 9))
+    return FileStat(stat_result.st_ino, stat_result.st_size, mtime_ns)
+
+
+def scan_vdir(path, fileext):
+    """inode, size and mtime of all items in the vdir at `path`
+
+    :param fileext: only files ending with this are items
+    :type fileext: str
+    :rtype: dict(str, FileStat)
+    """
+    files = dict()
+    if scandir is not None:
+        for entry in scandir(path):
+            if not entry.name.endswith(fileext):
+                continue
+            try:
+                if entry.is_file():
+                    files[entry.name] = file_stat(entry.stat())
+            except OSError:  # deleted in the meantime
+                pass
+    else:
+        for fname in os.listdir(path):
+            if not fname.endswith(fileext):
+                continue
+            try:
+                stat_result = os.stat(os.path.join(path, fname))
+            except OSError:
+                continue
+            if stat.S_ISREG(stat_result.st_mode):
+                files[fname] = file_stat(stat_result)
+    return files
+
+
+# set up by _init_worker in each worker process of Calendar.db_update
+_worker = dict()
+
+
+def _init_worker(path, calendar, default_tz, expansion_horizon):
+    _worker['storage'] = FilesystemStorage(path, '.ics')
+    _worker['calendar'] = calendar
+    _worker['default_tz'] = default_tz
+    _worker['expansion_horizon'] = expansion_horizon
+
+
+def _prepare_href(href):
+    """read, parse and expand the event saved under `href`, runs in a worker
+    process
+
+    :returns: href, etag, the prepared vevents (or None) and an error message
+              (or None)
+    """
+    try:
+        event, etag = _worker['storage'].get(href)
+    except Exception as error:
+        return href, None, None, str(error)
+    try:
+        prepared = backend.prepare_update(
+            event.raw, href, _worker['calendar'], _worker['default_tz'],
+            _worker['expansion_horizon'])
+        return href, etag, prepared, None
+    except (UpdateFailed, UnsupportedFeatureError) as error:
+        return href, etag, None, str(error)
+    except Exception as error:
+        logger.debug(traceback.format_exc())
+        return href, etag, None, 'Unknown exception happened: {}'.format(error)
+
+
+def _consecutive(days):
+    """split sorted `days` into lists of consecutive days
+
+    :type days: list(datetime.date)
+    :rtype: generator(list(datetime.date))
+    """
+    window = list()
+    for day in days:
+        if window and day - window[-1] != datetime.timedelta(days=1):
+            yield window
+            window = list()
+        window.append(day)
+    if window:
+        yield window
+
+
+def events_by_days(source, days, occurrences=False):
+    """the events of each of `days`
+
+    Instead of querying each day separately, the events of each range of
+    consecutive days are fetched at once and then sorted into the days they
+    take place on. An event spanning several days is returned for each of
+    them (as the same object).
+
+    :param source: where to get the events from
+    :type source: Calendar or CalendarCollection
+    :type days: list(datetime.date)
+    :param occurrences: return `event.Occurrence`s instead of `event.Event`s
+    :type occurrences: bool
+    :returns: for each of `days` (in that order): the day, its all day events
+              and its datetime events ordered by their start
+    :rtype: list(tuple(datetime.date, list(event.Event), list(event.Event)))
+    """
+    by_day = dict()
+    for window in _consecutive(sorted(set(days))):
+        by_day.update(_events_in_window(source, window, occurrences))
+    return [(day, ) + by_day[day] for day in days]
+
+
+def _events_in_window(source, days, occurrences=False):
+    """
+    :param days: consecutive days
+    :type days: list(datetime.date)
+    :rtype: dict(datetime.date, tuple(list(event.Event), list(event.Event)))
+    """
+    by_day = dict((day, (list(), list())) for day in days)
+    first, last = days[0], days[-1]
+
+    for event in source.get_allday_by_time_range(
+            first, last + datetime.timedelta(days=1), occurrences=occurrences):
+        day = max(event.start, first)
+        while day < event.end and day <= last:
+            by_day[day][0].append(event)
+            day += datetime.timedelta(days=1)
+
+    # the same bounds get_datetime_by_time_range used to be called with for
+    # each day
+    starts = [time.mktime(datetime.datetime.combine(
+        day, datetime.time.min).timetuple()) for day in days]
+    ends = [time.mktime(datetime.datetime.combine(
+        day, datetime.time.max).timetuple()) for day in days]
+    # these are ordered by their start already
+    events = source.get_datetime_by_time_range(
+        datetime.datetime.combine(first, datetime.time.min),
+        datetime.datetime.combine(last, datetime.time.max),
+        occurrences=occurrences)
+    for event in events:
+        start = timegm(event.start.utctimetuple())
+        end = timegm(event.end.utctimetuple())
+        for index in range(bisect.bisect_left(ends, start),
+                           bisect.bisect_right(starts, end)):
+            by_day[days[index]][1].append(event)
+    return by_day
+
+
 class Calendar(object):
 
     def __init__(self, name, dbpath, path, readonly=False, color='',
-                 unicode_symbols=True, locale=None):
+                 unicode_symbols=True, locale=None, expansion_horizon=None,
+                 workers=1, sync=True, lazy_db=False):
         """
         :param name: the name of the calendar
         :type name: str
@@ -69,43 +252,118 @@ class Calendar(object):
         :type unicode_symbols: bool
         :param locale: the locale settings
         :type locale: dict()
+        :param expansion_horizon: how many days into the future recurring
+                                  events without an end are expanded, None for
+                                  all of them
+        :type expansion_horizon: int or None
+        :param workers: number of processes used to parse events when
+                        updating many of them, 0 for one per cpu
+        :type workers: int
+        :param sync: if False, the db is assumed to be up to date with the
+                     vdir, e.g. because `khal watch` keeps it that way,
+                     otherwise it is updated before it is read for the first
+                     time, see `needs_sync`
+        :type sync: bool
+        :param lazy_db: if True, the db is only opened once it is needed (e.g.
+                        not if all events are read from the snapshot, see
+                        `CalendarCollection`)
+        :type lazy_db: bool
         """
         self._locale = locale
+        self._workers = workers or multiprocessing.cpu_count()
 
         self.name = name
         self.color = color
         self.path = os.path.expanduser(path)
-        self._dbtool = backend.SQLiteDb(self.name, dbpath, locale=self._locale)
+        self._dbpath = dbpath
+        self._expansion_horizon = expansion_horizon
+        self._db = None if lazy_db else self._open_db()
         create_directory(path)
         self._storage = FilesystemStorage(path, '.ics')
         self._readonly = readonly
         self._unicode_symbols = unicode_symbols
 
-        if self._db_needs_update():
-            self.db_update()
+        # if the db needs to be checked against the vdir before reading
+        # events from it, many commands never read from most calendars
+        self.needs_sync = sync
 
     @property
     def readonly(self):
         return self._readonly
 
+    def _open_db(self):
+        return backend.SQLiteDb(self.name, self._dbpath, locale=self._locale,
+                                expansion_horizon=self._expansion_horizon)
+
+    @property
+    def _dbtool(self):
+        if self._db is None:
+            self._db = self._open_db()
+        return self._db
+
     def _cover_event(self, event):
         event.color = self.color
         event.readonly = self._readonly
         event.unicode_symbols = self._unicode_symbols
         return event
 
-    def local_ctag(self):
-        return os.path.getmtime(self.path)
+    def _occurrence(self, href, etag, href_rec_inst, start, end, summary,
+                    location, recurring, allday, tzname):
+        """build an Occurrence of one of this calendar's events from a row of
+        the snapshot, the db is only opened once its `event` is needed"""
+        return self._cover_event(Occurrence(
+            self.name, href, etag, href_rec_inst, start, end, summary,
+            location, recurring, allday, tzname, self._locale,
+            functools.partial(self._get_instance, href_rec_inst, start, end)))
+
+    def _get_instance(self, href_rec_inst, start, end):
+        return self._dbtool.get(href_rec_inst, start=start, end=end)
+
+    def _record_file(self, href):
+        """remember the current inode, size and mtime of `href`'s file, so
+        db_update does not read it again"""
+        stat_result = os.stat(os.path.join(self._storage.path, href))
+        self._dbtool.update_files([(href, file_stat(stat_result))])
+
+    def scan(self):
+        """
+        :returns: inode, size and mtime of all items in the vdir
+        :rtype: dict(str, FileStat)
+        """
+        return scan_vdir(self._storage.path, self._storage.fileext)
+
+    def sync(self, files=None):
+        """update the db from the vdir if `needs_sync` and the vdir has
+        changed
 
-    def get_allday_by_time_range(self, start, end=None):
+        :param files: the result of `scan`, if the vdir has just been
+                      scanned anyway
+        :type files: dict(str, FileStat)
+        """
+        if not self.needs_sync:
+            return
+        if files is None:
+            files = self.scan()
+        if files != self._dbtool.list_files():
+            self.db_update(files)
+        self.needs_sync = False
+
+    def get_allday_by_time_range(self, start, end=None, occurrences=False):
+        self.sync()
         return [self._cover_event(event) for event in
-                self._dbtool.get_allday_range(start, end)]
+                self._dbtool.get_allday_range(start, end, occurrences)]
 
-    def get_datetime_by_time_range(self, start, end):
+    def get_datetime_by_time_range(self, start, end, occurrences=False):
+        self.sync()
         return [self._cover_event(event) for event in
-                self._dbtool.get_time_range(start, end)]
+                self._dbtool.get_time_range(start, end, occurrences)]
+
+    def get_events_by_days(self, days, occurrences=False):
+        """see `events_by_days`"""
+        return events_by_days(self, days, occurrences)
 
     def get_event(self, href):
+        self.sync()
         return self._cover_event(self._dbtool.get(href))
 
     def update(self, event):
@@ -122,6 +380,7 @@ class Calendar(object):
             else:
                 etag = self._storage.update(event.href, event, event.etag)
                 self._dbtool.update(event.vevent.to_ical(), event.href, etag=etag)
+                self._record_file(event.href)
 
     def new(self, event):
         """save a new event to the database
@@ -134,7 +393,7 @@ class Calendar(object):
                 raise ReadOnlyCalendarError()
             event.href, event.etag = self._storage.upload(event)
             self._dbtool.update(event.to_ical(), event.href, event.etag)
-            self._dbtool.set_ctag(self.local_ctag())
+            self._record_file(event.href)
 
     def delete(self, href, etag):
         """delete event from this collection
@@ -145,31 +404,79 @@ class Calendar(object):
         self._dbtool.delete(href)
 
     def _db_needs_update(self):
-        if self.local_ctag() == self._dbtool.get_ctag():
-            return False
-        else:
-            return True
+        """check if any file of the vdir has been added, changed or deleted
+        since the db was last updated"""
+        return self.scan() != self._dbtool.list_files()
 
-    def db_update(self):
+    def db_update(self, files=None):
         """update the db from the vdir,
 
         should be called after every change to the vdir
+
+        :param files: the result of `scan_vdir`, if the vdir has just been
+                      scanned anyway
+        :type files: dict(str, FileStat)
         """
-        db_hrefs = set(href for href, etag in self._dbtool.list())
-        storage_hrefs = set()
+        if files is None:
+            files = self.scan()
+        db_files = self._dbtool.list_files()
+        db_etags = dict(self._dbtool.list())
+        changed = list()
+        # files which are not in the file index with their current stat
+        unrecorded = list()
+
+        for href, stat_result in files.items():
+            if db_files.get(href) == stat_result:
+                continue
+            unrecorded.append(href)
+            if href not in db_files and href in db_etags:
+                # the db was created by an older version of khal, without
+                # a file index, or the file could not be recorded
+                etag = get_etag_from_file(os.path.join(self._storage.path, href))
+                if etag == db_etags[href]:
+                    continue
+            logger.debug('Updating {}'.format(href))
+            changed.append(href)
+        removed = set(db_etags).union(db_files).difference(files)
 
         with self._dbtool.at_once():
-            for href, etag in self._storage.list():
-                storage_hrefs.add(href)
-                dbetag = self._dbtool.get_etag(href)
-                if etag != dbetag:
-                    logger.debug('Updating {} because {} != {}'
-                                 .format(href, etag, dbetag))
+            if self._workers > 1 and len(changed) >= PARALLEL_THRESHOLD:
+                self._update_parallel(changed)
+            else:
+                for href in changed:
                     self._update_vevent(href)
-            for href in db_hrefs - storage_hrefs:
+            for href in removed:
                 self._dbtool.delete(href)
+            self._dbtool.update_files((href, files[href]) for href in unrecorded)
+        self.needs_sync = False
+        logger.debug('Calendar {}: scanned {} items, updated {}, deleted {}'
+                     .format(self.name, len(files), len(changed), len(removed)))
+
+    def db_update_hrefs(self, hrefs):
+        """update the db from the files of `hrefs` only, which are known to
+        have been added, changed or deleted
 
-            self._dbtool.set_ctag(self.local_ctag())
+        :type hrefs: iterable(str)
+        """
+        with self._dbtool.at_once():
+            for href in hrefs:
+                if not href.endswith(self._storage.fileext):
+                    continue
+                try:
+                    stat_result = os.stat(os.path.join(self._storage.path, href))
+                except OSError:
+                    stat_result = None
+                if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+                    logger.debug('Deleting {}'.format(href))
+                    self._dbtool.delete(href)
+                    continue
+                logger.debug('Updating {}'.format(href))
+                try:
+                    self._update_vevent(href)
+                except NotFoundError:  # deleted in the meantime
+                    self._dbtool.delete(href)
+                    continue
+                self._dbtool.update_files([(href, file_stat(stat_result))])
 
     def _update_vevent(self, href):
         """should only be called during db_update, does not check for
@@ -181,28 +488,93 @@ class Calendar(object):
         except Exception as e:
             if not isinstance(e, (UpdateFailed, UnsupportedFeatureError)):
                 logger.exception('Unknown exception happened.')
-            logger.warning(
-                'Skipping {}/{}: {}\n'
-                'This event will not be available in khal.'
-                .format(self.name, href, str(e))
-            )
+            self._skip(href, str(e))
             return False
 
+    def _update_parallel(self, hrefs):
+        """parse and expand the events saved under `hrefs` in a pool of
+        worker processes, the results are inserted into the db from this
+        process, `INGEST_BATCH` events per transaction
+
+        should only be called during db_update, does not check for readonly
+        """
+        logger.debug('Updating {} events with {} processes'
+                     .format(len(hrefs), self._workers))
+        pool = multiprocessing.Pool(
+            self._workers, _init_worker,
+            (self.path, self.name, self._locale['default_timezone'],
+             self._dbtool.expansion_horizon))
+        try:
+            results = pool.imap_unordered(_prepare_href, hrefs, chunksize=16)
+            while True:
+                batch = list(itertools.islice(results, INGEST_BATCH))
+                if not batch:
+                    break
+                for href, etag, prepared, error in batch:
+                    if error is None:
+                        self._dbtool.insert(prepared, href, etag)
+                    else:
+                        self._skip(href, error)
+                self._dbtool.conn.commit()
+        finally:
+            # all results have been consumed (or something went wrong), so
+            # there is nothing left for the workers to do
+            pool.terminate()
+            pool.join()
+
+    def _skip(self, href, error):
+        """remove an event khal could not understand from the db"""
+        self._dbtool.delete(href)
+        logger.warning(
+            'Skipping {}/{}: {}\n'
+            'This event will not be available in khal.'
+            .format(self.name, href, error)
+        )
+
     def new_event(self, ical):
         """creates and returns (but does not insert) new event from ical
         string"""
         return Event(ical=ical, calendar=self.name, locale=self._locale)
 
-    def search(self, search_string):
-        return [self._cover_event(event) for event in
-                self._dbtool.search(search_string)]
+    def search(self, search_string, start=None, end=None, field=None, limit=None):
+        """search this calendar's events, see `backend.SQLiteDb.search`
+
+        :rtype: generator(event.Event)
+        """
+        self.sync()
+        for event in self._dbtool.search(search_string, start=start, end=end,
+                                         field=field, limit=limit):
+            yield self._cover_event(event)
 
 
 class CalendarCollection(object):
 
-    def __init__(self):
+    def __init__(self, snapshot_db=None, index=False, all_calendars=True):
+        """
+        :param snapshot_db: if set, the path of the db all calendars are
+                            cached in, the occurrences (see `event.Occurrence`)
+                            around today are then read from a snapshot next
+                            to it as long as the db does not change (see
+                            `snapshot`)
+        :type snapshot_db: str or None
+        :param all_calendars: if the collection holds all configured
+                              calendars, only then the snapshot is written by
+                              it, other collections only read their calendars'
+                              occurrences from an existing one
+        :type all_calendars: bool
+        :param index: if True, occurrences are kept in memory once they have
+                      been read (see `index`), for long running sessions
+        :type index: bool
+        """
         self._calnames = dict()
         self._default_calendar_name = None
+        self._snapshot_db = snapshot_db
+        self._snapshot = None
+        self._all_calendars = all_calendars
+        self._index = OccurrenceIndex(self._load_occurrences) if index else None
+        # the data_version of each db connection when the index was last
+        # checked, see `_current_index`
+        self._data_versions = None
 
     @property
     def writable_names(self):
@@ -227,29 +599,210 @@ class CalendarCollection(object):
     def append(self, calendar):
         self._calnames[calendar.name] = calendar
 
-    def get_allday_by_time_range(self, start, end=None):
-        events = list()
+    def sync(self):
+        """update the db from the vdirs of all calendars which `needs_sync`,
+        the vdirs are scanned in parallel"""
+        calendars = [one for one in self.calendars if one.needs_sync]
+        if calendars and self._index is not None:
+            self._index.clear()
+        if len(calendars) > 1:
+            # scanning is mostly waiting for the file system, the db is then
+            # updated one calendar after the other
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(min(len(calendars), SCAN_THREADS))
+            try:
+                scans = pool.map(lambda one: one.scan(), calendars)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            scans = [None] * len(calendars)
+        for one, files in zip(calendars, scans):
+            one.sync(files)
+
+    def _db_groups(self):
+        """the calendars' SQLiteDbs, grouped by the db connection they share
+        (usually all of them share one)
+
+        :rtype: list(list(backend.SQLiteDb))
+        """
+        groups = collections.OrderedDict()
         for one in self.calendars:
-            events.extend(one.get_allday_by_time_range(start, end))
-        return events
+            groups.setdefault(id(one._dbtool.conn), list()).append(one._dbtool)
+        return list(groups.values())
+
+    def _query(self, query, *args, **kwargs):
+        """run `query` (one of backend's module level query functions) once
+        for all calendars sharing a db
 
-    def get_datetime_by_time_range(self, start, end):
+        :returns: the events of all calendars and if they are from more
+                  than one query
+        :rtype: tuple(list(event.Event), bool)
+        """
+        self.sync()
+        groups = self._db_groups()
         events = list()
-        for one in self.calendars:
-            events.extend(one.get_datetime_by_time_range(start, end))
+        for dbs in groups:
+            events.extend(self._calnames[event.calendar]._cover_event(event)
+                          for event in query(dbs, *args, **kwargs))
+        return events, len(groups) > 1
+
+    def update_snapshot(self):
+        """write the snapshot of the occurrences of all calendars, if there
+        should be one
+
+        :rtype: snapshot.Snapshot or None
+        """
+        if self._snapshot_db is None or not self._all_calendars:
+            # a snapshot of some calendars only would replace the one of all
+            # calendars other khal commands use
+            return None
+        groups = self._db_groups()
+        if len(groups) != 1:
+            logger.debug('Not writing a snapshot, the calendars are not '
+                         'cached in the same db')
+            return None
+        self._snapshot = snapshot.write(groups[0])
+        return self._snapshot
+
+    def _fresh_snapshot(self):
+        """the snapshot, if it holds all calendars and the db has not changed
+        since it was written, otherwise it is written anew first (if this
+        collection may write it, see `update_snapshot`)
+
+        :rtype: snapshot.Snapshot or None
+        """
+        version = snapshot.db_version(self._snapshot_db)
+        if not self._is_fresh(version):
+            # another khal process might have written a new one
+            self._snapshot = snapshot.load(self._snapshot_db)
+        if not self._is_fresh(version):
+            self.update_snapshot()
+            version = snapshot.db_version(self._snapshot_db)
+        if self._is_fresh(version):
+            return self._snapshot
+        return None
+
+    def _is_fresh(self, version):
+        return (version is not None and self._snapshot is not None and
+                self._snapshot.version == version and
+                self._snapshot.calendars.issuperset(self.names))
+
+    def _from_snapshot(self, query, *args):
+        """the Occurrences `query` (a method of `snapshot.Snapshot`) finds
+        in the snapshot of all calendars, or None if there is no snapshot
+        or it does not cover the queried range"""
+        if self._snapshot_db is None:
+            return None
+        self.sync()
+        current = self._fresh_snapshot()
+        if current is None:
+            return None
+        rows = getattr(current, query)(*args)
+        if rows is None:
+            return None
+        return [self._calnames[row[0]]._occurrence(*row[1:])
+                for row in rows if row[0] in self._calnames]
+
+    def _current_index(self):
+        """the index, after forgetting everything in it if another process
+        has written to the db since it was last used
+
+        :rtype: index.OccurrenceIndex
+        """
+        self.sync()
+        # our own changes do not change the data_version of our connection
+        versions = [dbs[0].conn.execute('PRAGMA data_version;').fetchall()[0][0]
+                    for dbs in self._db_groups()]
+        if versions != self._data_versions:
+            self._index.clear()
+            self._data_versions = versions
+        return self._index
+
+    def _load_occurrences(self, first, last, calendar=None, href=None):
+        """the all day and the datetime occurrences from `first` to `last`
+        (inclusive) of all calendars or only of the event saved under `href`
+        in `calendar`, for the index
+
+        :type first: datetime.date
+        :type last: datetime.date
+        :type calendar: str
+        :type href: str
+        :rtype: tuple(list(event.Occurrence), list(event.Occurrence))
+        """
+        end = last + datetime.timedelta(days=1)
+        start_dt = datetime.datetime.combine(first, datetime.time.min)
+        end_dt = datetime.datetime.combine(last, datetime.time.max)
+        if calendar is None:
+            return (self._get_allday(first, end, occurrences=True),
+                    self._get_datetime(start_dt, end_dt, occurrences=True))
+        one = self._calnames[calendar]
+        one.sync()
+        dbs = [one._dbtool]
+        return ([one._cover_event(event) for event in backend.get_allday_range(
+                    dbs, first, end, occurrences=True, href=href)],
+                [one._cover_event(event) for event in backend.get_time_range(
+                    dbs, start_dt, end_dt, occurrences=True, href=href)])
+
+    def _index_update(self, calendar, href):
+        """let the index know that the event saved under `href` in
+        `calendar` has been added, changed or deleted"""
+        if self._index is not None:
+            self._index.update(calendar, href)
+
+    def get_allday_by_time_range(self, start, end=None, occurrences=False):
+        """all day events between `start` and `end`, ordered by their start"""
+        if occurrences and self._index is not None:
+            return self._current_index().get_allday_by_time_range(start, end)
+        return self._get_allday(start, end, occurrences)
+
+    def _get_allday(self, start, end=None, occurrences=False):
+        if occurrences:
+            events = self._from_snapshot('get_allday_range', start, end)
+            if events is not None:
+                return events
+        events, merged = self._query(backend.get_allday_range, start, end,
+                                     occurrences=occurrences)
+        if merged:
+            events.sort(key=lambda event: event.start)
+        return events
+
+    def get_datetime_by_time_range(self, start, end, occurrences=False):
+        """datetime events between `start` and `end`, ordered by their
+        start"""
+        if occurrences and self._index is not None:
+            return self._current_index().get_datetime_by_time_range(start, end)
+        return self._get_datetime(start, end, occurrences)
+
+    def _get_datetime(self, start, end, occurrences=False):
+        if occurrences:
+            events = self._from_snapshot('get_time_range', start, end)
+            if events is not None:
+                return events
+        events, merged = self._query(backend.get_time_range, start, end,
+                                     occurrences=occurrences)
+        if merged:
+            events.sort(key=lambda event: event.start)
         return events
 
+    def get_events_by_days(self, days, occurrences=False):
+        """the events of each of `days` in all calendars, see
+        `events_by_days`"""
+        self.sync()
+        return events_by_days(self, days, occurrences)
+
     def update(self, event):
         self._calnames[event.calendar].update(event)
+        self._index_update(event.calendar, event.href)
 
     def new(self, event, collection=None):
-        if collection:
-            self._calnames[collection].new(event)
-        else:
-            self._calnames[event.calendar].new(event)
+        calendar = collection or event.calendar
+        self._calnames[calendar].new(event)
+        self._index_update(calendar, event.href)
 
     def delete(self, href, etag, calendar):
         self._calnames[calendar].delete(href, etag)
+        self._index_update(calendar, href)
 
     def get_event(self, href, calendar):
         return self._calnames[calendar].get_event(href)
@@ -258,20 +811,31 @@ class CalendarCollection(object):
         href, etag, calendar = event.href, event.etag, event.calendar
         self._calnames[new_collection].new(event)
         self._calnames[calendar].delete(href, etag)
+        self._index_update(new_collection, event.href)
+        self._index_update(calendar, href)
 
     def new_event(self, ical, collection):
         """returns a new event"""
         return self._calnames[collection].new_event(ical)
 
     def _db_needs_update(self):
-        any([one._db_needs_update() for one in self.calendars])
+        return any([one._db_needs_update() for one in self.calendars])
 
     def db_update(self):
         for one in self.calendars:
             one.db_update()
+        if self._index is not None:
+            self._index.clear()
 
-    def search(self, search_string):
-        events = list()
-        for one in self.calendars:
-            events.extend(one.search(search_string))
-        return events
+    def search(self, search_string, start=None, end=None, field=None, limit=None):
+        """search the events of all calendars at once, see `backend.search`
+
+        :rtype: generator(event.Event)
+        """
+        self.sync()
+        events = itertools.chain.from_iterable(
+            backend.search(dbs, search_string, start=start, end=end,
+                           field=field, limit=limit)
+            for dbs in self._db_groups())
+        return (self._calnames[event.calendar]._cover_event(event)
+                for event in itertools.islice(events, limit))
@@ -0,0 +1,402 @@
+# vim: set ts=4 sw=4 expandtab sts=4 fileencoding=utf-8:
+# Copyright (c) 2013-2015 Christian Geier et al.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+A snapshot of the occurrences of all calendars around today, saved in a file
+next to the caching db, which can be read without opening the db.
+
+The snapshot holds, separately for datetime and all day events, the start
+and end (as unix times, like in the recursion tables) of each occurrence,
+ordered by their start, and the number of its event. For each event, the
+snapshot holds which strings (saved as one blob, with a table of their
+offsets) are its calendar, href, etag, hrefrecuid, summary, location and
+timezone, and if it recurs or is an all day event.
+The file is memory mapped and the occurrences of a range of time are found by
+bisecting the starts (and the greatest end so far, for events which have
+started before the range).
+
+A snapshot is only used as long as the db has not changed since it was
+written, see `db_version`.
+"""
+import bisect
+import datetime
+import mmap
+import os
+import struct
+import time
+
+import pytz
+
+from . import aux
+from .backend import DISPLAY_COLUMNS, instances_query
+from .. import log
+
+logger = log.logger
+
+MAGIC = b'khalsnap'
+
+# increase this whenever the layout of the file changes
+FORMAT_VERSION = 1
+
+# the snapshot holds the occurrences of this many days before and after today
+PAST_DAYS = 31
+FUTURE_DAYS = 366
+
+# magic, format version, the db's version (change counter, size, mtime_ns,
+# inode), the ranges of datetime and of all day occurrences held, the number
+# of calendars, datetime occurrences, all day occurrences, events and strings
+HEADER = struct.Struct('<8sIIqqqqqqqIIIII4x')
+
+# the strings of calendar, href, etag, hrefrecuid, summary, location and
+# tzname, and the flags of an event
+EVENT = struct.Struct('<8I')
+EVENT_STRINGS = 7
+RECURRING = 1
+ALLDAY = 2
+
+# the string index of None
+NONE = 0xffffffff
+
+INT64 = 'q'
+UINT32 = 'I'
+
+
+def snapshot_path(db_path):
+    return db_path + '.snapshot'
+
+
+def db_version(db_path):
+    """the version of the db at `db_path`, which changes whenever the db is
+    written to
+
+    This is the file change counter of the db's header together with the size,
+    mtime and inode of the db file. In write-ahead logging mode, sqlite does
+    not increase the change counter and changes are only written to the db
+    file once they are checkpointed, so as long as the `-wal` file is not
+    empty the db has no version.
+
+    :type db_path: str
+    :rtype: tuple(int, int, int, int) or None
+    """
+    try:
+        if os.path.getsize(db_path + '-wal'):
+            return None
+    except OSError:  # no -wal file
+        pass
+    try:
+        with open(db_path, 'rb') as db_file:
+            stat_result = os.fstat(db_file.fileno())
+            db_file.seek(24)
+            header = db_file.read(4)
+    except (IOError, OSError):
+        return None
+    if len(header) < 4:
+        return None
+    mtime_ns = getattr(stat_result, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(round(stat_result.st_mtime * 10 ** 9))
+    return (struct.unpack('>I', header)[0], stat_result.st_size, mtime_ns,
+            stat_result.st_ino)
+
+
+def _checkpoint(conn, db_path):
+    """write all changes from the `-wal` file into the db, then return the
+    db's version (or None if that was not possible right now)"""
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE);').fetchall()
+    return db_version(db_path)
+
+
+def _pack(code, numbers):
+    """`numbers` packed as struct format `code`, padded to a multiple of 8
+    bytes"""
+    packed = struct.pack('<{0}{1}'.format(len(numbers), code), *numbers)
+    return packed + b'\0' * (-len(packed) % 8)
+
+
+def write(dbs, today=None):
+    """write the snapshot of the occurrences of the calendars of `dbs`
+
+    All `dbs` must share the same db connection. Nothing is written (and None
+    is returned) if the db changes while the snapshot is assembled.
+
+    :type dbs: list(backend.SQLiteDb)
+    :param today: the snapshot covers the days around this one
+    :type today: datetime.date
+    :rtype: Snapshot or None
+    """
+    db_path = dbs[0].db_path
+    today = today or datetime.date.today()
+    first = today - datetime.timedelta(days=PAST_DAYS)
+    last = today + datetime.timedelta(days=FUTURE_DAYS)
+    # the same (inclusive) bounds get_time_range and get_allday_range query
+    # the recursion tables with
+    windows = [
+        int(time.mktime(datetime.datetime.combine(first, datetime.time.min).timetuple())),
+        int(time.mktime(datetime.datetime.combine(last, datetime.time.min).timetuple())),
+        aux.to_unix_time(first) + 1,
+        aux.to_unix_time(last) - 1,
+    ]
+    for db in dbs:
+        db._extend_horizons(max(windows[1], windows[3] + 1))
+
+    version = _checkpoint(dbs[0].conn, db_path)
+    if version is None:
+        return None
+    # the calendars' names are the first strings
+    calendars = [db.calendar for db in dbs]
+    strings = dict((calendar, num) for num, calendar in enumerate(calendars))
+    # the number of each event with instances in the snapshot
+    numbers = dict()
+    sections = list()
+    for table, lo, hi in [('recs_loc', windows[0], windows[1]),
+                          ('recs_float', windows[2], windows[3])]:
+        sql_s, stuple = instances_query(dbs, table, lo, hi)
+        section = list()
+        for calendar, href_rec_inst, start, end in dbs[0].conn.execute(
+                'SELECT * FROM ({0}) ORDER BY dtstart;'.format(sql_s), stuple):
+            key = (calendar, href_rec_inst)
+            section.append((int(start), int(end),
+                            numbers.setdefault(key, len(numbers))))
+        sections.append(section)
+    events = [None] * len(numbers)
+    sql_s = ('SELECT calendar, hrefrecuid, href, etag, {0} FROM events '
+             'WHERE calendar IN ({1});'.format(DISPLAY_COLUMNS, ', '.join('?' * len(dbs))))
+    for (calendar, href_rec_inst, href, etag, summary, location, recurring,
+         allday, tzname) in dbs[0].conn.execute(sql_s, calendars):
+        num = numbers.get((calendar, href_rec_inst))
+        if num is None:
+            continue
+        flags = (RECURRING if recurring else 0) | (ALLDAY if allday else 0)
+        events[num] = [
+            NONE if one is None else strings.setdefault(one, len(strings))
+            for one in (calendar, href, etag, href_rec_inst, summary,
+                        location, tzname)] + [flags]
+    missing = set(num for num, fields in enumerate(events) if fields is None)
+    if missing:
+        # instances without an event are never returned by get_time_range
+        # and get_allday_range either
+        sections = [[one for one in section if one[2] not in missing]
+                    for section in sections]
+        for num in missing:
+            events[num] = [NONE] * EVENT_STRINGS + [0]
+    if _checkpoint(dbs[0].conn, db_path) != version:
+        logger.debug('Not writing the snapshot, the db has changed meanwhile')
+        return None
+
+    blob = [one.encode('utf-8') for one in sorted(strings, key=strings.get)]
+    offsets = [0]
+    for one in blob:
+        offsets.append(offsets[-1] + len(one))
+
+    parts = [HEADER.pack(
+        MAGIC, FORMAT_VERSION, version[0], version[1], version[2], version[3],
+        windows[0], windows[1], windows[2], windows[3], len(calendars),
+        len(sections[0]), len(sections[1]), len(events), len(blob))]
+    parts.append(_pack(UINT32, offsets))
+    for section in sections:
+        # the rows are ordered by their start already
+        max_ends = list()
+        for _, end, _ in section:
+            max_ends.append(max(end, max_ends[-1]) if max_ends else end)
+        parts.append(_pack(INT64, [one[0] for one in section]))
+        parts.append(_pack(INT64, [one[1] for one in section]))
+        parts.append(_pack(INT64, max_ends))
+        parts.append(_pack(UINT32, [one[2] for one in section]))
+    for fields in events:
+        parts.append(EVENT.pack(*fields))
+    parts.extend(blob)
+
+    path = snapshot_path(db_path)
+    # several khal processes might write a snapshot at the same time
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as snapshot_file:
+        snapshot_file.write(b''.join(parts))
+    os.rename(tmp_path, path)
+    logger.debug('Wrote a snapshot of {0} occurrences of {1} events'.format(
+        len(sections[0]) + len(sections[1]), len(events)))
+    return load(db_path)
+
+
+def load(db_path):
+    """the snapshot of the db at `db_path`, whether it is up to date or not
+
+    :rtype: Snapshot or None
+    """
+    try:
+        with open(snapshot_path(db_path), 'rb') as snapshot_file:
+            buf = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return Snapshot(buf)
+    except (IOError, OSError, ValueError, struct.error) as error:
+        logger.debug('Cannot read the snapshot: {0}'.format(error))
+        return None
+
+
+class _Column(object):
+    """a read only sequence of `count` numbers of struct format `code` from
+    `offset` on, which `bisect` can search without unpacking all of them"""
+
+    def __init__(self, buf, code, offset, count):
+        self._code = code
+        self._unpack = struct.Struct('<' + code).unpack_from
+        self._buf = buf
+        self._offset = offset
+        self._itemsize = struct.calcsize(code)
+        self._count = count
+        # where the next column starts, see `_pack`
+        self.end = offset + self._itemsize * count
+        self.end += -self.end % 8
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        return self._unpack(self._buf, self._offset + index * self._itemsize)[0]
+
+    def slice(self, start, stop):
+        """the numbers from `start` to (not including) `stop`
+
+        :rtype: tuple(int)
+        """
+        return struct.unpack_from(
+            '<{0}{1}'.format(stop - start, self._code), self._buf,
+            self._offset + start * self._itemsize)
+
+
+class Snapshot(object):
+    """
+    A memory mapped snapshot file, see `write`.
+
+    :param buf: the contents of the file
+    :type buf: mmap.mmap
+    """
+
+    def __init__(self, buf):
+        header = HEADER.unpack_from(buf)
+        if header[0] != MAGIC or header[1] != FORMAT_VERSION:
+            raise ValueError('unknown snapshot format')
+        self._buf = buf
+        self.version = header[2:6]
+        self._windows = header[6:10]
+        n_calendars, n_datetime, n_allday, n_events, n_strings = header[10:]
+
+        self._strings = _Column(buf, UINT32, HEADER.size, n_strings + 1)
+        offset = self._strings.end
+        self._sections = list()
+        for count in [n_datetime, n_allday]:
+            columns = list()
+            for code in [INT64, INT64, INT64, UINT32]:
+                columns.append(_Column(buf, code, offset, count))
+                offset = columns[-1].end
+            self._sections.append(columns)
+        self._events = offset
+        self._blob = offset + EVENT.size * n_events
+        if self._blob + self._strings[n_strings] != len(buf):
+            raise ValueError('truncated snapshot')
+        # the decoded strings and flags of the events read so far
+        self._decoded = dict()
+        self.calendars = frozenset(
+            self._string(num) for num in range(n_calendars))
+
+    def _string(self, num):
+        if num == NONE:
+            return None
+        start = self._blob + self._strings[num]
+        return self._buf[start:self._blob + self._strings[num + 1]].decode('utf-8')
+
+    def _event(self, num):
+        """calendar, href, etag, hrefrecuid, summary, location, timezone and
+        flags of the event `num`"""
+        try:
+            return self._decoded[num]
+        except KeyError:
+            fields = EVENT.unpack_from(self._buf, self._events + EVENT.size * num)
+            event = tuple(self._string(one) for one in fields[:EVENT_STRINGS])
+            self._decoded[num] = event + fields[EVENT_STRINGS:]
+            return self._decoded[num]
+
+    def _occurrences(self, section, start, end):
+        """the rows of the occurrences of `section` which end at or after
+        `start` and start at or before `end` (unix times)"""
+        starts, ends, max_ends, ids = self._sections[section]
+        # occurrences before `first` (and all which started before them) have
+        # ended before `start`
+        first = bisect.bisect_left(max_ends, start)
+        last = bisect.bisect_right(starts, end)
+        if first >= last:
+            return
+        rows = zip(starts.slice(first, last), ends.slice(first, last),
+                   ids.slice(first, last))
+        for one_start, one_end, num in rows:
+            if one_end < start:
+                continue
+            (calendar, href, etag, href_rec_inst, summary, location, tzname,
+             flags) = self._event(num)
+            yield (calendar, href, etag, href_rec_inst, one_start, one_end,
+                   summary, location, bool(flags & RECURRING),
+                   bool(flags & ALLDAY), tzname)
+
+    def get_time_range(self, start, end):
+        """the datetime occurrences between `start` and `end`, ordered by
+        their start, see `backend.get_time_range`
+
+        :type start: datetime.datetime
+        :type end: datetime.datetime
+        :returns: calendar, href, etag, hrefrecuid, start, end, summary,
+                  location, if it recurs, if it is an all day event and
+                  timezone of each occurrence, or None if the snapshot does
+                  not cover all of `start` to `end`
+        :rtype: list(tuple) or None
+        """
+        start = int(time.mktime(start.timetuple()))
+        end = int(time.mktime(end.timetuple()))
+        if start < self._windows[0] or end > self._windows[1]:
+            return None
+        occurrences = list()
+        for row in self._occurrences(0, start, end):
+            occurrences.append(row[:4] + (
+                pytz.UTC.localize(datetime.datetime.utcfromtimestamp(row[4])),
+                pytz.UTC.localize(datetime.datetime.utcfromtimestamp(row[5])),
+            ) + row[6:])
+        return occurrences
+
+    def get_allday_range(self, start, end=None):
+        """the all day occurrences between `start` and `end` (or on `start`,
+        if `end` is None), ordered by their start, see `get_time_range` and
+        `backend.get_allday_range`
+
+        :type start: datetime.date
+        :type end: datetime.date
+        :rtype: list(tuple) or None
+        """
+        if end is None:
+            end = start + datetime.timedelta(days=1)
+        # the boundaries are exclusive here
+        start = aux.to_unix_time(start) + 1
+        end = aux.to_unix_time(end) - 1
+        if start < self._windows[2] or end > self._windows[3]:
+            return None
+        occurrences = list()
+        for row in self._occurrences(1, start, end):
+            occurrences.append(row[:4] + (
+                datetime.date.fromtimestamp(row[4]),
+                datetime.date.fromtimestamp(row[5]),
+            ) + row[6:])
+        return occurrences
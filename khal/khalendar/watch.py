@@ -0,0 +1,331 @@
+# vim: set ts=4 sw=4 expandtab sts=4 fileencoding=utf-8:
+# Copyright (c) 2013-2015 Christian Geier et al.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Keeps the caching db up to date with the vdirs while `khal watch` is
+running, so other invocations of khal don't need to check the vdirs for
+changes themselves.
+
+While the db is up to date, the watcher says so in a status file next to the
+db, see `is_current`.
+"""
+import ctypes
+import ctypes.util
+import errno
+import json
+import os
+import select
+import struct
+import time
+
+from .. import log
+
+logger = log.logger
+
+# how long to wait for further changes before applying them to the db, most
+# programs change several files at once
+DEBOUNCE = 0.5
+
+# apply changes after this many seconds, even if files keep changing
+MAX_DELAY = 5
+
+# how often to check the vdirs for changes if inotify is not available
+POLL_INTERVAL = 10
+
+# see inotify(7)
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class Inotify(object):
+    """a minimal wrapper around Linux' inotify API
+
+    raises OSError if inotify is not available
+    """
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError(errno.ENOSYS, 'could not find libc')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            self._raise()
+
+    def _raise(self):
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+
+    def fileno(self):
+        return self._fd
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        """
+        :returns: the watch descriptor for `path`
+        :rtype: int
+        """
+        if not isinstance(path, bytes):
+            path = path.encode('utf-8')
+        wd = self._libc.inotify_add_watch(self._fd, path, mask)
+        if wd < 0:
+            self._raise()
+        return wd
+
+    def rm_watch(self, wd):
+        """stop watching, watches of deleted files are removed by the kernel
+        already, so this fails silently"""
+        self._libc.inotify_rm_watch(self._fd, wd)
+
+    def read(self):
+        """read all pending events
+
+        :returns: watch descriptor, mask and file name of each event
+        :rtype: list(tuple(int, int, unicode))
+        """
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError as error:
+            if error.errno == errno.EAGAIN:
+                return list()
+            raise
+        events = list()
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, pos)
+            pos += _EVENT_HEADER.size
+            name = data[pos:pos + length].rstrip(b'\0').decode('utf-8', 'replace')
+            pos += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self._fd)
+
+
+def status_path(db_path):
+    """the path of the watcher's status file for the db at `db_path`"""
+    return db_path + '.watch'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as error:
+        return error.errno == errno.EPERM
+    return True
+
+
+def is_current(db_path):
+    """returns True if a running watcher reports the db at `db_path` to be up
+    to date with all vdirs
+
+    :type db_path: str
+    :rtype: bool
+    """
+    try:
+        with open(status_path(db_path)) as status_file:
+            status = json.load(status_file)
+    except (IOError, OSError, ValueError):
+        return False
+    return bool(status.get('current')) and _pid_alive(status.get('pid', 0))
+
+
+class Watcher(object):
+    """
+    Applies changes to the vdirs of a CalendarCollection's calendars to the
+    caching db.
+
+    :param collection: the calendars to watch
+    :type collection: khalendar.CalendarCollection
+    :param db_path: path of the calendars' db, the status file is saved next
+                    to it
+    :type db_path: str
+    :param use_inotify: if False, the vdirs are always polled
+    :type use_inotify: bool
+    """
+
+    def __init__(self, collection, db_path, use_inotify=True,
+                 debounce=DEBOUNCE, poll_interval=POLL_INTERVAL):
+        self._collection = collection
+        self._calendars = list(collection.calendars)
+        self._status_path = status_path(db_path)
+        self._debounce = debounce
+        self._poll_interval = poll_interval
+        self._inotify = None
+        # maps watch descriptors to calendars
+        self._watches = dict()
+        # calendars whose directory has been deleted or moved away, see
+        # `_rewatch`
+        self._unwatched = set()
+        if use_inotify:
+            try:
+                self._inotify = Inotify()
+                for calendar in self._calendars:
+                    self._watches[self._inotify.add_watch(calendar.path)] = calendar
+            except OSError as error:
+                logger.warning('Cannot use inotify ({0}), falling back to '
+                               'polling every {1} seconds'
+                               .format(error, poll_interval))
+                if self._inotify is not None:
+                    self._inotify.close()
+                self._inotify = None
+                self._watches = dict()
+
+    def run(self):
+        """update the db from the vdirs and keep it up to date until
+        interrupted"""
+        try:
+            self.update_all()
+            while True:
+                if self._inotify is None:
+                    time.sleep(self._poll_interval)
+                    self.poll()
+                else:
+                    self.wait(self._poll_interval if self._unwatched else None)
+        finally:
+            self.close()
+
+    def close(self):
+        try:
+            os.remove(self._status_path)
+        except OSError:
+            pass
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def update_all(self):
+        """update the db from all vdirs"""
+        self._set_status(False)
+        for calendar in self._calendars:
+            calendar.db_update()
+        self._updated()
+
+    def poll(self):
+        """update the db from all vdirs which have changed"""
+        changed = [calendar for calendar in self._calendars
+                   if calendar._db_needs_update()]
+        if changed:
+            self._set_status(False)
+            for calendar in changed:
+                calendar.db_update()
+            self._updated()
+
+    def wait(self, timeout=None):
+        """wait for (at most `timeout` seconds) and apply the next batch of
+        changes
+
+        While the directory of a calendar is missing, `timeout` is at most
+        the poll interval, and the directory is checked for again every time.
+        """
+        if self._unwatched:
+            timeout = self._poll_interval if timeout is None else \
+                min(timeout, self._poll_interval)
+        readable, _, _ = select.select([self._inotify], [], [], timeout)
+        if not readable and not self._unwatched:
+            return
+        self._set_status(False)
+        changes = dict()
+        overflow = False
+        start = time.time()
+        while readable:
+            for wd, mask, name in self._inotify.read():
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                elif mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    if wd in self._watches:
+                        self._unwatched.add(self._watches.pop(wd))
+                        self._inotify.rm_watch(wd)
+                elif wd in self._watches and name:
+                    changes.setdefault(self._watches[wd], set()).add(name)
+            remaining = min(self._debounce, start + MAX_DELAY - time.time())
+            if remaining <= 0:
+                break
+            readable, _, _ = select.select([self._inotify], [], [], remaining)
+
+        rewatched = self._rewatch()
+        if overflow:
+            logger.debug('Lost track of changes, checking all calendars')
+            for calendar in self._calendars:
+                if calendar not in self._unwatched:
+                    calendar.db_update()
+        else:
+            for calendar, hrefs in changes.items():
+                if calendar in self._unwatched or calendar in rewatched:
+                    continue
+                logger.debug('{0} file(s) changed in {1}'
+                             .format(len(hrefs), calendar.name))
+                calendar.db_update_hrefs(hrefs)
+            for calendar in rewatched:
+                calendar.db_update()
+        self._updated()
+
+    def _rewatch(self):
+        """watch the directories of calendars which have been deleted or
+        moved away again, if they exist (again)
+
+        :returns: the calendars which are watched again, these need to be
+                  read completely
+        :rtype: list(khalendar.Calendar)
+        """
+        rewatched = list()
+        for calendar in list(self._unwatched):
+            try:
+                wd = self._inotify.add_watch(calendar.path)
+            except OSError as error:
+                logger.debug('Cannot watch {0}: {1}'.format(calendar.path, error))
+                continue
+            self._watches[wd] = calendar
+            self._unwatched.discard(calendar)
+            rewatched.append(calendar)
+        return rewatched
+
+    def _updated(self):
+        """the db is up to date again, the snapshot is written right away so
+        other khal commands find it ready"""
+        self._collection.update_snapshot()
+        self._set_status(True)
+
+    def _set_status(self, current):
+        """write the status file atomically"""
+        # while polling, changes since the last poll are unknown, so the db
+        # is only kept warm, but never reported to be up to date, the same
+        # goes for calendars whose directory is missing
+        current = current and self._inotify is not None and not self._unwatched
+        tmp_path = self._status_path + '.tmp'
+        with open(tmp_path, 'w') as status_file:
+            json.dump({'pid': os.getpid(), 'current': current}, status_file)
+        os.rename(tmp_path, self._status_path)
@@ -1,2 +1,2 @@
-from .settings import get_config  # noqa
+from .settings import get_config, find_configuration_file  # noqa
 from .exceptions import InvalidSettingsError  # noqa
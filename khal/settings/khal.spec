@@ -23,6 +23,26 @@ readonly = boolean(default=False)
 # khal stores its internal caching database here, by default this will be in the *$XDG_DATA_HOME/khal/khal.db* (this will most likely be *~/.local/share/khal/khal.db*).
 path = expand_db_path(default=None)
 
+# Recurring events without an end (neither *UNTIL* nor *COUNT*) are only
+# expanded this many days into the future when they are inserted into the
+# database, later instances are added as soon as they are needed. Set this to
+# *0* to expand all instances (up to the year 2037) right away.
+expansion_horizon = integer(min=0, default=365)
+
+# When many events need to be (re-)read from the calendars' directories (e.g.
+# on the first run), they are parsed by this many processes in parallel. Set
+# this to *0* to use one process per CPU or to *1* to not start any extra
+# processes.
+workers = integer(min=0, default=0)
+
+# If true, khal keeps a snapshot of all events from a month ago until a year
+# from now next to the database (in *khal.db.snapshot*), which is used
+# instead of the database as long as the database does not change. This makes
+# `agenda` and `calendar` (e.g. called by a status bar) answer much faster,
+# especially while `khal watch` is running, which writes the snapshot after
+# every change.
+snapshot = boolean(default=False)
+
 # The most important options in the the **[locale]** section are probably (long-)time and dateformat.
 [locale]
 
@@ -21,23 +21,29 @@
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #
 
+import collections
 import os
+import pickle
 
-from configobj import ConfigObj, flatten_errors, get_extra_values, \
-    ConfigObjError
-from validate import Validator
 import xdg.BaseDirectory
 
 from .exceptions import InvalidSettingsError, CannotParseConfigFileError
-from khal import __productname__
+from khal import __productname__, __version__
 from ..log import logger
-from .utils import is_timezone, weeknumber_option, config_checks, \
-    expand_path, expand_db_path
 
 SPECPATH = os.path.join(os.path.dirname(__file__), 'khal.spec')
 
+# the validated config of the last run is cached here, see get_config
+CACHEPATH = os.path.join(xdg.BaseDirectory.xdg_cache_home, __productname__,
+                         'config.pickle')
 
-def _find_configuration_file():
+# the config's values depend on these, too (paths are expanded, the local
+# timezone is looked up if none is configured)
+CACHE_ENVIRON = ['HOME', 'TZ', 'XDG_DATA_HOME']
+LOCALTIME = '/etc/localtime'
+
+
+def find_configuration_file():
     """Return the configuration filename.
 
     This function builds the list of paths known by khal and
@@ -67,20 +73,122 @@ def _find_configuration_file():
     return None
 
 
-def get_config(config_path=None):
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+
+def _cache_key(config_path):
+    """everything the validated config depends on, as far as it is cheap to
+    find out"""
+    config_path = os.path.abspath(config_path)
+    return (
+        __version__,
+        config_path,
+        _stat(config_path),
+        _stat(SPECPATH),
+        tuple(os.environ.get(name) for name in CACHE_ENVIRON),
+        os.path.realpath(LOCALTIME),
+        _stat(LOCALTIME),
+    )
+
+
+def _load_cache(key):
+    """
+    :returns: the cached config and the warnings logged while validating it,
+              or None if there is no valid cache for `key`
+    :rtype: tuple(dict, list(str)) or None
+    """
+    try:
+        with open(CACHEPATH, 'rb') as cache:
+            cached_key, config, warnings = pickle.load(cache)
+    except Exception as error:
+        # missing, from an older khal, another python version, ...
+        logger.debug('not using the cached config: {0!r}'.format(error))
+        return None
+    if cached_key != key:
+        return None
+    return config, warnings
+
+
+def _save_cache(key, config, warnings):
+    tmp_path = CACHEPATH + '.tmp'
+    try:
+        if not os.path.isdir(os.path.dirname(CACHEPATH)):
+            os.makedirs(os.path.dirname(CACHEPATH))
+        with open(tmp_path, 'wb') as cache:
+            pickle.dump((key, config, warnings), cache, 2)
+        os.rename(tmp_path, CACHEPATH)
+    except (IOError, OSError, pickle.PicklingError, TypeError,
+            AttributeError) as error:
+        # e.g. a local timezone pytz cannot pickle
+        logger.debug('could not cache the config: {0!r}'.format(error))
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def _to_dict(section):
+    """converts a (validated) ConfigObj into nested OrderedDicts"""
+    return collections.OrderedDict(
+        (key, _to_dict(value) if isinstance(value, dict) else value)
+        for key, value in section.items())
+
+
+def get_config(config_path=None, use_cache=True):
     """reads the config file, validates it and return a config dict
 
+    The validated config is cached, as long as neither the config file nor
+    khal's config spec change, later calls just load it from the cache.
+
     :param config_path: path to a custom config file, if none is given the
                         default locations will be searched
     :type config_path: str
+    :param use_cache: if the config may be loaded from (and saved to) the
+                      cache
+    :type use_cache: bool
     :returns: configuration
     :rtype: dict
     """
     if config_path is None:
-        config_path = _find_configuration_file()
+        config_path = find_configuration_file()
 
     logger.debug('using the config file at {}'.format(config_path))
 
+    if use_cache and config_path is not None:
+        key = _cache_key(config_path)
+        cached = _load_cache(key)
+        if cached is not None:
+            config, warnings = cached
+            for warning in warnings:
+                logger.warn(warning)
+            return config
+    else:
+        key = None
+
+    config, warnings = _read_config(config_path)
+    if key is not None:
+        _save_cache(key, config, warnings)
+    return config
+
+
+def _read_config(config_path):
+    """parses and validates the config file
+
+    :returns: the config and the warnings logged while validating it
+    :rtype: tuple(dict, list(str))
+    """
+    # only needed if the config isn't cached
+    from configobj import ConfigObj, flatten_errors, get_extra_values, \
+        ConfigObjError
+    from validate import Validator
+    from .utils import is_timezone, weeknumber_option, config_checks, \
+        expand_path, expand_db_path
+
     try:
         user_config = ConfigObj(config_path,
                                 configspec=SPECPATH,
@@ -124,15 +232,19 @@ def get_config(config_path=None):
 
     config_checks(user_config)
 
+    warnings = list()
     extras = get_extra_values(user_config)
     for section, value in extras:
         if section == ():
-            logger.warn('unknown section "{}" in config file'.format(value))
+            warnings.append('unknown section "{}" in config file'.format(value))
         else:
             section = sectionize(section)
-            logger.warn('unknown key or subsection "{}" in '
-                        'section "{}"'.format(value, section))
-    return user_config
+            warnings.append('unknown key or subsection "{}" in '
+                            'section "{}"'.format(value, section))
+    for warning in warnings:
+        logger.warn(warning)
+
+    return _to_dict(user_config), warnings
 
 
 def sectionize(sections, depth=1):
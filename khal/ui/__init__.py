@@ -28,6 +28,7 @@ import sys
 import urwid
 
 from .. import aux
+from ..khalendar.exceptions import EventNotFound
 from ..calendar_display import getweeknumber
 
 from .base import Pane, Window, CColumns, CPile, CSimpleFocusListWalker, Choice
@@ -317,23 +318,29 @@ class CalendarWalker(urwid.SimpleFocusListWalker):
 
 class U_Event(urwid.Text):
 
-    def __init__(self, event, this_date=None, eventcolumn=None):
+    def __init__(self, occurrence, this_date=None, eventcolumn=None):
         """
         representation of an event in EventList
 
-        :param event: the encapsulated event
-        :type event: khal.event.Event
+        :param occurrence: the encapsulated event, the complete event is
+                           only parsed once it is viewed or edited
+        :type occurrence: khal.event.Occurrence
         """
-        self.event = event
+        self.occurrence = occurrence
         self.this_date = this_date
         self.eventcolumn = eventcolumn
         self.conf = eventcolumn.pane.conf
-        super(U_Event, self).__init__(self.event.compact(self.this_date))
+        super(U_Event, self).__init__(self.occurrence.compact(self.this_date))
         self.set_title()
 
+    @property
+    def event(self):
+        return self.occurrence.event
+
     @property
     def is_viewed(self):
-        return self.event is self.eventcolumn.current_event
+        current_event = self.eventcolumn.current_event
+        return current_event is not None and self.event is current_event
 
     @classmethod
     def selectable(cls):
@@ -341,19 +348,19 @@ class U_Event(urwid.Text):
 
     @property
     def uid(self):
-        return self.event.calendar + '\n' + \
-            str(self.event.href) + '\n' + str(self.event.etag)
+        return self.occurrence.calendar + '\n' + \
+            str(self.occurrence.href) + '\n' + str(self.occurrence.etag)
 
     def set_title(self, mark=''):
         if self.uid in self.eventcolumn.pane.deleted:
             mark = 'D'
-        self.set_text(mark + ' ' + self.event.compact(self.this_date))
+        self.set_text(mark + ' ' + self.occurrence.compact(self.this_date))
 
     def toggle_delete(self):
-        if self.event.readonly:
+        if self.occurrence.readonly:
             self.eventcolumn.pane.window.alert(
                 ('light red',
-                 'Calendar {} is read-only.'.format(self.event.calendar)))
+                 'Calendar {} is read-only.'.format(self.occurrence.calendar)))
             return
         if self.uid in self.eventcolumn.pane.deleted:
             self.eventcolumn.pane.deleted.remove(self.uid)
@@ -365,10 +372,16 @@ class U_Event(urwid.Text):
         binds = self.conf['keybindings']
 
         if key in binds['view']:
-            if self.is_viewed:
-                self.eventcolumn.edit(self.event)
-            else:
-                self.eventcolumn.current_event = self.event
+            try:
+                if self.is_viewed:
+                    self.eventcolumn.edit(self.event)
+                else:
+                    self.eventcolumn.current_event = self.event
+            except EventNotFound:
+                # deleted (e.g. by another khal) since the list was shown
+                self.eventcolumn.pane.window.alert(
+                    ('light red', 'This event does not exist anymore.'))
+                self.eventcolumn.current_date = self.eventcolumn.current_date
         elif key in binds['delete']:
             self.toggle_delete()
         elif key in binds['left'] + binds['up'] + binds['down']:
@@ -393,8 +406,9 @@ class EventList(urwid.WidgetWrap):
         date_text = urwid.Text(
             this_date.strftime(self.eventcolumn.pane.conf['locale']['longdateformat']))
         event_column = list()
-        all_day_events = self.eventcolumn.pane.collection.get_allday_by_time_range(this_date)
-        events = self.eventcolumn.pane.collection.get_datetime_by_time_range(start, end)
+        collection = self.eventcolumn.pane.collection
+        all_day_events = collection.get_allday_by_time_range(this_date, occurrences=True)
+        events = collection.get_datetime_by_time_range(start, end, occurrences=True)
 
         for event in all_day_events:
             event_column.append(
@@ -22,6 +22,7 @@ requirements = [
 
 extra_requirements = {
     'proctitle': ['setproctitle'],
+    'numpy': ['numpy'],
 }
 
 setup(
@@ -41,7 +42,8 @@ setup(
     entry_points={
         'console_scripts': [
             'khal = khal.cli:main_khal',
-            'ikhal = khal.cli:main_ikhal'
+            'ikhal = khal.cli:main_ikhal',
+            'khalc = khal.client:main',
         ]
     },
     install_requires=requirements,
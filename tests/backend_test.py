@@ -5,20 +5,47 @@ import pytz
 from datetime import date, datetime, timedelta
 import icalendar
 
-from khal.khalendar import backend
+from khal.khalendar import aux, backend
 from khal.compat import unicode_type
-from khal.khalendar.exceptions import OutdatedDbVersionError, UpdateFailed
+from khal.khalendar.exceptions import OutdatedDbVersionError, UpdateFailed, \
+    EventNotFound
 
 berlin = pytz.timezone('Europe/Berlin')
 locale = {'local_timezone': berlin, 'default_timezone': berlin}
 
 
-def test_new_db_version():
+def stored_times(dbi, table='recs_loc'):
+    """the hrefrecuid, start and end of all instances in the db, whether saved
+    as rows or as series"""
+    return sorted(row[1:] for row in dbi.sql_ex(*backend.instances_query([dbi], table)))
+
+
+def test_new_db_version(monkeypatch):
     dbi = backend.SQLiteDb('home', ':memory:', locale=locale)
-    backend.DB_VERSION += 1
+    monkeypatch.setattr(backend, 'DB_VERSION', backend.DB_VERSION + 1)
     with pytest.raises(OutdatedDbVersionError):
         dbi._check_table_version()
 
+
+def test_migrate_db_version_3(tmpdir):
+    """version 3 dbs only lack the indexes on the recursion tables"""
+    dbpath = str(tmpdir) + '/khal.db'
+    dbi = backend.SQLiteDb('home', dbpath, locale=locale)
+    dbi.update(event_rrule_recurrence_id, href='12345.ics', etag='abcd')
+    for table in ['recs_loc', 'recs_float']:
+        dbi.sql_ex('DROP INDEX {0}_dtstart;'.format(table))
+        dbi.sql_ex('DROP INDEX {0}_dtend;'.format(table))
+    dbi.sql_ex('UPDATE version SET version = 3;')
+    backend.disconnect(dbpath)
+
+    dbi = backend.SQLiteDb('home', dbpath, locale=locale)
+    assert dbi.sql_ex('SELECT version FROM version;') == [(backend.DB_VERSION, )]
+    indexes = dbi.sql_ex("SELECT name FROM sqlite_master WHERE type = 'index' "
+                         "AND name LIKE 'recs_%';")
+    assert len(indexes) == 4
+    events = dbi.get_time_range(datetime(2014, 4, 30, 0, 0), datetime(2014, 9, 26, 0, 0))
+    assert len(list(events)) == 6
+
 event_rrule_recurrence_id = """
 BEGIN:VCALENDAR
 BEGIN:VEVENT
@@ -72,6 +99,263 @@ def test_event_rrule_recurrence_id():
 
     assert dbi
 
+
+def test_time_range_single_query(monkeypatch):
+    """range queries should fetch everything they need in one query, and
+    not look up every single event again"""
+    dbi = backend.SQLiteDb('home', ':memory:', locale=locale)
+    dbi.update(event_rrule_recurrence_id, href='12345.ics', etag='abcd')
+
+    def get(*args, **kwargs):
+        raise AssertionError('SQLiteDb.get() should not be called')
+    monkeypatch.setattr(dbi, 'get', get)
+
+    events = list(dbi.get_time_range(datetime(2014, 4, 30, 0, 0), datetime(2014, 9, 26, 0, 0)))
+    assert len(events) == 6
+    assert set(event.etag for event in events) == set(['abcd'])
+    assert set(event.href for event in events) == set(['12345.ics'])
+    assert sorted(event.start for event in events)[1] == \
+        berlin.localize(datetime(2014, 7, 7, 9, 0))
+
+
+def test_occurrences(monkeypatch):
+    """Occurrences look like the events in lists, without parsing them"""
+    dbi = backend.SQLiteDb('home', ':memory:', locale=locale)
+    dbi.update(event_rrule_recurrence_id, href='12345.ics', etag='abcd')
+    dbi.update(event_rrule_this_and_future_allday, href='allday.ics', etag='efgh')
+    start, end = datetime(2014, 4, 30, 0, 0), datetime(2014, 9, 26, 0, 0)
+    events = list(dbi.get_time_range(start, end))
+    allday = list(dbi.get_allday_range(date(2014, 7, 1), date(2014, 8, 1)))
+
+    def from_ical(*args, **kwargs):
+        raise AssertionError('the event should not be parsed')
+    monkeypatch.setattr(icalendar.Event, 'from_ical', from_ical)
+    occurrences = list(dbi.get_time_range(start, end, occurrences=True))
+    allday_occurrences = list(dbi.get_allday_range(
+        date(2014, 7, 1), date(2014, 8, 1), occurrences=True))
+    assert [one.compact(one.start.date()) for one in occurrences] == \
+        [one.compact(one.start.date()) for one in events]
+    assert [one.compact(one.start) for one in allday_occurrences] == \
+        [one.compact(one.start) for one in allday]
+    assert [one.tzname for one in occurrences] == ['Europe/Berlin'] * 6
+    assert occurrences[1].recur
+    monkeypatch.undo()
+
+    event = occurrences[1].event
+    assert event is occurrences[1].event
+    assert (event.start, event.end) == (events[1].start, events[1].end)
+    assert event.raw == events[1].raw
+
+    # the event is gone once it is deleted
+    dbi.delete('12345.ics')
+    with pytest.raises(EventNotFound):
+        occurrences[2].event
+    with pytest.raises(EventNotFound):
+        dbi.get(occurrences[2]._recuid)
+
+
+def test_migrate_db_version_6(tmpdir):
+    """version 7 adds the columns Occurrences are built from"""
+    dbpath = str(tmpdir) + '/khal.db'
+    dbi = backend.SQLiteDb('home', dbpath, locale=locale)
+    dbi.update(event_rrule_recurrence_id, href='12345.ics', etag='abcd')
+    columns = 'href, hrefrecuid, calendar, sequence, etag, type, item'
+    dbi.sql_ex('ALTER TABLE events RENAME TO events_new;')
+    dbi.sql_ex('CREATE TABLE events (href TEXT NOT NULL, hrefrecuid TEXT NOT NULL, '
+               'calendar TEXT NOT NULL, sequence INT, etag TEXT, type TEXT, item TEXT, '
+               'primary key (hrefrecuid, calendar));')
+    dbi.sql_ex('INSERT INTO events ({0}) SELECT {0} FROM events_new;'.format(columns))
+    dbi.sql_ex('DROP TABLE events_new;')
+    dbi.sql_ex('UPDATE version SET version = 6;')
+    backend.disconnect(dbpath)
+
+    dbi = backend.SQLiteDb('home', dbpath, locale=locale)
+    assert dbi.sql_ex('SELECT version FROM version;') == [(backend.DB_VERSION, )]
+    assert sorted(dbi.sql_ex('SELECT summary, location, recurring, allday, tzname '
+                             'FROM events;')) == \
+        [(u'Arbeit', None, 1, 0, u'Europe/Berlin')] * 2
+    backend.disconnect(dbpath)
+
+
+def test_vevent_cache():
+    """all instances of a recurring event share one parsed vevent"""
+    dbi = backend.SQLiteDb('home', ':memory:', locale=locale)
+    dbi.update(event_rrule_recurrence_id, href='12345.ics', etag='abcd')
+    events = list(dbi.get_time_range(datetime(2014, 4, 30, 0, 0), datetime(2014, 9, 26, 0, 0)))
+    assert len(events) == 6
+    # one miss for the original event and one for the RECURRENCE-ID event
+    assert dbi.vevent_cache.misses == 2
+    assert dbi.vevent_cache.hits == 4
+    # every instance still has its own start time
+    assert len(set(event.start for event in events)) == 6
+    assert len(set(event.end for event in events)) == 6
+
+    dbi.update(event_rrule_recurrence_id_update, href='12345.ics', etag='abcd')
+    assert len(dbi.vevent_cache) == 0
+    events = list(dbi.get_time_range(datetime(2014, 4, 30, 0, 0), datetime(2014, 9, 26, 0, 0)))
+    assert len(events) == 5
+
+
+def test_vevent_cache_eviction():
+    cache = backend.VEventCache(maxsize=2)
+    cache.get(('home', 'a', ''), event_a)
+    cache.get(('home', 'b', ''), event_b)
+    cache.get(('home', 'a', ''), event_a)
+    assert (cache.hits, cache.misses) == (1, 2)
+    cache.get(('home', 'c', ''), event_b)
+    assert len(cache) == 2
+    # 'b' was the least recently used one
+    cache.get(('home', 'b', ''), event_b)
+    assert (cache.hits, cache.misses) == (1, 4)
+
+
+def test_expansion_cache(monkeypatch):
+    """events with the same recurrence are only expanded once"""
+    dba = backend.SQLiteDb('home', ':memory:', locale=locale)
+    dba.update(event_rrule_recurrence_id, href='12345.ics', etag='abcd')
+    expected = stored_times(dba)
+    assert len(expected) == 6
+    assert len(dba.sql_ex('SELECT * FROM expansions;')) == 1
+
+    aux_expand = backend.aux.expand
+
+    def expand(vevent, *args, **kwargs):
+        assert 'RRULE' not in vevent, 'the event should not be expanded again'
+        return aux_expand(vevent, *args, **kwargs)
+    monkeypatch.setattr(backend.aux, 'expand', expand)
+    renamed = event_rrule_recurrence_id.replace('SUMMARY:Arbeit', 'SUMMARY:Work', 1)
+    dba.update(renamed, href='12345.ics', etag='efgh')
+    assert stored_times(dba) == expected
+
+    # but the EXDATE makes it a different recurrence
+    with pytest.raises(AssertionError):
+        dba.update(event_rrule_recurrence_id_update, href='12345.ics', etag='ijkl')
+
+
+def test_expansion_cache_hit(monkeypatch):
+    """the times found in the expansions table are not written again"""
+    dbi = backend.SQLiteDb('home', ':memory:', locale=locale)
+    dbi.update(event_rrule_recurrence_id, href='a.ics')
+
+    def pack_times(times):
+        raise AssertionError('the expansion was written again')
+    monkeypatch.setattr(backend, 'pack_times', pack_times)
+    (last_used, ) = dbi.sql_ex('SELECT last_used FROM expansions;')[0]
+    monkeypatch.setattr(backend.time, 'time', lambda: last_used / 1000. + 10)
+    dbi.update(event_rrule_recurrence_id, href='b.ics')
+    assert dbi.sql_ex('SELECT last_used FROM expansions;') == [(last_used + 10000, )]
+
+
+def test_expansion_key_until():
+    """only the expansion of RRULEs without an end depends on `until`"""
+    today = datetime.combine(date.today(), datetime.min.time())
+    bounded = event_rrule_recurrence_id
+    open_ended = bounded.replace(';UNTIL=20140806T060000Z', '')
+    assert open_ended != bounded
+    for event, same in [(bounded, True), (open_ended, False)]:
+        vevent = icalendar.Event.from_ical(event).walk('VEVENT')[0]
+        keys = [backend.expansion_key(vevent, berlin, today + timedelta(days=days))
+                for days in [365, 366]]
+        assert (keys[0] == keys[1]) is same
+
+
+def test_expansion_cache_eviction(monkeypatch):
+    monkeypatch.setattr(backend, 'EXPANSION_CACHE_SIZE', 2)
+    dbi = backend.SQLiteDb('home', ':memory:', locale=locale)
+    dbi.update(event_rrule_recurrence_id, href='a.ics')
+    dbi.update(event_rrule_recurrence_id_update, href='b.ics')
+    key_a, key_b = [backend.prepare_update(one, 'c.ics', 'home', berlin)[0].expansion
+                    for one in [event_rrule_recurrence_id, event_rrule_recurrence_id_update]]
+    # using `a` again makes `b` the least recently used one
+    dbi.update(event_rrule_recurrence_id, href='a.ics')
+    dbi.update(event_rrule_this_and_future_allday, href='c.ics')
+    assert len(dbi.sql_ex('SELECT * FROM expansions;')) == 2
+    assert dbi.cached_expansion(key_a) is not None
+    assert dbi.cached_expansion(key_b) is None
+
+
+def test_pack_times():
+    times = [(1404104400, 1404122400), (-86400, 0)]
+    assert backend.unpack_times(backend.pack_times(times)) == times
+    assert backend.unpack_times(backend.pack_times([])) == []
+
+
+def test_compact_times():
+    day = 24 * 3600
+    # daily, one day skipped and an hour later from the fifth day on
+    times = [(start, start + 600) for start in [0, day, 2 * day, 4 * day - 3600]] + \
+        [(start, start + 600) for start in range(5 * day - 3600, 9 * day, day)]
+    series, single = backend.compact_times(times, day)
+    assert series == [(0, day, 3, 600), (4 * day - 3600, day, 6, 600)]
+    assert single == []
+
+    # every other instance lasts longer
+    times = [(start, start + 600 + start % (2 * day)) for start in range(0, 6 * day, day)]
+    series, single = backend.compact_times(times, day)
+    assert series == []
+    assert single == times
+    series, single = backend.compact_times(times, 2 * day)
+    assert series == [(0, 2 * day, 3, 600), (day, 2 * day, 3, day + 600)]
+
+
+def test_series_period():
+    def period(rrule):
+        return backend.series_period(icalendar.Event.from_ical(
+            'BEGIN:VEVENT\nRRULE:{0}\nEND:VEVENT'.format(rrule)))
+    assert period('FREQ=DAILY') == 24 * 3600
+    assert period('FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,WE') == 14 * 24 * 3600
+    assert period('FREQ=MONTHLY') is None
+
+
+def test_series():
+    """the instances of regular recurring events are saved as series"""
+    dbi = backend.SQLiteDb('home', ':memory:', locale=locale)
+    dbi.update(event_rrule_open_ended, href='12345.ics', etag='abcd')
+    # one series each between the daylight saving time changes
+    assert 40 < len(dbi.sql_ex('SELECT * FROM series;')) < 60
+    # the instance replaced by the RECURRENCE-ID event is missing there
+    assert dbi.sql_ex('SELECT dtstart FROM recs_loc;') == \
+        [(aux.to_unix_time(berlin.localize(datetime(2031, 7, 7, 9))), )]
+    events = list(dbi.get_time_range(datetime(2031, 6, 29), datetime(2031, 7, 21)))
+    assert [event.start for event in events] == [
+        berlin.localize(datetime(2031, 6, 30, 7)),
+        berlin.localize(datetime(2031, 7, 7, 9)),
+        berlin.localize(datetime(2031, 7, 14, 7)),
+    ]
+    assert [event.summary for event in events] == \
+        [u'weekly meeting', u'weekly meeting, moved', u'weekly meeting']
+    # the boundaries of the range are inclusive
+    end = datetime.fromtimestamp(aux.to_unix_time(berlin.localize(datetime(2031, 6, 30, 12))))
+    assert len(list(dbi.get_time_range(end, end + timedelta(days=7)))) == 2
+    assert len(list(dbi.get_time_range(end + timedelta(seconds=1),
+                                       end + timedelta(days=7)))) == 1
+    dbi.delete('12345.ics')
+    assert dbi.sql_ex('SELECT * FROM series;') == []
+
+
+def test_migrate_db_version_8(tmpdir, monkeypatch):
+    """version 9 saves the instances of regular recurring events as series"""
+    dbpath = str(tmpdir) + '/khal.db'
+    with monkeypatch.context() as patched:
+        patched.setattr(backend, 'series_period', lambda vevent: None)
+        dbi = backend.SQLiteDb('home', dbpath, locale=locale)
+        dbi.update(event_rrule_recurrence_id, href='12345.ics', etag='abcd')
+    expected = stored_times(dbi)
+    assert len(dbi.sql_ex('SELECT * FROM recs_loc;')) == 6
+    dbi.sql_ex('DROP TABLE series;')
+    dbi.sql_ex('DROP TABLE calendar_ids;')
+    dbi.sql_ex('UPDATE version SET version = 8;')
+    backend.disconnect(dbpath)
+
+    dbi = backend.SQLiteDb('home', dbpath, locale=locale)
+    assert dbi.sql_ex('SELECT version FROM version;') == [(backend.DB_VERSION, )]
+    # the first instance is on its own, the second one has been replaced
+    assert len(dbi.sql_ex('SELECT * FROM recs_loc;')) == 2
+    assert len(dbi.sql_ex('SELECT * FROM series;')) == 1
+    assert stored_times(dbi) == expected
+    backend.disconnect(dbpath)
+
+
 event_rrule_recurrence_id_reverse = """
 BEGIN:VCALENDAR
 BEGIN:VEVENT
@@ -459,6 +743,24 @@ def test_two_calendars_same_uid(tmpdir):
     assert dba.list() == []
     assert dbb.list() == [('12345.ics', 'abcd')]
 
+
+def test_shared_connection(tmpdir):
+    dbpath = str(tmpdir) + '/khal.db'
+    dba = backend.SQLiteDb('home', dbpath, locale=locale)
+    dbb = backend.SQLiteDb('work', dbpath, locale=locale)
+    assert dba.conn is dbb.conn
+    assert dba.sql_ex('PRAGMA journal_mode;') == [('wal', )]
+    assert sorted(dba.sql_ex('SELECT calendar FROM calendars;')) == [('home', ), ('work', )]
+
+    backend.disconnect(dbpath)
+    dbc = backend.SQLiteDb('home', dbpath, locale=locale)
+    assert dbc.conn is not dba.conn
+
+    # in-memory dbs can't be shared
+    dba = backend.SQLiteDb('home', ':memory:', locale=locale)
+    dbb = backend.SQLiteDb('home', ':memory:', locale=locale)
+    assert dba.conn is not dbb.conn
+
 event_rdate_period = """BEGIN:VEVENT
 SUMMARY:RDATE period
 DTSTART:19961230T020000Z
@@ -488,3 +790,150 @@ def test_check_support():
     ical = icalendar.Calendar.from_ical(event_rdate_period)
     with pytest.raises(UpdateFailed):
         [backend.check_support(event, '', '') for event in ical.walk()]
+
+event_rrule_open_ended = """BEGIN:VCALENDAR
+BEGIN:VEVENT
+UID:open_ended
+SUMMARY:weekly meeting
+RRULE:FREQ=WEEKLY
+DTSTART;TZID=Europe/Berlin:20140630T070000
+DTEND;TZID=Europe/Berlin:20140630T120000
+END:VEVENT
+BEGIN:VEVENT
+UID:open_ended
+SUMMARY:weekly meeting, moved
+RECURRENCE-ID:20310707T050000Z
+DTSTART;TZID=Europe/Berlin:20310707T090000
+DTEND;TZID=Europe/Berlin:20310707T140000
+END:VEVENT
+END:VCALENDAR
+"""
+
+
+def test_expansion_horizon():
+    dbi = backend.SQLiteDb('home', ':memory:', locale=locale, expansion_horizon=30)
+    dbi.update(event_rrule_open_ended, href='12345.ics', etag='abcd')
+    horizon = datetime.now() + timedelta(days=30)
+    last_start = max(start for href_rec_inst, start, _ in stored_times(dbi)
+                     if href_rec_inst == '12345.ics')
+    assert last_start <= aux.to_unix_time(horizon)
+    assert last_start > aux.to_unix_time(horizon - timedelta(days=8))
+
+    # querying beyond the horizon expands the event further
+    events = list(dbi.get_time_range(datetime(2031, 6, 29, 0, 0), datetime(2031, 7, 14, 0, 0)))
+    assert sorted(event.start for event in events) == [
+        berlin.localize(datetime(2031, 6, 30, 7, 0)),
+        berlin.localize(datetime(2031, 7, 7, 9, 0)),
+    ]
+    until, = dbi.sql_ex('SELECT until FROM horizons;')[0]
+    assert until > aux.to_unix_time(datetime(2031, 7, 14))
+    assert len(list(dbi.get_time_range(datetime(2014, 6, 29), datetime(2014, 7, 14)))) == 2
+
+    dbi.delete('12345.ics')
+    assert dbi.sql_ex('SELECT * FROM horizons;') == []
+
+
+def test_no_expansion_horizon():
+    dbi = backend.SQLiteDb('home', ':memory:', locale=locale)
+    dbi.update(event_rrule_open_ended, href='12345.ics', etag='abcd')
+    assert dbi.sql_ex('SELECT * FROM horizons;') == []
+    last_start = max(start for _, start, _ in stored_times(dbi))
+    assert last_start > aux.to_unix_time(datetime(2037, 12, 20))
+
+
+event_search = """BEGIN:VEVENT
+UID:search
+SUMMARY:Meeting with Jane
+LOCATION:Conference Room
+DESCRIPTION:Discuss the budget
+CATEGORIES:work
+DTSTART;TZID=Europe/Berlin:20140630T070000
+DTEND;TZID=Europe/Berlin:20140630T120000
+END:VEVENT"""
+
+
+def test_search():
+    dbi = backend.SQLiteDb('home', ':memory:', locale=locale)
+    assert dbi._fts
+    dbi.update(event_a, href='a.ics', etag='abcd')
+    dbi.update(event_b, href='b.ics', etag='abcd')
+    dbi.update(event_search, href='search.ics', etag='abcd')
+    assert [event.href for event in dbi.search('meet')] == ['search.ics']
+    assert [event.href for event in dbi.search('room jane')] == ['search.ics']
+    assert [event.href for event in dbi.search('budget')] == ['search.ics']
+    assert [event.href for event in dbi.search('work')] == ['search.ics']
+    assert sorted(event.href for event in dbi.search('event')) == ['a.ics', 'b.ics']
+    assert [event.href for event in dbi.search('event b')] == ['b.ics']
+    # property names and other raw iCalendar data are not searched
+    assert list(dbi.search('DTSTART')) == []
+    assert list(dbi.search('Europe')) == []
+
+    dbi.delete('search.ics')
+    assert list(dbi.search('meet')) == []
+    assert dbi.sql_ex('SELECT count(*) FROM events_fts;') == [(2, )]
+
+    dbi._fts = False
+    assert [event.href for event in dbi.search('event b')] == ['b.ics']
+    assert [event.href for event in dbi.search('event', field='summary', limit=1)] == \
+        [event.href for event in dbi.search('event', limit=1)]
+    assert list(dbi.search('event', field='location')) == []
+
+
+def test_search_time_range():
+    dbi = backend.SQLiteDb('home', ':memory:', locale=locale)
+    dbi.update(event_a, href='a.ics', etag='abcd')
+    dbi.update(event_search, href='search.ics', etag='abcd')
+    events = list(dbi.search('event', start=date(2014, 7, 7), end=date(2014, 7, 22)))
+    assert [event.start for event in events] == [
+        berlin.localize(datetime(2014, 7, 7, 7, 0)),
+        berlin.localize(datetime(2014, 7, 14, 7, 0)),
+        berlin.localize(datetime(2014, 7, 21, 7, 0)),
+    ]
+    events = list(dbi.search('event', start=date(2014, 7, 7), limit=2))
+    assert [event.start for event in events] == [
+        berlin.localize(datetime(2014, 7, 7, 7, 0)),
+        berlin.localize(datetime(2014, 7, 14, 7, 0)),
+    ]
+    assert len(list(dbi.search('event', end=date(2014, 7, 7)))) == 1
+    assert list(dbi.search('meeting', start=date(2014, 7, 1))) == []
+    assert len(list(dbi.search('meeting', field='summary', end=date(2014, 7, 1)))) == 1
+    assert list(dbi.search('meeting', field='location', end=date(2014, 7, 1))) == []
+
+
+def test_search_index_created_later(tmpdir):
+    """events already in a db without a full text index are added to it once
+    it is created"""
+    dbpath = str(tmpdir) + '/khal.db'
+    dbi = backend.SQLiteDb('home', dbpath, locale=locale)
+    dbi.update(event_search, href='search.ics', etag='abcd')
+    dbi.sql_ex('DROP TABLE events_fts;')
+    backend.disconnect(dbpath)
+
+    dbi = backend.SQLiteDb('home', dbpath, locale=locale)
+    assert [event.href for event in dbi.search('meet')] == ['search.ics']
+
+
+def test_search_without_fts5(tmpdir, monkeypatch):
+    """a db with a full text index can be used by a sqlite without FTS5, the
+    index is rebuilt once it is opened with FTS5 again"""
+    dbpath = str(tmpdir) + '/khal.db'
+    dbi = backend.SQLiteDb('home', dbpath, locale=locale)
+    dbi.update(event_a, href='a.ics', etag='abcd')
+    backend.disconnect(dbpath)
+
+    monkeypatch.setattr(backend, 'fts5_available', lambda conn: False)
+    dbi = backend.SQLiteDb('home', dbpath, locale=locale)
+    assert not dbi._fts
+    # without FTS5, writing to the index would fail with "no such module: fts5"
+    dbi.update(event_search, href='search.ics', etag='abcd')
+    dbi.delete('a.ics')
+    assert [event.href for event in dbi.search('meet')] == ['search.ics']
+    backend.disconnect(dbpath)
+
+    monkeypatch.undo()
+    dbi = backend.SQLiteDb('home', dbpath, locale=locale)
+    assert dbi._fts
+    assert [event.href for event in dbi.search('meet')] == ['search.ics']
+    assert list(dbi.search('event')) == []
+    assert dbi.sql_ex('SELECT count(*) FROM events_fts;') == [(1, )]
+    backend.disconnect(dbpath)
@@ -165,3 +165,134 @@ def test_printformats(runner):
                       'timeformat: 10:09',
                       '']) == result.output
     assert not result.exception
+
+
+def test_search(runner):
+    runner = runner(command='', showalldays=False)
+    result = runner.invoke(
+        main_khal, ['new', '-r', 'weekly'] + '01.06.2015 10:00 weekly standup'.split())
+    assert not result.exception
+    result = runner.invoke(
+        main_khal, ['new', '-l', 'standup room'] + '09.06.2015 12:00 lunch'.split())
+    assert not result.exception
+
+    result = runner.invoke(main_khal, ['search', 'standup'])
+    assert not result.exception
+    assert len(result.output.splitlines()) == 2
+
+    result = runner.invoke(main_khal, ['search', '--field', 'summary', 'standup'])
+    assert not result.exception
+    assert result.output == '10:00-11:00 01.06.2015: weekly standup Repeat: FREQ=WEEKLY\n'
+
+    result = runner.invoke(
+        main_khal, 'search --from 08.06.2015 --to 15.06.2015 standup'.split())
+    assert not result.exception
+    assert result.output.splitlines() == [
+        '10:00-11:00 08.06.2015: weekly standup Repeat: FREQ=WEEKLY',
+        '12:00-13:00 09.06.2015: lunch Location: standup room',
+        '10:00-11:00 15.06.2015: weekly standup Repeat: FREQ=WEEKLY',
+    ]
+
+    result = runner.invoke(
+        main_khal, 'search --from 08.06.2015 --limit 1 standup'.split())
+    assert not result.exception
+    assert result.output == '10:00-11:00 08.06.2015: weekly standup Repeat: FREQ=WEEKLY\n'
+
+    result = runner.invoke(main_khal, 'search --from 32.13. standup'.split())
+    assert result.exit_code == 2
+
+
+def test_skip_sync_while_watched(runner):
+    runner = runner(command='agenda', showalldays=False)
+    from .event_test import cal_dt
+    runner.calendars['one'].join('test.ics').write('\n'.join(cal_dt))
+
+    with open(str(runner.db) + '.watch', 'w') as status:
+        status.write('{"pid": %d, "current": true}' % os.getpid())
+    result = runner.invoke(main_khal, ['agenda', '09.04.2014'])
+    assert not result.exception
+    assert result.output == 'No events\n'
+
+    os.remove(str(runner.db) + '.watch')
+    result = runner.invoke(main_khal, ['agenda', '09.04.2014'])
+    assert not result.exception
+    assert result.output == u'09.04.2014\n09:30-10:30: An Event\n'
+
+
+def test_daemon(runner, tmpdir):
+    import threading
+    from khal import client, daemon
+    from khal.settings import get_config
+    from .event_test import cal_dt
+
+    runner = runner(command='agenda', showalldays=False)
+    conf = get_config(str(runner.config))
+    sock_path = str(tmpdir.join('khal.sock'))
+    server = daemon.Server(main_khal, conf, str(runner.config), sock_path)
+
+    assert server.run(['agenda', '09.04.2014'], width=80) == (0, b'No events\n')
+    runner.calendars['one'].join('test.ics').write('\n'.join(cal_dt))
+    assert server.run(['agenda', '09.04.2014'], width=80) == \
+        (0, b'09.04.2014\n09:30-10:30: An Event\n')
+    assert server.run([], width=80) == server.run(['agenda'], width=80)
+    assert server.run(['printcalendars']) == (0, b'one\n')
+
+    # the output is laid out for the client's terminal
+    assert server.run(['agenda', '09.04.2014'], width=15) == \
+        (0, b'09.04.2014\n09:30-10:30: An\nEvent\n')
+    # which the client must tell
+    assert server.run(['agenda', '09.04.2014']) is None
+
+    # these are left to the client
+    assert server.run(['new', '18:00', 'myevent']) is None
+    assert server.run(['interactive']) is None
+    assert server.run(['-c', str(runner.config), 'agenda']) is None
+    assert server.run(['--help']) is None
+
+    server.bind()
+
+    # the calendars' db connection must be used by the thread creating it
+    results = list()
+    thread = threading.Thread(target=lambda: results.append(
+        client.query(['agenda', '09.04.2014'], path=sock_path, width=80)))
+    thread.start()
+    conn, _ = server._sock.accept()
+    server.handle(conn)
+    conn.close()
+    thread.join()
+    assert results == [(0, b'09.04.2014\n09:30-10:30: An Event\n')]
+    server.close()
+    assert client.query(['agenda'], path=sock_path) is None
+
+
+@pytest.mark.parametrize('args', [['--help'], ['search', '--help'], ['printcalendars']])
+def test_lazy_imports(runner, tmpdir, args):
+    """commands not dealing with events must not import icalendar and co"""
+    import subprocess
+    import sys
+    runner = runner(command='', showalldays=False)
+    script = ('import sys\n'
+              'from khal.cli import main_khal\n'
+              'try:\n'
+              '    main_khal(sys.argv[1:])\n'
+              'except SystemExit:\n'
+              '    pass\n'
+              'heavy = ["icalendar", "dateutil", "vdirsyncer", "urwid", "sqlite3",\n'
+              '         "khal.khalendar", "khal.controllers"]\n'
+              'sys.stderr.write(" ".join(m for m in heavy if m in sys.modules))\n')
+    process = subprocess.Popen(
+        [sys.executable, '-c', script, '-c', str(runner.config)] + args,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        env=dict(os.environ, XDG_CACHE_HOME=str(tmpdir.join('cache'))),
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    out, err = process.communicate()
+    assert process.returncode == 0
+    assert err.decode('utf-8').strip() == ''
+    if args == ['printcalendars']:
+        assert out == b'one\n'
+
+
+def test_search_fields():
+    from khal.cli import SEARCH_FIELDS
+    from khal.khalendar.backend import SEARCH_FIELDS as BACKEND_SEARCH_FIELDS
+    assert SEARCH_FIELDS == BACKEND_SEARCH_FIELDS
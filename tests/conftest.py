@@ -0,0 +1,11 @@
+import pytest
+
+from khal.settings import settings
+
+
+@pytest.fixture(autouse=True)
+def config_cache(tmpdir, monkeypatch):
+    """keep the tests from writing the validated config into the user's cache"""
+    path = str(tmpdir.join('cache', 'config.pickle'))
+    monkeypatch.setattr(settings, 'CACHEPATH', path)
+    return path
@@ -5,7 +5,7 @@ import icalendar
 import pytest
 import pytz
 
-from khal.khalendar import aux
+from khal.khalendar import aux, fastexpand
 
 # datetime
 event_dt = """BEGIN:VCALENDAR
@@ -727,3 +727,74 @@ class TestSenitize(object):
     def test_duration(self):
         vevent = _get_vevent_file('event_dtr_exdatez')
         vevent = aux.sanitize(vevent)
+
+
+fast_template = """BEGIN:VEVENT
+UID:fast123
+DTSTART{0}
+DURATION:PT1H30M
+RRULE:{1}
+{2}END:VEVENT
+"""
+
+fast_starts = [
+    ';TZID=Europe/Berlin:20140630T070000',
+    # doesn't exist or is ambiguous in Berlin
+    ';TZID=Europe/Berlin:20150329T023000',
+    ';TZID=Europe/Berlin:20151025T023000',
+    # DST starts at midnight
+    ';TZID=America/Sao_Paulo:20141019T000000',
+    ';TZID=America/New_York:20160131T100000',
+    ':20160229T120000Z',
+    ':20160229T120000',
+    ';VALUE=DATE:20150131',
+]
+
+fast_rrules = [
+    'FREQ=DAILY;COUNT=40',
+    'FREQ=DAILY;INTERVAL=3;UNTIL=20161231T235959Z',
+    'FREQ=DAILY',
+    'FREQ=WEEKLY;UNTIL=20160601',
+    'FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,WE,SU;COUNT=30',
+    'FREQ=WEEKLY;INTERVAL=3;BYDAY=MO,SU;WKST=SU;COUNT=30',
+    'FREQ=MONTHLY;COUNT=30',
+    'FREQ=MONTHLY;INTERVAL=5',
+    'FREQ=YEARLY;COUNT=5',
+    'FREQ=YEARLY;INTERVAL=3;UNTIL=20300101T000000Z',
+    # these are left to dateutil
+    'FREQ=MONTHLY;BYDAY=-1FR;COUNT=10',
+    'FREQ=YEARLY;BYMONTH=3;COUNT=10',
+]
+
+fast_extras = [
+    '',
+    'EXDATE;TZID=Europe/Berlin:20140714T070000,20140630T070000\n'
+    'RDATE;TZID=Europe/Berlin:20140702T090000\n',
+]
+
+
+class TestFastExpand(object):
+    """the numpy expander needs to return exactly what dateutil does"""
+
+    @pytest.mark.parametrize('extra', fast_extras)
+    @pytest.mark.parametrize('rrule', fast_rrules)
+    @pytest.mark.parametrize('start', fast_starts)
+    def test_same_as_dateutil(self, monkeypatch, start, rrule, extra):
+        pytest.importorskip('numpy')
+        vevent = fast_template.format(start, rrule, extra)
+        until = datetime.datetime(2016, 6, 1)
+        fast = aux.expand(_get_vevent(vevent), berlin, until=until)
+        monkeypatch.setattr(fastexpand, 'numpy', None)
+        slow = aux.expand(_get_vevent(vevent), berlin, until=until)
+        assert fast == slow
+        # equal datetimes might still have different UTC offsets
+        assert [str(start) for start, _ in fast] == [str(start) for start, _ in slow]
+
+    def test_fast_path_used(self, monkeypatch):
+        pytest.importorskip('numpy')
+
+        def list_rrule(self):
+            raise AssertionError('dateutil should not be needed')
+        monkeypatch.setattr(aux.dateutil.rrule.rrule, '__iter__', list_rrule)
+        vevent = _get_vevent(fast_template.format(fast_starts[0], fast_rrules[4], ''))
+        assert len(aux.expand(vevent, berlin)) == 30
@@ -0,0 +1,131 @@
+import datetime
+import random
+import sqlite3
+
+import pytest
+import pytz
+
+from vdirsyncer.storage import FilesystemStorage
+from vdirsyncer.storage.base import Item
+
+from khal.khalendar import Calendar, CalendarCollection
+from khal.khalendar import backend
+from khal.khalendar.index import _Intervals
+
+berlin = pytz.timezone('Europe/Berlin')
+locale = {'default_timezone': berlin, 'local_timezone': berlin}
+
+template = (u'BEGIN:VEVENT\nUID:{0}\nSUMMARY:{0}\n'
+            u'DTSTART{1}\nDTEND{2}\n{3}END:VEVENT')
+
+EVENTS = [
+    ('home', 'overnight', ';TZID=Europe/Berlin:20140430T220000',
+     ';TZID=Europe/Berlin:20140501T020000', ''),
+    ('home', 'daily', ';TZID=Europe/Berlin:20140425T093000',
+     ';TZID=Europe/Berlin:20140425T103000', 'RRULE:FREQ=DAILY;COUNT=40\n'),
+    ('home', 'long', ';VALUE=DATE:20140428', ';VALUE=DATE:20140503', ''),
+    ('work', 'monthly', ';VALUE=DATE:20140415', ';VALUE=DATE:20140416',
+     'RRULE:FREQ=MONTHLY\n'),
+    ('work', 'midnight', ';VALUE=DATE-TIME:20140531T220000Z',
+     ';VALUE=DATE-TIME:20140531T230000Z', ''),
+]
+
+
+@pytest.fixture
+def collections(tmpdir):
+    """a collection with an index and one without it, on the same db"""
+    dbpath = str(tmpdir.join('khal.db'))
+    for name in ['home', 'work']:
+        tmpdir.mkdir(name)
+    vdirs = dict((name, FilesystemStorage(str(tmpdir.join(name)), '.ics'))
+                 for name in ['home', 'work'])
+    for calendar, uid, start, end, rrule in EVENTS:
+        vdirs[calendar].upload(Item(template.format(uid, start, end, rrule)))
+    colls = list()
+    for index in [True, False]:
+        coll = CalendarCollection(index=index)
+        for name in ['home', 'work']:
+            coll.append(Calendar(name, dbpath, str(tmpdir.join(name)),
+                                 locale=locale))
+        colls.append(coll)
+    yield colls
+    backend.disconnect(dbpath)
+
+
+def summaries(coll, start, end):
+    allday = coll.get_allday_by_time_range(start, end, occurrences=True)
+    timed = coll.get_datetime_by_time_range(
+        datetime.datetime.combine(start, datetime.time.min),
+        datetime.datetime.combine(end, datetime.time.max), occurrences=True)
+    return ([(one.calendar, one.summary, one.start) for one in allday],
+            sorted((one.calendar, one.summary, one.start, one.end) for one in timed))
+
+
+def test_intervals():
+    rand = random.Random(1)
+    items = sorted(((start, start + rand.randint(0, 50), num) for num, start in
+                    enumerate(rand.randint(0, 1000) for _ in range(300))),
+                   key=lambda item: item[0])
+    intervals = _Intervals(items)
+    for _ in range(200):
+        start = rand.randint(-10, 1010)
+        end = start + rand.randint(0, 100)
+        assert intervals.overlapping(start, end) == \
+            [item for item in items if item[1] >= start and item[0] <= end]
+
+
+def test_same_as_db(collections):
+    indexed, plain = collections
+    day = datetime.date(2014, 4, 20)
+    ranges = [(day + datetime.timedelta(days=offset),
+               day + datetime.timedelta(days=offset + length))
+              for offset in range(0, 50, 3) for length in [0, 1, 5, 40]]
+    for start, end in ranges:
+        assert summaries(indexed, start, end) == summaries(plain, start, end)
+    assert sorted(indexed._index._months) == [
+        datetime.date(2014, month, 1) for month in [4, 5, 6, 7]]
+    # one day only, as ikhal asks for it
+    assert [one.summary for one in indexed.get_allday_by_time_range(
+        datetime.date(2014, 5, 1), occurrences=True)] == ['long']
+
+
+def test_update(collections):
+    indexed, plain = collections
+    start, end = datetime.date(2014, 4, 28), datetime.date(2014, 5, 3)
+    summaries(indexed, start, end)
+    overnight = indexed.get_datetime_by_time_range(
+        datetime.datetime(2014, 4, 30, 21), datetime.datetime(2014, 4, 30, 23),
+        occurrences=True)[0]
+
+    event = indexed.new_event(template.format(
+        'new', ';TZID=Europe/Berlin:20140501T120000',
+        ';TZID=Europe/Berlin:20140501T130000', ''), 'work')
+    indexed.new(event)
+    assert summaries(indexed, start, end) == summaries(plain, start, end)
+    assert ('work', 'new') in [one[:2] for one in summaries(indexed, start, end)[1]]
+
+    daily = [one for one in indexed.get_datetime_by_time_range(
+        datetime.datetime(2014, 5, 1), datetime.datetime(2014, 5, 1, 23),
+        occurrences=True) if one.summary == 'daily'][0].event
+    daily.vevent['SUMMARY'] = 'weekly'
+    daily.vevent['RRULE']['FREQ'] = 'WEEKLY'
+    indexed.update(daily)
+    assert summaries(indexed, start, end) == summaries(plain, start, end)
+
+    indexed.delete(event.href, event.etag, 'work')
+    assert summaries(indexed, start, end) == summaries(plain, start, end)
+    # the occurrences of other events are kept
+    assert indexed.get_datetime_by_time_range(
+        datetime.datetime(2014, 4, 30, 21), datetime.datetime(2014, 4, 30, 23),
+        occurrences=True)[0] is overnight
+
+
+def test_changed_elsewhere(collections, tmpdir):
+    indexed, plain = collections
+    day = datetime.date(2014, 4, 30)
+    assert ('home', 'overnight') in [one[:2] for one in summaries(indexed, day, day)[1]]
+    conn = sqlite3.connect(str(tmpdir.join('khal.db')))
+    conn.execute("UPDATE events SET summary = 'changed' WHERE summary = 'overnight';")
+    conn.commit()
+    conn.close()
+    assert ('home', 'changed') in [one[:2] for one in summaries(indexed, day, day)[1]]
@@ -0,0 +1,174 @@
+import datetime
+import io
+import os
+
+import pytest
+import pytz
+
+from khal.khalendar import Calendar, CalendarCollection
+from khal.khalendar import backend, snapshot
+
+berlin = pytz.timezone('Europe/Berlin')
+locale = {'default_timezone': berlin, 'local_timezone': berlin}
+
+today = datetime.date.today()
+
+template = u"""BEGIN:VEVENT
+UID:{0}
+SUMMARY:{0}
+DTSTART{1}
+DTEND{2}
+{3}
+END:VEVENT"""
+
+
+def dtstamp(day, hour):
+    return ';TZID=Europe/Berlin:{0}T{1:02d}0000'.format(
+        day.strftime('%Y%m%d'), hour)
+
+
+def datestamp(day):
+    return ';VALUE=DATE:{0}'.format(day.strftime('%Y%m%d'))
+
+
+def write(coll, calendar, uid, *args):
+    path = os.path.join(coll._calnames[calendar].path, uid + '.ics')
+    with io.open(path, 'w', encoding='utf-8') as ics:
+        ics.write(template.format(uid, *args))
+
+
+@pytest.fixture
+def dbpath(tmpdir):
+    dbpath = str(tmpdir.join('khal.db'))
+    for name in ['home', 'work']:
+        tmpdir.mkdir(name)
+    yield dbpath
+    backend.disconnect(dbpath)
+
+
+def collection(tmpdir, dbpath, use_snapshot=True, sync=True, names=('home', 'work')):
+    coll = CalendarCollection(snapshot_db=dbpath if use_snapshot else None,
+                              all_calendars=len(names) == 2)
+    for name in names:
+        coll.append(Calendar(name, dbpath, str(tmpdir.join(name)),
+                             locale=locale, lazy_db=use_snapshot, sync=sync))
+    return coll
+
+
+def occurrences(coll, first, last):
+    """the events of all days from `first` to `last`"""
+    allday = coll.get_allday_by_time_range(first, last, occurrences=True)
+    timed = coll.get_datetime_by_time_range(
+        datetime.datetime.combine(first, datetime.time.min),
+        datetime.datetime.combine(last, datetime.time.max), occurrences=True)
+    return ([(event.calendar, event.summary, event.start, event.end, event.recur)
+             for event in allday],
+            sorted((event.calendar, event.summary, event.start, event.end,
+                    event.location, event.recur) for event in timed))
+
+
+def fill(coll):
+    yesterday = today - datetime.timedelta(days=1)
+    tomorrow = today + datetime.timedelta(days=1)
+    write(coll, 'home', 'daily', dtstamp(yesterday, 9), dtstamp(yesterday, 10),
+          'RRULE:FREQ=DAILY')
+    write(coll, 'home', 'monthly', dtstamp(yesterday, 11), dtstamp(yesterday, 12),
+          'RRULE:FREQ=MONTHLY;COUNT=3')
+    write(coll, 'work', 'overnight', dtstamp(today, 22), dtstamp(tomorrow, 2),
+          u'LOCATION:B\xfcro')
+    write(coll, 'work', 'holiday', datestamp(yesterday),
+          datestamp(today + datetime.timedelta(days=3)), '')
+    write(coll, 'work', 'birthday', datestamp(tomorrow),
+          datestamp(tomorrow + datetime.timedelta(days=1)), 'RRULE:FREQ=YEARLY')
+
+
+def test_snapshot(tmpdir, dbpath):
+    coll = collection(tmpdir, dbpath)
+    fill(coll)
+    expected = occurrences(collection(tmpdir, dbpath, use_snapshot=False),
+                           today - datetime.timedelta(days=2),
+                           today + datetime.timedelta(days=40))
+    assert len(expected[1]) == 45
+
+    assert occurrences(coll, today - datetime.timedelta(days=2),
+                       today + datetime.timedelta(days=40)) == expected
+    assert os.path.exists(snapshot.snapshot_path(dbpath))
+
+    # a fresh snapshot is read without opening the db (e.g. while `khal
+    # watch` keeps it up to date)
+    fresh = collection(tmpdir, dbpath, sync=False)
+    assert occurrences(fresh, today - datetime.timedelta(days=2),
+                       today + datetime.timedelta(days=40)) == expected
+    assert all(one._db is None for one in fresh.calendars)
+    event = fresh.get_datetime_by_time_range(
+        datetime.datetime.combine(today, datetime.time(21)),
+        datetime.datetime.combine(today, datetime.time(23)), occurrences=True)[0]
+    assert event.event.location == u'B\xfcro'
+    assert event.color == ''
+
+
+def test_snapshot_outdated(tmpdir, dbpath):
+    coll = collection(tmpdir, dbpath)
+    fill(coll)
+    first = coll._fresh_snapshot()
+    assert first is not None
+    assert coll._fresh_snapshot() is first
+
+    write(coll, 'home', 'new', dtstamp(today, 15), dtstamp(today, 16), '')
+    coll._calnames['home'].db_update()
+    assert first.version != snapshot.db_version(dbpath)
+    summaries = [event.summary for event in coll.get_datetime_by_time_range(
+        datetime.datetime.combine(today, datetime.time.min),
+        datetime.datetime.combine(today, datetime.time.max), occurrences=True)]
+    assert summaries == ['daily', 'new', 'overnight']
+    assert coll._snapshot is not first
+    assert coll._snapshot.version == snapshot.db_version(dbpath)
+
+
+def test_snapshot_not_covered(tmpdir, dbpath):
+    coll = collection(tmpdir, dbpath)
+    fill(coll)
+    current = coll._fresh_snapshot()
+    assert current.get_allday_range(today) is not None
+    past = today - datetime.timedelta(days=snapshot.PAST_DAYS + 1)
+    assert current.get_allday_range(past) is None
+    start = datetime.datetime.combine(past, datetime.time.min)
+    assert current.get_time_range(start, start + datetime.timedelta(days=60)) is None
+    # those are read from the db instead
+    assert len(coll.get_datetime_by_time_range(
+        start, start + datetime.timedelta(days=60), occurrences=True)) == 31
+
+
+def test_snapshot_selection(tmpdir, dbpath):
+    """a collection of some calendars only reads the snapshot of all of
+    them, but never writes it"""
+    fill(collection(tmpdir, dbpath))
+    first, last = today - datetime.timedelta(days=2), today + datetime.timedelta(days=40)
+    work = collection(tmpdir, dbpath, names=['work'])
+    assert work.update_snapshot() is None
+    assert not os.path.exists(snapshot.snapshot_path(dbpath))
+    expected = occurrences(collection(tmpdir, dbpath, use_snapshot=False,
+                                      names=['work']), first, last)
+    assert occurrences(work, first, last) == expected
+
+    full = collection(tmpdir, dbpath)
+    occurrences(full, first, last)
+    written = os.stat(snapshot.snapshot_path(dbpath))
+    work = collection(tmpdir, dbpath, sync=False, names=['work'])
+    assert occurrences(work, first, last) == expected
+    assert all(one._db is None for one in work.calendars)
+
+    # once the db has changed, the outdated snapshot is left alone
+    write(full, 'work', 'new', dtstamp(today, 15), dtstamp(today, 16), '')
+    full._calnames['work'].db_update()
+    work = collection(tmpdir, dbpath, sync=False, names=['work'])
+    assert 'new' in [one[1] for one in occurrences(work, first, last)[1]]
+    current = os.stat(snapshot.snapshot_path(dbpath))
+    assert (current.st_ino, current.st_mtime) == (written.st_ino, written.st_mtime)
+
+
+def test_load_broken(tmpdir, dbpath):
+    assert snapshot.load(dbpath) is None
+    with open(snapshot.snapshot_path(dbpath), 'wb') as broken:
+        broken.write(b'khalsnap')
+    assert snapshot.load(dbpath) is None
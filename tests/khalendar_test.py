@@ -12,6 +12,7 @@ from khal import aux
 
 from khal.khalendar import Calendar, CalendarCollection
 from khal.khalendar.event import Event
+from khal.khalendar import backend
 from khal.khalendar.backend import CouldNotCreateDbDir
 import khal.khalendar.exceptions
 
@@ -300,6 +301,8 @@ class TestDbCreation(object):
 
 def test_default_calendar(cal_vdir):
     cal, vdir = cal_vdir
+    # the db is only updated from the vdir before it is read the first time
+    assert len(cal.get_allday_by_time_range(today)) == 0
     event = cal.new_event(event_today)
     vdir.upload(event)
     uid, etag = list(vdir.list())[0]
@@ -354,6 +357,160 @@ def test_only_update_old_event(cal_vdir, monkeypatch):
     END:VEVENT
     """)))
 
+    def get_etag(href):
+        raise AssertionError('etags should be looked up all at once')
+    monkeypatch.setattr(cal._dbtool, 'get_etag', get_etag)
+
     assert cal._db_needs_update()
     cal.db_update()
     assert updated_hrefs == [href_three]
+
+
+def test_parallel_update(tmpdir, monkeypatch):
+    monkeypatch.setattr(khal.khalendar.khalendar, 'PARALLEL_THRESHOLD', 2)
+    cal = Calendar(cal1, ':memory:', str(tmpdir), locale=locale, workers=2)
+    vdir = FilesystemStorage(str(tmpdir), '.ics')
+    for num in range(5):
+        vdir.upload(cal.new_event(dedent("""
+        BEGIN:VEVENT
+        UID:meeting-{0}
+        DTSTART;VALUE=DATE:2014091{0}
+        DTEND;VALUE=DATE:2014091{1}
+        SUMMARY:meeting {0}
+        END:VEVENT
+        """.format(num, num + 1))))
+    vdir.upload(cal.new_event(dedent("""
+    BEGIN:VEVENT
+    UID:broken
+    DTSTART;VALUE=DATE:20140912
+    DTEND;VALUE=DATE:20140911
+    SUMMARY:ends before it starts
+    END:VEVENT
+    """)))
+
+    cal.db_update()
+    assert not cal._db_needs_update()
+    events = cal.get_allday_by_time_range(datetime.date(2014, 9, 10),
+                                          datetime.date(2014, 9, 15))
+    assert sorted(event.summary for event in events) == \
+        ['meeting {}'.format(num) for num in range(5)]
+    assert sorted(href for href, etag in cal._dbtool.list()) == \
+        ['meeting-{}.ics'.format(num) for num in range(5)]
+
+
+def test_edit_in_place(cal_vdir):
+    """editing a file doesn't change the mtime of its directory"""
+    cal, vdir = cal_vdir
+    href, etag = vdir.upload(cal.new_event(event_today))
+    cal.db_update()
+    assert not cal._db_needs_update()
+
+    dir_mtime = os.stat(vdir.path).st_mtime
+    fpath = os.path.join(vdir.path, href)
+    with open(fpath, 'w') as f:
+        f.write(event_today.replace('a meeting', 'another meeting'))
+    os.utime(vdir.path, (dir_mtime, dir_mtime))
+
+    assert cal._db_needs_update()
+    cal.db_update()
+    assert not cal._db_needs_update()
+    assert [event.summary for event in cal.get_allday_by_time_range(today)] == \
+        ['another meeting']
+
+
+def test_file_index_from_etags(cal_vdir, monkeypatch):
+    """a db without file index is not read completely again"""
+    cal, vdir = cal_vdir
+    vdir.upload(cal.new_event(event_today))
+    cal.db_update()
+    cal._dbtool.sql_ex('DELETE FROM files;')
+    assert cal._db_needs_update()
+
+    def _update_vevent(href):
+        raise AssertionError('{} has not changed'.format(href))
+    monkeypatch.setattr(cal, '_update_vevent', _update_vevent)
+    cal.db_update()
+    assert not cal._db_needs_update()
+    assert len(cal.get_allday_by_time_range(today)) == 1
+
+
+def test_lazy_sync(coll_vdirs):
+    """calendars are only synced when they are read from"""
+    coll, vdirs = coll_vdirs
+    for name in example_cals:
+        vdirs[name].upload(Item(event_today))
+    work = coll._calnames[cal2]
+    assert all(one.needs_sync for one in coll.calendars)
+
+    assert len(work.get_allday_by_time_range(today)) == 1
+    assert not work.needs_sync
+    assert coll._calnames[cal1].needs_sync
+
+    assert len(coll.get_allday_by_time_range(today)) == 3
+    assert not any(one.needs_sync for one in coll.calendars)
+    assert not coll._db_needs_update()
+
+
+def test_events_by_days(coll_vdirs):
+    """fetching whole ranges of days finds the same events as querying each
+    day on its own"""
+    coll, vdirs = coll_vdirs
+    template = (u'BEGIN:VEVENT\nUID:{0}\nSUMMARY:{0}\n'
+                u'DTSTART{1}\nDTEND{2}\nEND:VEVENT')
+    vdirs[cal1].upload(Item(template.format(
+        'overnight', ';TZID=Europe/Berlin:20140409T220000',
+        ';TZID=Europe/Berlin:20140410T020000')))
+    vdirs[cal1].upload(Item(template.format(
+        'long', ';VALUE=DATE:20140408', ';VALUE=DATE:20140412')))
+    vdirs[cal2].upload(Item(template.format(
+        'daily', ';TZID=Europe/Berlin:20140409T093000',
+        ';TZID=Europe/Berlin:20140409T103000\nRRULE:FREQ=DAILY;COUNT=20')))
+    vdirs[cal2].upload(Item(template.format(
+        'midnight', ';VALUE=DATE-TIME:20140410T220000Z',
+        ';VALUE=DATE-TIME:20140410T230000Z')))
+
+    days = [datetime.date(2014, 4, 9), datetime.date(2014, 4, 10),
+            datetime.date(2014, 4, 11), datetime.date(2014, 4, 11),
+            datetime.date(2014, 4, 20), datetime.date(2014, 4, 7)]
+    result = coll.get_events_by_days(days)
+    assert [day for day, _, _ in result] == days
+    for day, allday, events in result:
+        start = datetime.datetime.combine(day, datetime.time.min)
+        end = datetime.datetime.combine(day, datetime.time.max)
+        assert sorted(event.summary for event in allday) == \
+            sorted(event.summary for event in coll.get_allday_by_time_range(day))
+        expected = coll.get_datetime_by_time_range(start, end)
+        expected.sort(key=lambda event: event.start)
+        assert [(event.summary, event.start) for event in events] == \
+            [(event.summary, event.start) for event in expected]
+    assert [event.summary for event in result[1][1]] == ['long']
+    assert [event.summary for event in result[4][2]] == ['daily']
+    assert result[5][1:] == ([], [])
+
+
+def test_collection_one_query(tmpdir):
+    """calendars sharing a db are queried together, the events come out
+    ordered by their start"""
+    dbpath = str(tmpdir.join('khal.db'))
+    coll = CalendarCollection()
+    vdirs = dict()
+    for name, color in [(cal1, 'dark blue'), (cal2, 'dark red')]:
+        path = str(tmpdir.mkdir(name))
+        coll.append(Calendar(name, dbpath, path, color=color, locale=locale))
+        vdirs[name] = FilesystemStorage(path, '.ics')
+    assert len(coll._db_groups()) == 1
+    template = (u'BEGIN:VEVENT\nUID:{0}\nSUMMARY:meeting {0}\n'
+                u'DTSTART;TZID=Europe/Berlin:20140409T{1:02d}0000\n'
+                u'DTEND;TZID=Europe/Berlin:20140409T{1:02d}3000\nEND:VEVENT')
+    for uid, hour, name in [('a', 11, cal1), ('b', 9, cal2), ('c', 10, cal1),
+                            ('d', 12, cal2)]:
+        vdirs[name].upload(Item(template.format(uid, hour)))
+
+    events = coll.get_datetime_by_time_range(TestCollection.astart,
+                                             TestCollection.aend)
+    assert [(event.summary, event.calendar, event.color) for event in events] == [
+        ('meeting b', cal2, 'dark red'), ('meeting c', cal1, 'dark blue'),
+        ('meeting a', cal1, 'dark blue'), ('meeting d', cal2, 'dark red')]
+    found = coll.search('meeting', start=aday, end=bday, limit=3)
+    assert [event.summary for event in found] == ['meeting b', 'meeting c', 'meeting a']
+    backend.disconnect(dbpath)
@@ -0,0 +1,137 @@
+import datetime
+import os
+import shutil
+
+import pytest
+import pytz
+
+from khal.khalendar import Calendar, CalendarCollection
+from khal.khalendar import watch
+
+berlin = pytz.timezone('Europe/Berlin')
+locale = {'default_timezone': berlin, 'local_timezone': berlin}
+
+event = u"""BEGIN:VEVENT
+UID:{0}
+DTSTART;VALUE=DATE:20140909
+DTEND;VALUE=DATE:20140910
+SUMMARY:{1}
+END:VEVENT"""
+
+day = datetime.date(2014, 9, 9)
+
+
+@pytest.fixture
+def collection(tmpdir):
+    coll = CalendarCollection()
+    for name in ['home', 'work']:
+        path = str(tmpdir.mkdir(name))
+        coll.append(Calendar(name, ':memory:', path, locale=locale))
+    return coll
+
+
+def summaries(coll):
+    return sorted(event.summary for event in coll.get_allday_by_time_range(day))
+
+
+def write(coll, calendar, uid, summary):
+    path = os.path.join(coll._calnames[calendar].path, uid + '.ics')
+    with open(path, 'w') as ics:
+        ics.write(event.format(uid, summary))
+    return path
+
+
+def test_inotify(collection, tmpdir):
+    dbpath = str(tmpdir.join('khal.db'))
+    try:
+        watcher = watch.Watcher(collection, dbpath, debounce=0.01)
+    except OSError:
+        pytest.skip('inotify is not available')
+    if watcher._inotify is None:
+        pytest.skip('inotify is not available')
+    watcher.update_all()
+    assert watch.is_current(dbpath)
+
+    write(collection, 'home', 'one', 'first')
+    path = write(collection, 'work', 'two', 'second')
+    watcher.wait(timeout=1)
+    assert summaries(collection) == ['first', 'second']
+    assert not collection._db_needs_update()
+
+    # edits in place
+    with open(path, 'w') as ics:
+        ics.write(event.format('two', 'changed'))
+    watcher.wait(timeout=1)
+    assert summaries(collection) == ['changed', 'first']
+
+    os.remove(path)
+    watcher.wait(timeout=1)
+    assert summaries(collection) == ['first']
+    assert watch.is_current(dbpath)
+
+    watcher.close()
+    assert not watch.is_current(dbpath)
+
+
+def test_inotify_recreated(collection, tmpdir):
+    """a calendar's directory is watched again after it has been deleted and
+    created again"""
+    dbpath = str(tmpdir.join('khal.db'))
+    try:
+        watcher = watch.Watcher(collection, dbpath, debounce=0.01,
+                                poll_interval=0.05)
+    except OSError:
+        pytest.skip('inotify is not available')
+    if watcher._inotify is None:
+        pytest.skip('inotify is not available')
+    watcher.update_all()
+    write(collection, 'home', 'one', 'first')
+    watcher.wait(timeout=1)
+    assert summaries(collection) == ['first']
+
+    path = collection._calnames['home'].path
+    shutil.rmtree(path)
+    watcher.wait(timeout=1)
+    assert not watch.is_current(dbpath)
+
+    os.mkdir(path)
+    watcher.wait(timeout=1)
+    assert summaries(collection) == []
+    assert watch.is_current(dbpath)
+    write(collection, 'home', 'two', 'second')
+    watcher.wait(timeout=1)
+    assert summaries(collection) == ['second']
+    assert watch.is_current(dbpath)
+
+    # the same goes for a directory moved away and replaced by another one
+    os.rename(path, path + '.old')
+    os.mkdir(path)
+    watcher.wait(timeout=1)
+    write(collection, 'home', 'three', 'third')
+    watcher.wait(timeout=1)
+    assert summaries(collection) == ['third']
+    assert watch.is_current(dbpath)
+    watcher.close()
+
+
+def test_polling(collection, tmpdir):
+    dbpath = str(tmpdir.join('khal.db'))
+    watcher = watch.Watcher(collection, dbpath, use_inotify=False)
+    watcher.update_all()
+    write(collection, 'home', 'one', 'first')
+    watcher.poll()
+    assert summaries(collection) == ['first']
+    # changes between two polls are not noticed right away
+    assert not watch.is_current(dbpath)
+    watcher.close()
+
+
+def test_is_current(tmpdir):
+    dbpath = str(tmpdir.join('khal.db'))
+    assert not watch.is_current(dbpath)
+    with open(watch.status_path(dbpath), 'w') as status:
+        status.write('{"pid": %d, "current": true}' % os.getpid())
+    assert watch.is_current(dbpath)
+    with open(watch.status_path(dbpath), 'w') as status:
+        status.write('{"pid": %d, "current": false}' % os.getpid())
+    assert not watch.is_current(dbpath)
@@ -22,7 +22,9 @@ class TestSettings(object):
                 'work': {'path': os.path.expanduser('~/.calendars/work/'),
                          'readonly': False, 'color': ''},
             },
-            'sqlite': {'path': os.path.expanduser('~/.local/share/khal/khal.db')},
+            'sqlite': {'path': os.path.expanduser('~/.local/share/khal/khal.db'),
+                       'expansion_horizon': 365, 'workers': 0,
+                       'snapshot': False},
             'locale': {
                 'local_timezone': pytz.timezone('Europe/Berlin'),
                 'default_timezone': pytz.timezone('Europe/Berlin'),
@@ -58,7 +60,9 @@ class TestSettings(object):
                          'color': 'dark green', 'readonly': False},
                 'work': {'path': os.path.expanduser('~/.calendars/work/'),
                          'readonly': True, 'color': ''}},
-            'sqlite': {'path': os.path.expanduser('~/.local/share/khal/khal.db')},
+            'sqlite': {'path': os.path.expanduser('~/.local/share/khal/khal.db'),
+                       'expansion_horizon': 365, 'workers': 0,
+                       'snapshot': False},
             'locale': {
                 'local_timezone': get_localzone(),
                 'default_timezone': get_localzone(),
@@ -117,3 +121,25 @@ foo = bar
             conf.write(config)
         get_config(conf_path)
         # FIXME test for log entries
+
+    def test_cache(self, tmpdir, monkeypatch, config_cache):
+        from khal.settings import settings
+        conf_path = str(tmpdir.join('khal.conf'))
+        with open(PATH + 'simple.conf') as simple, open(conf_path, 'w') as conf:
+            conf.write(simple.read())
+        config = get_config(conf_path)
+        assert os.path.exists(config_cache)
+
+        def fail(*args, **kwargs):
+            raise AssertionError('config was parsed again')
+        monkeypatch.setattr(settings, '_read_config', fail)
+        cached = get_config(conf_path)
+        assert cached == config
+        assert cached['locale']['local_timezone'] is pytz.timezone('Europe/Berlin')
+        assert list(cached['calendars']) == ['home', 'work']
+
+        # the cache is only used for unchanged config files
+        with open(conf_path, 'a') as conf:
+            conf.write('\n')
+        with pytest.raises(AssertionError):
+            get_config(conf_path)
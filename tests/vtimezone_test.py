@@ -1,6 +1,6 @@
 from datetime import datetime as datetime
 import pytz
-from khal.khalendar.event import create_timezone
+from khal.khalendar.event import create_timezone, _transition_window
 
 berlin = pytz.timezone('Europe/Berlin')
 bogota = pytz.timezone('America/Bogota')
@@ -73,3 +73,25 @@ def test_bogota():
                b'END:VTIMEZONE',
                b'']
     assert create_timezone(bogota, atime, atime).to_ical().split(b'\r\n') == vbogota
+
+
+def test_cache():
+    """the same VTIMEZONE is only generated once, as long as the events are
+    between the same transition times"""
+    vberlin = create_timezone(berlin, atime, atime)
+    assert create_timezone(berlin, atime, atime) is vberlin
+    assert create_timezone(berlin.localize(atime).tzinfo,
+                           datetime(2014, 11, 5), datetime(2014, 12, 1)) is vberlin
+    assert create_timezone(berlin, atime, btime) is not vberlin
+    assert create_timezone(bogota, atime, atime) is not vberlin
+
+
+def test_transition_window():
+    """the last transition before the first date and the first one after the
+    last date are included"""
+    times = [datetime(1, 1, 1), datetime(2014, 3, 30), datetime(2014, 10, 26),
+             datetime(2015, 3, 29), datetime(2015, 10, 25)]
+    assert _transition_window(times, atime, atime) == (2, 3)
+    assert _transition_window(times, datetime(2014, 10, 26), atime) == (1, 3)
+    assert _transition_window(times, datetime(2000, 1, 1), btime) == (0, 4)
+    assert _transition_window(times, btime, btime) == (4, 4)